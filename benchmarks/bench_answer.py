@@ -0,0 +1,71 @@
+"""
+Benchmark for answering received messages.
+
+Compares parsing all parameters into a dict and encoding every parameter of the answer from
+scratch, as done before parameters were decoded lazily and tracked, against the delta encoding of yate.protocol.Message.encode_answer_for_yate, which copies
+unmodified parameters from the received line, or encodes small messages again in C. Run with:
+
+    python -m benchmarks.bench_answer
+"""
+import timeit
+
+from yate import protocol
+
+
+def parse_eager(line):
+    return protocol.Message.parse(protocol.yate_decode_split(line))
+
+
+def encode_from_scratch(msg):
+    return protocol.yate_encode_join("%<message", msg.id, "true", msg.name, msg.return_value,
+                                     *["=".join(item) for item in msg.params.items()])
+
+
+def build_message(param_count):
+    params = {"id": "sip/1234", "caller": "9940", "called": "2049", "address": "172.20.23.1:5060"}
+    for i in range(param_count):
+        params["osip_X-Header-{}".format(i)] = "value-{}".format(i)
+    msg = protocol.MessageRequest("call.route", params)
+    return msg.encode("0x7ff823883bb0.1932044751", 1522601502)
+
+
+def unmodified(msg):
+    pass
+
+
+def set_return_value(msg):
+    msg.return_value = "sip/sip:2049@172.20.1.3"
+
+
+def set_one_param(msg):
+    msg.return_value = "sip/sip:2049@172.20.1.3"
+    msg.params["osip_X-Route"] = "yes"
+    msg.params["called"] = "2050"
+
+
+def bench(label, parse, encode, modify, line, number):
+    def run():
+        msg = parse(line)
+        modify(msg)
+        encode(msg)
+
+    seconds = timeit.timeit(run, number=number)
+    print("  {:<32} {:10.2f} us/msg".format(label, seconds / number * 1e6))
+    return seconds
+
+
+def main():
+    for param_count in (5, 30, 100, 500):
+        line = build_message(param_count)
+        number = max(100, 100000 // param_count)
+        print("{} params, {} bytes".format(param_count, len(line)))
+        for modify in (unmodified, set_return_value, set_one_param):
+            scratch = bench("from scratch, " + modify.__name__, parse_eager, encode_from_scratch, modify,
+                            line, number)
+            delta = bench("delta, " + modify.__name__, protocol.parse_yate_message,
+                          lambda msg: msg.encode_answer_for_yate(True), modify, line, number)
+            print("  speedup {:>35.1f}x".format(scratch / delta))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark for waiting on channel events with many concurrent IVR calls.
+
+Every call waits for its next channel event in a loop, with a timeout like IVR applications use. In every round
+all calls are notified of the end of their playback, the round ends when every call received its event. Compares
+the per call ChannelEventQueue with waiting on two asyncio.Event tasks for DTMF and the end of playback (as
+wait_channel_event did before). Run with:
+
+    python -m benchmarks.bench_channel_events
+"""
+import asyncio
+import time
+
+from yate import protocol
+from yate.ivr import IVRCallMixin, ChannelEventType
+
+ROUNDS = 20
+WAIT_TIMEOUT_S = 30
+
+EOF_NOTIFY = protocol.Message("bench.1", None, "chan.notify", "", {"reason": "eof"})
+
+
+class QueueCall(IVRCallMixin):
+    def __init__(self):
+        self._init_call()
+
+
+class EventsCall(IVRCallMixin):
+    def __init__(self):
+        self._init_call()
+        self.dtmf_event = asyncio.Event()
+        self.playback_end_event = asyncio.Event()
+
+    def _chan_notify_handler(self, msg):
+        self.playback_end_event.set()
+        return True
+
+    async def wait_channel_event(self, timeout_s=None):
+        dtmf_waiter = asyncio.create_task(self.dtmf_event.wait())
+        play_waiter = asyncio.create_task(self.playback_end_event.wait())
+        done, pending = await asyncio.wait([dtmf_waiter, play_waiter], timeout=timeout_s,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for t in pending:
+            t.cancel()
+        if dtmf_waiter in done:
+            return ChannelEventType.DTMF
+        elif play_waiter in done:
+            self.playback_end_event.clear()
+            return ChannelEventType.PLAYBACK_END
+        return None
+
+
+async def drive(call_class, call_count):
+    loop = asyncio.get_running_loop()
+    calls = [call_class() for _ in range(call_count)]
+    round_done = None
+    waiting = 0
+
+    async def wait_events(call):
+        nonlocal waiting
+        for _ in range(ROUNDS):
+            event_type = await call.wait_channel_event(WAIT_TIMEOUT_S)
+            assert event_type == ChannelEventType.PLAYBACK_END, event_type
+            waiting -= 1
+            if not waiting:
+                round_done.set_result(None)
+
+    tasks = [asyncio.create_task(wait_events(call)) for call in calls]
+    # let every call start waiting
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        round_done = loop.create_future()
+        waiting = call_count
+        for call in calls:
+            call._chan_notify_handler(EOF_NOTIFY)
+        await round_done
+    seconds = time.perf_counter() - start
+    await asyncio.gather(*tasks)
+    return seconds
+
+
+def main():
+    print("{:>6} {:<12} {:>12} {:>16}".format("calls", "wait", "events/s", "us per event"))
+    for call_count in (100, 1000, 10000):
+        for label, call_class in (("queue", QueueCall), ("two tasks", EventsCall)):
+            seconds = asyncio.run(drive(call_class, call_count))
+            events = call_count * ROUNDS
+            print("{:>6} {:<12} {:12.0f} {:16.2f}".format(call_count, label, events / seconds,
+                                                          seconds / events * 1e6))
+
+
+if __name__ == "__main__":
+    main()
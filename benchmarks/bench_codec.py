@@ -0,0 +1,88 @@
+"""
+Throughput benchmark for the yate wire codec.
+
+Compares the table driven codec in yate.protocol (and the C accelerator, if it is built)
+against the previous byte-by-byte implementation on message lines of realistic size. Run with:
+
+    python -m benchmarks.bench_codec
+"""
+import timeit
+
+from yate import protocol
+
+
+def legacy_yate_decode_bytes(byte_input: bytes):
+    output = b""
+    view = memoryview(byte_input)
+    pos = 0
+    while True:
+        next_percent = byte_input.find(protocol.ORD_PERCENT, pos)
+        if next_percent < 0:
+            return output + view[pos:]
+        output += view[pos:next_percent]
+        if view[next_percent+1] == protocol.ORD_PERCENT:
+            output += b"%"
+        else:
+            output += (view[next_percent+1]-64).to_bytes(1, "big")
+        pos = next_percent+2
+
+
+def legacy_yate_encode_bytes(byte_input: bytes):
+    output = b""
+    view = memoryview(byte_input)
+    pos = 0
+    for i in range(len(byte_input)):
+        if view[i] < 32 or view[i] == protocol.ORD_COLON:
+            output += view[pos:i]
+            output += b"%" + (view[i]+64).to_bytes(1, "big")
+            pos = i+1
+        elif view[i] == protocol.ORD_PERCENT:
+            output += view[pos:i]
+            output += b"%%"
+            pos = i+1
+    output += view[pos:]
+    return output
+
+
+def build_message(param_count):
+    params = {"id": "sip/1234", "caller": "9940", "called": "2049"}
+    for i in range(param_count):
+        params["osip_X-Header-{}".format(i)] = "sip:{}@172.20.23.2:5060;tag=%{}".format(i, i)
+    msg = protocol.MessageRequest("call.route", params)
+    return msg.encode("0x7ff823883bb0.1932044751", 1522601502)
+
+
+def bench(label, func, data, number):
+    seconds = timeit.timeit(lambda: func(data), number=number)
+    mb_per_s = len(data) * number / seconds / 1e6
+    print("  {:<8} {:10.1f} us/op {:10.1f} MB/s".format(label, seconds / number * 1e6, mb_per_s))
+    return seconds
+
+
+def main():
+    for param_count in (10, 100, 500, 2000):
+        encoded = build_message(param_count)
+        decoded = protocol.yate_decode_bytes(encoded)
+        assert legacy_yate_decode_bytes(encoded) == decoded
+        assert legacy_yate_encode_bytes(decoded) == protocol.yate_encode_bytes(decoded)
+        number = max(10, 20000 // param_count)
+
+        print("{} params, {} bytes on the wire".format(param_count, len(encoded)))
+        print(" decode")
+        legacy = bench("legacy", legacy_yate_decode_bytes, encoded, number)
+        current = bench("python", protocol._pure_python_codec["yate_decode_bytes"], encoded, number)
+        print("  speedup  {:10.1f}x".format(legacy / current))
+        if protocol.HAS_SPEEDUPS:
+            current = bench("C", protocol.yate_decode_bytes, encoded, number)
+            print("  speedup  {:10.1f}x".format(legacy / current))
+        print(" encode")
+        legacy = bench("legacy", legacy_yate_encode_bytes, decoded, number)
+        current = bench("python", protocol._pure_python_codec["yate_encode_bytes"], decoded, number)
+        print("  speedup  {:10.1f}x".format(legacy / current))
+        if protocol.HAS_SPEEDUPS:
+            current = bench("C", protocol.yate_encode_bytes, decoded, number)
+            print("  speedup  {:10.1f}x".format(legacy / current))
+
+
+if __name__ == "__main__":
+    main()
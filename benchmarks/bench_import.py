@@ -0,0 +1,59 @@
+"""
+Import-time benchmark for the modules IVR scripts and tools load on startup.
+
+Runs a fresh interpreter with python -X importtime for every module, like yate starting an IVR script for a
+call, and reports the median cumulative import time of the module, the number of modules it loads on top of
+the interpreter startup and the imports that cost the most. Run with:
+
+    python -m benchmarks.bench_import
+"""
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+MODULES = ["yate.protocol", "yate.yate", "yate.asyncio", "yate.ivr", "yate.callgen"]
+RUNS = 15
+TOP = 5
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter and return the self and cumulative import times in microseconds of
+    every module it loaded.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            stderr=subprocess.PIPE, check=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.partition(":")[2].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def main():
+    # the interpreter has to find the yate package of this tree
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))
+    startup = set(import_times("sys"))
+    for module in MODULES:
+        cumulative = []
+        self_times = defaultdict(list)
+        for _ in range(RUNS):
+            times = import_times(module)
+            cumulative.append(times[module][1])
+            for name, (self_us, _cumulative_us) in times.items():
+                if name not in startup:
+                    self_times[name].append(self_us)
+        print("{:<16} {:8.1f} ms {:5d} modules".format(
+            module, statistics.median(cumulative) / 1e3, len(self_times)))
+        costly = sorted(self_times, key=lambda name: statistics.median(self_times[name]), reverse=True)
+        for name in costly[:TOP]:
+            print("  {:<30} {:8.2f} ms".format(name, statistics.median(self_times[name]) / 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Load test for serving many IVR calls over a single connection with YateIVRServer.
+
+A stand-in for yate runs in a separate process and drives thousands of simulated calls with a number of them
+active at the same time. For every call it sends call.execute to the server, notifies it that the call was
+connected to a dumb channel, waits for the prompt the server plays with chan.masquerade, reports the end of
+the playback with chan.notify and waits for the call.drop of the server. It measures the calls per second
+and the setup latency from sending call.execute to receiving the prompt. Run with:
+
+    python -m benchmarks.bench_ivr_server
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from yate import protocol
+from yate.ivr import YateIVRServer
+
+CALL_COUNT = 5000
+
+
+class StandInYate:
+    def __init__(self, call_count, concurrency):
+        self.call_count = call_count
+        self.concurrency = concurrency
+        self.writer = None
+        self.registrations = 0
+        self.ready = None
+        self.pending = {}
+        self.prompts = {}
+        self.drops = {}
+        self.latencies = []
+        self._msg_id = 0
+
+    def send(self, name, params):
+        self._msg_id += 1
+        msg_id = "bench.{}".format(self._msg_id)
+        self.pending[msg_id] = answer = asyncio.get_running_loop().create_future()
+        self.writer.write(protocol.MessageRequest(name, params).encode(msg_id, 1522601502) + b"\n")
+        return answer
+
+    def notify(self, name, params):
+        self._msg_id += 1
+        msg = protocol.Message("bench.{}".format(self._msg_id), None, name, "", params, reply=True)
+        self.writer.write(msg.encode_answer_for_yate(True) + b"\n")
+
+    def process_line(self, line):
+        if line.startswith(b"%%>connect:"):
+            return
+        msg = protocol.parse_yate_message(line)
+        if isinstance(msg, protocol.InstallRequest):
+            self.writer.write(protocol.InstallConfirm(msg.priority, msg.name, True).encode() + b"\n")
+        elif isinstance(msg, protocol.WatchRequest):
+            self.writer.write(protocol.WatchConfirm(msg.name, True).encode() + b"\n")
+        elif isinstance(msg, protocol.Message) and msg.reply:
+            self.pending.pop(msg.id).set_result(msg)
+            return
+        elif isinstance(msg, protocol.Message):
+            waiting = self.prompts if msg.name == "chan.masquerade" else self.drops
+            waiting.pop(msg.params["id"]).set_result(None)
+            self.writer.write(msg.encode_answer_for_yate(True) + b"\n")
+            return
+        else:
+            return
+        self.registrations += 1
+        if self.registrations == 5:
+            self.ready.set_result(None)
+
+    async def call(self, i):
+        loop = asyncio.get_running_loop()
+        call_id, channel_id = "sip/{}".format(i), "dumb/{}".format(i)
+        prompt = self.prompts[channel_id] = loop.create_future()
+        drop = self.drops[channel_id] = loop.create_future()
+        start = time.perf_counter()
+        await self.send("call.execute", {"id": call_id, "callto": "ivr/bench"})
+        self.notify("call.execute", {"id": call_id, "callto": "dumb/", "peerid": channel_id})
+        await prompt
+        self.latencies.append(time.perf_counter() - start)
+        await self.send("chan.notify", {"targetid": call_id, "reason": "eof"})
+        await drop
+        self.notify("chan.hangup", {"id": call_id})
+
+    async def drive(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited_call(i):
+            async with semaphore:
+                await self.call(i)
+
+        await self.ready
+        start = time.perf_counter()
+        await asyncio.gather(*(limited_call(i) for i in range(self.call_count)))
+        return time.perf_counter() - start
+
+    async def handle(self, reader, writer):
+        self.writer = writer
+        self.ready = asyncio.get_running_loop().create_future()
+        reading = asyncio.create_task(self.read(reader))
+        try:
+            return await self.drive()
+        finally:
+            reading.cancel()
+
+    async def read(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self.process_line(line.strip())
+
+
+def stand_in_server(sockpath, call_count, concurrency, ready, results):
+    async def serve():
+        stand_in = StandInYate(call_count, concurrency)
+        finished = asyncio.get_running_loop().create_future()
+
+        async def handle(reader, writer):
+            seconds = await stand_in.handle(reader, writer)
+            writer.close()
+            finished.set_result(seconds)
+
+        server = await asyncio.start_unix_server(handle, sockpath)
+        ready.set()
+        seconds = await finished
+        server.close()
+        results.put((seconds, stand_in.latencies))
+
+    asyncio.run(serve())
+
+
+async def prompt_call(session):
+    await session.play_soundfile("/var/opt/prompt.slin", complete=True)
+
+
+def main():
+    for concurrency in (10, 100, 1000):
+        with tempfile.TemporaryDirectory() as directory:
+            sockpath = os.path.join(directory, "yate.sock")
+            ready = multiprocessing.Event()
+            results = multiprocessing.Queue()
+            stand_in = multiprocessing.Process(target=stand_in_server,
+                                               args=(sockpath, CALL_COUNT, concurrency, ready, results))
+            stand_in.start()
+            ready.wait()
+            ivr_server = YateIVRServer(sockpath=sockpath)
+            ivr_server.set_termination_handler(lambda: ivr_server.main_task.cancel())
+            ivr_server.run(prompt_call)
+            seconds, latencies = results.get()
+            stand_in.join()
+            latencies.sort()
+            print("{} concurrent calls".format(concurrency))
+            print("  {:<20} {:10.0f} calls/s".format("throughput", CALL_COUNT / seconds))
+            print("  {:<20} {:10.2f} ms".format("median setup", statistics.median(latencies) * 1e3))
+            print("  {:<20} {:10.2f} ms".format("p99 setup", latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+if __name__ == "__main__":
+    main()
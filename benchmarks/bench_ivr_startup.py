@@ -0,0 +1,93 @@
+"""
+Benchmark for the startup latency of IVR calls in stdio mode.
+
+Measures the time from executing the module for a call, like yate does, to reading the answer to call.execute,
+which yate sends right after starting the module. The module is either an IVR script started from scratch or
+the launcher of yate.ivrlaunch passing the call to a warm IVRProcessPool. Run with:
+
+    python -m benchmarks.bench_ivr_startup
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from yate import ivrlaunch, protocol
+from yate.ivrpool import IVRProcessPool
+
+CALL_COUNT = 50
+
+IVR_SCRIPT = """
+from yate.ivr import YateIVR
+
+
+async def main(ivr):
+    pass
+
+
+YateIVR().run(main)
+"""
+
+
+async def end_call(ivr):
+    pass
+
+
+def run_call(command):
+    module_stdin, writer = os.pipe()
+    reader, module_stdout = os.pipe()
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdin=module_stdin, stdout=module_stdout)
+    os.close(module_stdin)
+    os.close(module_stdout)
+    with os.fdopen(reader, "rb") as lines:
+        os.write(writer, protocol.MessageRequest("call.execute", {"id": "sip/1"}).encode("bench.1", 1522601502)
+                 + b"\n")
+        answer = protocol.parse_yate_message(lines.readline().strip())
+        seconds = time.perf_counter() - start
+        assert answer.processed, answer
+        # let the IVR end the call
+        for _ in range(2):
+            install = protocol.parse_yate_message(lines.readline().strip())
+            os.write(writer, protocol.InstallConfirm(install.priority, install.name, True).encode() + b"\n")
+        lines.read()
+    os.close(writer)
+    process.wait()
+    return seconds
+
+
+def report(label, command, pool):
+    latencies = []
+    for _ in range(CALL_COUNT):
+        # replace the worker of the previous call, which the pool does in the background when running
+        pool.supervise(0)
+        latencies.append(run_call(command))
+    latencies.sort()
+    print("  {:<20} {:10.1f} ms median {:10.1f} ms p90".format(
+        label, statistics.median(latencies) * 1e3, latencies[int(len(latencies) * 0.9)] * 1e3))
+
+
+def main():
+    # the modules have to find the yate package like yate would
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, "ivr.py")
+        with open(script, "w") as f:
+            f.write(IVR_SCRIPT)
+        sockpath = os.path.join(directory, "ivr.sock")
+        pool = IVRProcessPool(end_call, sockpath, pool_size=4)
+        pool.start()
+        try:
+            print("exec to call.execute answer")
+            report("script per call", [sys.executable, script], pool)
+            report("pool launcher", [sys.executable, "-m", "yate.ivrlaunch", sockpath], pool)
+            # without site and runpy the launcher only pays for the startup of the interpreter
+            report("pool launcher -S", [sys.executable, "-S", ivrlaunch.__file__, sockpath], pool)
+        finally:
+            pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Memory benchmark for the message and handler records.
+
+Measures the footprint of the __slots__ based classes against equivalent classes with a per
+instance __dict__ (as they were before), both per object and for 10k pending requests in
+YateBase._requested_messages. Run with:
+
+    python -m benchmarks.bench_memory
+"""
+import tracemalloc
+from unittest.mock import patch
+
+from yate import protocol, yate
+
+COUNT = 10000
+
+
+def with_dict(cls):
+    # a subclass without __slots__ gets a __dict__ again, just like the classes had before
+    return type(cls.__name__, (cls,), {})
+
+
+def measure(factory, count=COUNT):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return size
+
+
+FACTORIES = {
+    protocol.Message: lambda cls, i: cls("id.{}".format(i), 4711, "chan.notify", "", protocol.MessageParams()),
+    protocol.MessageRequest: lambda cls, i: cls("call.execute", {}),
+    protocol.InstallRequest: lambda cls, i: cls(100, "chan.notify", "targetid", i),
+    yate.MessageHandler: lambda cls, i: cls("chan.notify", 100, print, "targetid", i),
+    yate.WatchHandler: lambda cls, i: cls("chan.notify", print),
+    yate.MessageRequest: lambda cls, i: cls(None, "id.{}".format(i), 4711, print),
+}
+
+
+def pending_requests():
+    y = yate.YateBase()
+    y._get_timestamp = lambda: 4711
+    msg = protocol.MessageRequest("chan.attach", {"source": "wave/play/test.slin"})
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(COUNT):
+        y.send_message(protocol.MessageRequest("chan.attach", msg.params), print)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+
+def main():
+    print("per object footprint (bytes, averaged over {} objects)".format(COUNT))
+    for cls, factory in FACTORIES.items():
+        legacy_cls = with_dict(cls)
+        legacy = measure(lambda i: factory(legacy_cls, i)) / COUNT
+        slotted = measure(lambda i: factory(cls, i)) / COUNT
+        print("  {:<30} {:8.1f} -> {:8.1f}".format(cls.__module__ + "." + cls.__qualname__, legacy, slotted))
+
+    with patch.object(yate, "MessageRequest", with_dict(yate.MessageRequest)), \
+            patch.object(protocol, "MessageRequest", with_dict(protocol.MessageRequest)):
+        legacy = pending_requests()
+    slotted = pending_requests()
+    print("{} pending requests (KiB): {:8.1f} -> {:8.1f}".format(COUNT, legacy / 1024, slotted / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Microbenchmark for parsing incoming %>message lines.
+
+Compares yate.protocol.parse_yate_message against the previous two step path (yate_decode_split
+followed by Message.parse / yate_parse_keyvalue). As the python codec decodes parameters lazily, the
+parser is also measured with a handler reading three parameters. Both paths are measured with the
+pure python codec and, if it is built, with the C accelerator. Run with:
+
+    python -m benchmarks.bench_parser
+"""
+import timeit
+from unittest.mock import patch
+
+from yate import protocol
+
+
+def two_pass_parse(line):
+    split_msg = protocol.yate_decode_split(line)
+    return protocol.Message.parse(split_msg)
+
+
+def parse_and_read(line):
+    msg = protocol.parse_yate_message(line)
+    return msg.params["id"], msg.params["caller"], msg.params["called"]
+
+
+def build_message(param_count):
+    params = {"id": "sip/1234", "caller": "9940", "called": "2049", "address": "172.20.23.1:5060"}
+    for i in range(param_count):
+        params["osip_X-Header-{}".format(i)] = "value-{}".format(i)
+    msg = protocol.MessageRequest("call.route", params)
+    return msg.encode("0x7ff823883bb0.1932044751", 1522601502)
+
+
+def bench(label, func, data, number):
+    seconds = timeit.timeit(lambda: func(data), number=number)
+    print("  {:<22} {:10.2f} us/msg".format(label, seconds / number * 1e6))
+    return seconds
+
+
+def run(label, line, number):
+    two_pass = bench("two pass ({})".format(label), two_pass_parse, line, number)
+    single_pass = bench("single pass ({})".format(label), protocol.parse_yate_message, line, number)
+    print("  speedup {:>25.1f}x".format(two_pass / single_pass))
+    single_pass = bench("+ read 3 params ({})".format(label), parse_and_read, line, number)
+    print("  speedup {:>25.1f}x".format(two_pass / single_pass))
+
+
+def main():
+    for param_count in (5, 30, 100, 500):
+        line = build_message(param_count)
+        number = max(100, 100000 // param_count)
+        print("{} params, {} bytes".format(param_count, len(line)))
+        with patch.multiple(protocol, **protocol._pure_python_codec):
+            run("python", line, number)
+        if protocol.HAS_SPEEDUPS:
+            run("C", line, number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark for receiving bursts of lines from yate over a Unix socket.
+
+A stand-in for yate runs in a separate process and sends a burst of chan.notify notifications to every client
+connecting to it. The client measures lines per second, once with the protocol based receive path of YateAsync
+and once with the previous loop awaiting StreamReader.readline() per line. Both are measured with the lines only
+being counted, which shows the cost of splitting the stream into lines, and with every line parsed and passed
+to a watch handler. Run with:
+
+    python -m benchmarks.bench_read
+"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from yate.asyncio import YateAsync
+from yate.protocol import Message
+
+LINE_COUNT = 200000
+
+
+class ReadlineYateAsync(YateAsync):
+    async def setup_for_unix(self, sockpath):
+        self.reader, self.writer = await asyncio.open_unix_connection(sockpath)
+        self.send_connect()
+
+    async def message_processing_loop(self):
+        while True:
+            raw_message = await self.reader.readline()
+            if raw_message == b"":
+                break
+            self._recv_message_raw(raw_message.strip())
+
+
+def build_burst(count):
+    lines = []
+    for i in range(count):
+        msg = Message("0x7ff8.{}".format(i), None, "chan.notify", "",
+                      {"targetid": "sip/{}".format(i % 1000), "reason": "eof"}, reply=True)
+        lines.append(msg.encode_answer_for_yate(True))
+    return b"\n".join(lines) + b"\n"
+
+
+def stand_in_server(sockpath, ready):
+    burst = build_burst(LINE_COUNT)
+
+    async def handle(reader, writer):
+        await reader.readline()
+        writer.write(burst)
+        await writer.drain()
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_unix_server(handle, sockpath)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+async def receive(yate_class, sockpath, dispatch):
+    yate = yate_class(sockpath=sockpath)
+    received = []
+    if not dispatch:
+        yate._recv_message_raw = received.append
+    start = time.perf_counter()
+    await yate.setup_for_unix(sockpath)
+    yate.register_watch_handler("chan.notify", received.append)
+    await yate.message_processing_loop()
+    seconds = time.perf_counter() - start
+    yate.writer.close()
+    return len(received), seconds
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        sockpath = os.path.join(directory, "yate.sock")
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=stand_in_server, args=(sockpath, ready), daemon=True)
+        server.start()
+        ready.wait()
+        try:
+            for dispatch in (False, True):
+                print("lines parsed and dispatched" if dispatch else "lines counted")
+                for label, yate_class in (("readline per line", ReadlineYateAsync), ("stream protocol", YateAsync)):
+                    received, seconds = asyncio.run(receive(yate_class, sockpath, dispatch))
+                    assert received == LINE_COUNT, received
+                    print("  {:<20} {:10.0f} lines/s".format(label, received / seconds))
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark for dispatching notifications to per-channel callbacks.
+
+Tracks a growing number of channels, each with its own callback, and measures the cost of passing an incoming
+chan.hangup line to the callback of its channel. Channels are tracked either with a MessageRouter registered as
+the single watch handler or with one filtered watch handler per channel. Both should stay flat from 10 to 100k
+channels. Adding and discarding a route is measured as well. Run with:
+
+    python -m benchmarks.bench_routing
+"""
+import random
+import timeit
+
+from yate.protocol import Message
+from yate.yate import YateBase, MessageRouter
+
+
+def build_lines(channels, count):
+    lines = []
+    for i in range(count):
+        channel = random.choice(channels)
+        # yate notifies watchers with the answer of the processed message
+        msg = Message("0x1.{}".format(i), None, "chan.hangup", "",
+                      {"id": channel, "reason": "hangup", "cause_sip": "487"}, reply=True)
+        lines.append(msg.encode_answer_for_yate(True))
+    return lines
+
+
+def router_yate(channels, callback):
+    yate = YateBase()
+    router = MessageRouter("id")
+    yate.register_watch_handler("chan.hangup", router)
+    yate._recv_message_raw(b"%%<watch:chan.hangup:true")
+    for channel in channels:
+        router.add(channel, callback)
+    return yate, router
+
+
+def filtered_handler_yate(channels, callback):
+    yate = YateBase()
+    for channel in channels:
+        yate.register_watch_handler("chan.hangup", callback, filter_attribute="id", filter_value=channel)
+    yate._recv_message_raw(b"%%<watch:chan.hangup:true")
+    return yate
+
+
+def bench_dispatch(label, yate, lines):
+    number = len(lines)
+    lines = iter(lines)
+    seconds = timeit.timeit(lambda: yate._recv_message_raw(next(lines)), number=number)
+    print("  {:<20} {:10.2f} us/msg".format(label, seconds / number * 1e6))
+
+
+def main():
+    calls = []
+    for channel_count in (10, 1000, 10000, 100000):
+        channels = ["sip/{}".format(i) for i in range(channel_count)]
+        lines = build_lines(channels, 20000)
+        print("{} channels".format(channel_count))
+
+        yate, router = router_yate(channels, calls.append)
+        bench_dispatch("router", yate, lines)
+        number = 100000
+        seconds = timeit.timeit(lambda: (router.add("sip/new", calls.append), router.discard("sip/new")),
+                                number=number)
+        print("  {:<20} {:10.2f} us/op".format("route add+discard", seconds / number * 1e6))
+
+        bench_dispatch("filtered handlers", filtered_handler_yate(channels, calls.append), lines)
+        calls.clear()
+
+
+if __name__ == "__main__":
+    main()
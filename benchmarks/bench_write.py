@@ -0,0 +1,100 @@
+"""
+Benchmark for sending messages to yate over a Unix socket.
+
+A stand-in for yate runs in a separate process, reads everything sent to it and reports the number of lines it
+received. The client fans out a number of messages per event loop iteration, like a handler sending
+chan.masquerade or call.drop to many channels at once, and measures messages per second with the coalesced
+writes of YateAsync and with one write per message as before. Run with:
+
+    python -m benchmarks.bench_write
+"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from yate.asyncio import YateAsync
+from yate import protocol
+from yate.protocol import MessageRequest
+
+
+class UnbatchedYateAsync(YateAsync):
+    def _write_line(self, msg):
+        self.writer.write(msg + b"\n")
+
+
+def stand_in_server(sockpath, ready):
+    async def handle(reader, writer):
+        lines = 0
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            lines += data.count(b"\n")
+            if data.endswith(b":bench.sync:\n"):
+                # answer the sync message with the number of lines received
+                sync = protocol.parse_yate_message(data[data.rfind(b"\n", 0, -1) + 1:-1])
+                sync.params["lines"] = str(lines)
+                writer.write(sync.encode_answer_for_yate(True) + b"\n")
+                await writer.drain()
+                lines = 0
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_unix_server(handle, sockpath)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+async def send(yate_class, sockpath, raw_messages, fan_out):
+    yate = yate_class(sockpath=sockpath)
+    await yate.setup_for_unix(sockpath)
+    start = time.perf_counter()
+    for i in range(0, len(raw_messages), fan_out):
+        for raw in raw_messages[i:i + fan_out]:
+            yate._send_message_raw(raw)
+        # let the loop run once, like a handler returning after its fan out
+        await asyncio.sleep(0)
+        await yate.drain()
+    answer = await yate.send_message_async(MessageRequest("bench.sync", {}))
+    received = int(answer.params["lines"])
+    seconds = time.perf_counter() - start
+    yate._flush_writes()
+    yate.writer.close()
+    return received, seconds
+
+
+def build_messages(count):
+    messages = []
+    for i in range(count):
+        msg = MessageRequest("chan.masquerade", {"message": "call.drop", "id": "sip/{}".format(i),
+                                                 "reason": "timeout"})
+        messages.append(msg.encode("bench.{}".format(i), 1522601502))
+    return messages
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        sockpath = os.path.join(directory, "yate.sock")
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=stand_in_server, args=(sockpath, ready), daemon=True)
+        server.start()
+        ready.wait()
+        try:
+            messages = build_messages(200000)
+            for fan_out in (1, 10, 50, 200):
+                print("{} messages per loop iteration".format(fan_out))
+                for label, yate_class in (("write per message", UnbatchedYateAsync), ("coalesced", YateAsync)):
+                    received, seconds = asyncio.run(send(yate_class, sockpath, messages, fan_out))
+                    assert received == len(messages) + 2, received
+                    print("  {:<20} {:10.0f} msgs/s".format(label, len(messages) / seconds))
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/python
+import os
+import sys
+
+from yate.ivr import YateIVRServer, IVRSession
+
+
+async def main(session: IVRSession):
+    dirname = os.path.dirname(__file__)
+    sndfile = os.path.join(dirname, "test.slin")
+    while True:
+        dtmf_symbol = await session.read_dtmf_symbols(1, timeout_s=30)
+        if dtmf_symbol == "1":
+            await session.play_soundfile(sndfile)
+        elif dtmf_symbol in ("0", ""):
+            break
+
+# serves all calls routed to ivr/... over the extmodule listener of yate at the given port
+server = YateIVRServer("127.0.0.1", int(sys.argv[1]))
+server.run(main)
@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import setup, Extension
 import os
 
 this_dir = os.path.abspath(os.path.dirname(__file__))
@@ -10,6 +10,8 @@ setup(
     name='python-yate',
     version='0.5.0',
     packages=['yate'],
+    # The C accelerator is optional, yate.protocol falls back to pure python if it cannot be built
+    ext_modules=[Extension("yate._speedups", ["yate/_speedups.c"], optional=True)],
     url='https://github.com/eventphone/python-yate',
     license='MIT',
     author='Martin Lang',
@@ -27,6 +29,7 @@ setup(
     entry_points={
         "console_scripts": [
             "yate_callgen=yate.callgen:main",
+            "yate_ivrlaunch=yate.ivrlaunch:main",
         ],
     },
 )
@@ -0,0 +1,9 @@
+from yate.ivr import YateIVR
+
+
+async def main(ivr: YateIVR):
+    await ivr.silence()
+
+
+ivr = YateIVR()
+ivr.run(main)
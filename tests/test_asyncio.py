@@ -1,12 +1,20 @@
 from subprocess import PIPE
 import asyncio
+import io
 import os
 import subprocess
+import tempfile
+import threading
+import time
 import unittest
+from unittest.mock import MagicMock, AsyncMock
 
-from yate.asyncio import YateAsync
+from yate.asyncio import YateAsync, YateStreamProtocol, HandlerRegistration
+from yate.yate import YateRequestTimeoutError, YateConnectionLostError
 from yate.protocol import parse_yate_message, Message, MessageRequest
 
+from tests.yatesim import YateSimServer
+
 class TestAsyncYateProgram(unittest.TestCase):
     def test_async_yate_program(self):
         this_dir = os.path.dirname(__file__)
@@ -56,3 +64,560 @@ class TestAsyncMessageHandling(unittest.TestCase):
 
         asyncio.run(async_testroutine())
         self.assertTrue(self.complete, "Async operation did not finish")
+
+    def test_async_message_timeout(self):
+        y = YateAsync()
+        y._send_message_raw = MagicMock()
+        y.request_timeout = 0.05
+
+        async def async_testroutine():
+            with self.assertRaises(YateRequestTimeoutError):
+                await y.send_message_async(MessageRequest("chan.test", {}), timeout=0.01)
+            with self.assertRaises(YateRequestTimeoutError):
+                await y.send_message_async(MessageRequest("chan.test", {}))
+
+        asyncio.run(async_testroutine())
+        self.assertEqual({}, y._requested_messages)
+        self.assertEqual(2, y.stats["expired_requests"])
+
+
+class TestFlowControl(unittest.TestCase):
+    def setUp(self):
+        self.y = YateAsync()
+        self.sent = []
+        self.y._send_message_raw = lambda raw: self.sent.append(parse_yate_message(raw))
+
+    def answer(self, msg):
+        self.y._recv_message_raw(msg.encode_answer_for_yate(True))
+
+    def test_in_flight_window(self):
+        self.y.set_flow_control(max_in_flight=2)
+        results = []
+
+        async def send(i):
+            result = await self.y.send_message_async(MessageRequest("chan.test", {"i": str(i)}))
+            results.append(result.params["i"])
+
+        async def async_testroutine():
+            tasks = [asyncio.create_task(send(i)) for i in range(5)]
+            await asyncio.sleep(0)
+            self.assertEqual(2, len(self.sent))
+            self.assertEqual(2, self.y.in_flight)
+            self.assertEqual(3, self.y.waiting_senders)
+
+            self.answer(self.sent[1])
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            self.assertEqual(["1"], results)
+            self.assertEqual(["0", "1", "2"], [msg.params["i"] for msg in self.sent])
+            self.assertEqual(2, self.y.in_flight)
+
+            # a cancelled sender gives up its place in the queue
+            tasks[3].cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(1, self.y.waiting_senders)
+
+            self.y.set_flow_control(max_in_flight=None)
+            await asyncio.sleep(0)
+            self.assertEqual(["0", "1", "2", "4"], [msg.params["i"] for msg in self.sent])
+            for msg in self.sent[0], self.sent[2], self.sent[3]:
+                self.answer(msg)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.assertEqual(0, self.y.in_flight)
+
+        asyncio.run(async_testroutine())
+        self.assertEqual(["1", "0", "2", "4"], results)
+
+    def test_write_buffer_backpressure(self):
+        self.y.writer = MagicMock()
+        self.y.writer.drain = AsyncMock()
+        self.y.set_flow_control(high_water=4096)
+        self.y.writer.transport.set_write_buffer_limits.assert_called_with(4096, None)
+
+        async def async_testroutine():
+            task = asyncio.create_task(self.y.send_message_async(MessageRequest("chan.test", {})))
+            await asyncio.sleep(0)
+            self.y.writer.drain.assert_awaited_once()
+            self.answer(self.sent[0])
+            await task
+
+        asyncio.run(async_testroutine())
+
+
+class TestWriteCoalescing(unittest.TestCase):
+    def test_lines_of_one_iteration_are_written_at_once(self):
+        y = YateAsync()
+        y.writer = MagicMock()
+
+        async def async_testroutine():
+            for i in range(3):
+                y._send_message_raw("%%>watch:chan.{}".format(i).encode())
+            y.writer.writelines.assert_not_called()
+            await asyncio.sleep(0)
+            y.writer.writelines.assert_called_once_with([b"%%>watch:chan.0", b"\n", b"%%>watch:chan.1", b"\n",
+                                                         b"%%>watch:chan.2", b"\n"])
+            y._send_message_raw(b"%%>watch:chan.3")
+            await y.drain()
+            y.writer.writelines.assert_called_with([b"%%>watch:chan.3", b"\n"])
+            y.writer.write.assert_not_called()
+
+        y.writer.drain = AsyncMock()
+        asyncio.run(async_testroutine())
+
+
+class TestBulkRegistration(unittest.TestCase):
+    def test_installs_and_watches_in_one_write(self):
+        y = YateAsync()
+        y.writer = MagicMock()
+
+        async def async_testroutine():
+            registrations = asyncio.create_task(y.register_handlers_async([
+                HandlerRegistration.for_message("chan.notify", MagicMock(), 100, "targetid", "sip/1"),
+                HandlerRegistration.for_message("chan.dtmf", MagicMock(), 100, "id", "sip/1"),
+                HandlerRegistration.for_watch("chan.hangup", MagicMock()),
+            ]))
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            y.writer.writelines.assert_called_once_with([b"%%>install:100:chan.notify:targetid:sip/1", b"\n",
+                                                         b"%%>install:100:chan.dtmf:id:sip/1", b"\n",
+                                                         b"%%>watch:chan.hangup", b"\n"])
+            y._recv_message_raw(b"%%<watch:chan.hangup:true")
+            y._recv_message_raw(b"%%<install:100:chan.dtmf:false")
+            self.assertFalse(registrations.done())
+            y._recv_message_raw(b"%%<install:100:chan.notify:true")
+            return await registrations
+
+        self.assertEqual([True, False, True], asyncio.run(async_testroutine()))
+
+
+class TestStreamProtocol(unittest.TestCase):
+    def setUp(self):
+        self.y = YateAsync()
+        self.received = []
+        self.y._recv_message_raw = self.received.append
+
+    def feed(self, *chunks):
+        async def async_testroutine():
+            protocol = YateStreamProtocol(self.y)
+            for chunk in chunks:
+                protocol.data_received(chunk)
+            return protocol
+
+        return asyncio.run(async_testroutine())
+
+    def test_lines_of_a_chunk(self):
+        self.feed(b"%%<watch:a:true\n%%<watch:b:true\r\n%%<watch:c:true\n")
+        self.assertEqual([b"%%<watch:a:true", b"%%<watch:b:true", b"%%<watch:c:true"], self.received)
+
+    def test_lines_split_across_chunks(self):
+        self.feed(b"%%<watch:a:tr", b"ue\n%%<wat", b"ch:b", b":true\n%%<watch:c:true\n%%<w", b"atch:d:true\n")
+        self.assertEqual([b"%%<watch:a:true", b"%%<watch:b:true", b"%%<watch:c:true", b"%%<watch:d:true"],
+                         self.received)
+
+    def test_line_longer_than_stream_reader_limit(self):
+        line = b"%%>message:id:1:call.route::" + b"x" * 200000
+        self.feed(*[line[i:i + 1000] for i in range(0, len(line), 1000)], b"\n%%<watch:a:true\n")
+        self.assertEqual([line, b"%%<watch:a:true"], self.received)
+
+    def test_oversize_lines_are_skipped(self):
+        self.y.set_line_limit(20)
+        with self.assertLogs("yate", "WARNING"):
+            self.feed(b"%%<watch:a:true\n%%<message:x:true:" + b"y" * 30, b"z" * 30, b"\n%%<watch:b:true\n",
+                      b"%%<message:x:true:" + b"y" * 30 + b"\n%%<watch:c:true\n")
+        self.assertEqual([b"%%<watch:a:true", b"%%<watch:b:true", b"%%<watch:c:true"], self.received)
+        self.assertEqual(2, self.y.stats["oversize_lines"])
+
+    def test_oversize_lines_are_truncated(self):
+        self.y.set_line_limit(20, YateAsync.OVERSIZE_TRUNCATE)
+        with self.assertLogs("yate", "WARNING"):
+            protocol = self.feed(b"%%<watch:a:true\n%%<message:x:", b"true:" + b"y" * 1000, b"y" * 1000,
+                                 b"y\n%%<watch:b:", b"true\n")
+        self.assertEqual([b"%%<watch:a:true", b"%%<message:x:true:yy", b"%%<watch:b:true"], self.received)
+        self.assertEqual(0, len(protocol._partial_line))
+
+    def test_oversize_line_callback(self):
+        callback = MagicMock()
+        self.y.set_line_limit(20, callback)
+        self.feed(b"%%<message:x:true:" + b"y" * 100 + b"\n%%<watch:a:true\n")
+        callback.assert_called_once_with(b"%%<message:x:true:yy", 118)
+        self.assertEqual([b"%%<watch:a:true"], self.received)
+
+    def test_failing_oversize_line_callback(self):
+        self.y.set_line_limit(20, MagicMock(side_effect=RuntimeError("policy failed")))
+        with self.assertLogs("yate", "ERROR"):
+            self.feed(b"%%<message:x:true:" + b"y" * 100 + b"\n%%<watch:a:true\n", b"%%<message:x:tr",
+                      b"ue:" + b"y" * 100 + b"\n%%<watch:b:true\n")
+        self.assertEqual([b"%%<watch:a:true", b"%%<watch:b:true"], self.received)
+
+    def test_unlimited_line_size(self):
+        self.y.set_line_limit(None)
+        line = b"%%>message:id:1:call.route::" + b"x" * (2 * 1024 * 1024)
+        self.feed(line[:1000000], line[1000000:] + b"\n")
+        self.assertEqual([line], self.received)
+
+    def test_failing_handler_does_not_stop_processing(self):
+        self.y._recv_message_raw = MagicMock(side_effect=[RuntimeError("handler failed"), None])
+        with self.assertLogs("yate", "ERROR"):
+            self.feed(b"%%<watch:a:true\n%%<watch:b:true\n")
+        self.y._recv_message_raw.assert_called_with(b"%%<watch:b:true")
+
+    def test_unix_socket_connection(self):
+        lines = [b"%%<watch:chan.notify:true", b"%%<message:x:true:chan.notify::data=" + b"y" * 100000]
+
+        async def handle(reader, writer):
+            await reader.readline()
+            writer.write(b"\n".join(lines) + b"\n")
+            writer.close()
+
+        async def application_main(yate):
+            await asyncio.sleep(10)
+
+        async def async_testroutine():
+            with tempfile.TemporaryDirectory() as directory:
+                sockpath = os.path.join(directory, "yate.sock")
+                server = await asyncio.start_unix_server(handle, sockpath)
+                y = YateAsync(sockpath=sockpath)
+                y._recv_message_raw = self.received.append
+                y.set_termination_handler(lambda: y.main_task.cancel())
+                await y._amain(application_main)
+                server.close()
+
+        asyncio.run(async_testroutine())
+        self.assertEqual(lines, self.received)
+
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sockpath = os.path.join(self.directory.name, "yate.sock")
+        self.server = YateSimServer(self.sockpath)
+        self.server.start()
+        self.y = YateAsync(sockpath=self.sockpath)
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    async def wait_for_server(self, condition):
+        await asyncio.to_thread(self.server.wait_for, condition)
+
+    async def reconnect(self):
+        await asyncio.to_thread(self.server.drop_connections)
+        await self.wait_for_server(lambda: self.server.connection_count == 2 and self.server.connections)
+
+    def test_registrations_are_replayed(self):
+        async def application_main(y):
+            self.assertTrue(await y.register_message_handler_async("call.route", lambda msg: True))
+            self.assertTrue(await y.register_watch_handler_async("chan.hangup", lambda msg: None))
+            self.assertTrue(await y.set_local_async("timeout", "1000"))
+            await self.reconnect()
+            connection = self.server.connections[0]
+            await self.wait_for_server(lambda: connection.watched_messages)
+            self.assertEqual({"call.route"}, set(connection.installed_message_handlers))
+            self.assertEqual({"chan.hangup"}, connection.watched_messages)
+            self.assertEqual({"timeout": "1000"}, connection.local_params)
+            answer = await asyncio.to_thread(self.server.send_message_request, MessageRequest("call.route", {}))
+            self.assertTrue(answer.processed)
+
+        self.y.set_reconnect(initial_delay=0.01)
+        self.y.run(application_main)
+        self.assertEqual(1, self.y.stats["reconnects"])
+
+    def test_pending_requests_fail(self):
+        async def application_main(y):
+            self.server.answer_messages = False
+            request = asyncio.create_task(y.send_message_async(MessageRequest("call.execute", {})))
+            await self.wait_for_server(lambda: any(c.received_message_requests for c in self.server.connections))
+            await self.reconnect()
+            with self.assertRaises(YateConnectionLostError):
+                await request
+
+        self.y.set_reconnect(initial_delay=0.01)
+        self.y.run(application_main)
+        self.assertEqual(1, self.y.stats["failed_requests"])
+
+    async def restart_server(self, while_disconnected):
+        # without a server to connect to, the client stays disconnected until the server is back
+        await self.wait_for_server(lambda: self.server.connections)
+        await asyncio.to_thread(self.server.stop)
+        await self.wait_for_server(lambda: self.y._reconnecting)
+        result = await while_disconnected()
+        self.server = YateSimServer(self.sockpath)
+        await asyncio.to_thread(self.server.start)
+        await self.wait_for_server(lambda: self.y.stats["reconnects"] == 1)
+        return result
+
+    def test_requests_fail_while_disconnected(self):
+        answers = []
+
+        async def application_main(y):
+            async def send():
+                y.send_message(MessageRequest("call.execute", {}), lambda _msg, answer: answers.append(answer))
+                with self.assertRaises(YateConnectionLostError):
+                    await y.send_message_async(MessageRequest("call.execute", {}))
+            await self.restart_server(send)
+            self.assertEqual({}, y._requested_messages)
+            self.assertIsInstance(answers[0], YateConnectionLostError)
+
+        self.y.set_reconnect(initial_delay=0.01)
+        self.y.set_flow_control(max_in_flight=1)
+        self.y.run(application_main)
+        self.assertEqual(0, self.y.in_flight)
+
+    def test_requests_sent_while_disconnected_are_retried(self):
+        async def application_main(y):
+            async def send():
+                return asyncio.create_task(y.send_message_async(MessageRequest("call.execute", {"id": "sip/1"})))
+            request = await self.restart_server(send)
+            answer = await request
+            self.assertEqual("sip/1", answer.params["id"])
+            self.assertEqual(1, len(self.server.connections[0].received_message_requests))
+
+        self.y.set_reconnect(initial_delay=0.01, pending_policy=YateAsync.PENDING_RETRY)
+        self.y.run(application_main)
+
+    def test_pending_requests_are_sent_again(self):
+        async def application_main(y):
+            self.server.answer_messages = False
+            request = asyncio.create_task(y.send_message_async(MessageRequest("call.execute", {"id": "sip/1"})))
+            await self.wait_for_server(lambda: any(c.received_message_requests for c in self.server.connections))
+            self.server.answer_messages = True
+            await self.reconnect()
+            answer = await request
+            self.assertEqual("sip/1", answer.params["id"])
+
+        self.y.set_reconnect(initial_delay=0.01, pending_policy=YateAsync.PENDING_RETRY)
+        self.y.run(application_main)
+
+    def test_reconnect_retries_with_backoff(self):
+        async def application_main(y):
+            # the connection has to be dropped by the stop, so it must have been accepted
+            await self.wait_for_server(lambda: self.server.connections)
+            await asyncio.to_thread(self.server.stop)
+            await asyncio.sleep(0.05)
+            self.server.start()
+            await self.wait_for_server(lambda: self.server.connections)
+            self.assertTrue(await y.register_message_handler_async("call.route", lambda msg: True))
+
+        self.y.set_reconnect(initial_delay=0.01, max_delay=0.02)
+        self.y.run(application_main)
+        self.assertEqual(1, self.y.stats["reconnects"])
+
+    def test_reconnect_requires_socket(self):
+        with self.assertRaises(ValueError):
+            YateAsync().set_reconnect()
+
+
+def route_in_worker(msg):
+    # module level, so it can be run in a process pool
+    msg.params["location"] = "sip/" + msg.params["called"]
+    msg.return_value = str(os.getpid())
+    return True
+
+
+class TestOffloadedHandlers(unittest.TestCase):
+    def setUp(self):
+        self.y = YateAsync()
+        self.sent = []
+        self.y._send_message_raw = lambda raw: self.sent.append(parse_yate_message(raw))
+
+    async def wait_for_answers(self, count):
+        for _ in range(500):
+            answers = [msg for msg in self.sent if isinstance(msg, Message)]
+            if len(answers) >= count:
+                return answers
+            await asyncio.sleep(0.01)
+        self.fail("Handlers did not answer in time")
+
+    def test_order_within_channel_and_concurrency_limit(self):
+        lock = threading.Lock()
+        running = []
+        handled = []
+        max_running = [0]
+
+        def slow_handler(msg):
+            with lock:
+                running.append(msg.id)
+                max_running[0] = max(max_running[0], len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(msg.id)
+                handled.append(msg.id)
+            return msg.params["id"] != "sip/2"
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", slow_handler, install=False, executor="thread",
+                                            max_concurrency=2)
+            for i in range(12):
+                self.y._recv_message_raw("%%>message:{}:1:call.route::id=sip/{}".format(i, i % 3).encode())
+            # nothing is answered on the event loop
+            self.assertEqual([], self.sent)
+            return await self.wait_for_answers(12)
+
+        answers = asyncio.run(async_testroutine())
+        self.assertLessEqual(max_running[0], 2)
+        for channel in range(3):
+            ids = [str(i) for i in range(channel, 12, 3)]
+            self.assertEqual(ids, [msg_id for msg_id in handled if int(msg_id) % 3 == channel])
+        self.assertEqual({str(i): i % 3 != 2 for i in range(12)}, {msg.id: msg.processed for msg in answers})
+        handler = next(iter(self.y._message_handlers["call.route"].handlers))
+        self.assertEqual({}, handler.callback._queued)
+
+    def test_process_pool_answers_with_modified_message(self):
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route_in_worker, install=False, executor="process")
+            self.y._recv_message_raw(b"%%>message:0x1:1:call.route::id=sip/1:called=123")
+            answers = await self.wait_for_answers(1)
+            self.y._process_pool.shutdown()
+            return answers
+
+        answer = asyncio.run(async_testroutine())[0]
+        self.assertTrue(answer.processed)
+        self.assertNotEqual(str(os.getpid()), answer.return_value)
+        self.assertEqual({"id": "sip/1", "called": "123", "location": "sip/123"}, answer.params)
+
+    def test_unregister_offloaded_handler(self):
+        self.y.register_message_handler("call.route", route_in_worker, install=False, executor="thread")
+        self.y.unregister_message_handler("call.route", route_in_worker)
+        self.assertNotIn("call.route", self.y._message_handlers)
+
+
+class TestCoroutineHandlers(unittest.TestCase):
+    def setUp(self):
+        self.y = YateAsync()
+        self.sent = []
+        self.y._send_message_raw = lambda raw: self.sent.append(parse_yate_message(raw))
+
+    def recv(self, msg_id, channel="sip/1"):
+        self.y._recv_message_raw("%%>message:{}:1:call.route::id={}".format(msg_id, channel).encode())
+
+    def test_answer_with_result(self):
+        async def route(msg):
+            await asyncio.sleep(0)
+            msg.return_value = "sip/123"
+            return msg.id != "0x2"
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route, install=False)
+            self.recv("0x1")
+            self.recv("0x2")
+            self.assertEqual([], self.sent)
+            await asyncio.sleep(0.01)
+
+        asyncio.run(async_testroutine())
+        self.assertEqual([("0x1", True, "sip/123"), ("0x2", False, "sip/123")],
+                         [(msg.id, msg.processed, msg.return_value) for msg in self.sent])
+
+    def test_concurrency_limit(self):
+        running = []
+        max_running = [0]
+
+        async def route(msg):
+            running.append(msg)
+            max_running[0] = max(max_running[0], len(running))
+            await asyncio.sleep(0.01)
+            running.remove(msg)
+            return True
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route, install=False, max_concurrency=3)
+            for i in range(10):
+                self.recv(str(i), "sip/{}".format(i))
+            for _ in range(100):
+                if len(self.sent) == 10:
+                    break
+                await asyncio.sleep(0.01)
+
+        asyncio.run(async_testroutine())
+        self.assertEqual(3, max_running[0])
+        self.assertEqual(10, len(self.sent))
+
+    def test_answer_false_after_timeout(self):
+        cancelled = []
+
+        async def route(msg):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(msg.id)
+                raise
+            return True
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route, install=False, answer_timeout=0.01)
+            self.recv("0x1")
+            await asyncio.sleep(0.05)
+
+        with self.assertLogs("yate", "WARNING"):
+            asyncio.run(async_testroutine())
+        self.assertEqual(["0x1"], cancelled)
+        self.assertEqual([("0x1", False)], [(msg.id, msg.processed) for msg in self.sent])
+        self.assertEqual(1, self.y.stats["handler_timeouts"])
+
+    def test_timeout_raised_by_handler(self):
+        async def route(msg):
+            raise YateRequestTimeoutError("Yate did not answer call.execute in time")
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route, install=False, answer_timeout=10)
+            self.recv("0x1")
+            await asyncio.sleep(0.01)
+
+        with self.assertLogs("yate", "ERROR"):
+            asyncio.run(async_testroutine())
+        self.assertEqual([("0x1", False)], [(msg.id, msg.processed) for msg in self.sent])
+        self.assertEqual(0, self.y.stats["handler_timeouts"])
+
+    def test_failing_and_self_answering_handlers(self):
+        async def route(msg):
+            if msg.id == "0x1":
+                raise RuntimeError("handler failed")
+            self.y.answer_message(msg, True)
+
+        async def async_testroutine():
+            self.y.register_message_handler("call.route", route, install=False)
+            self.recv("0x1")
+            self.recv("0x2")
+            await asyncio.sleep(0.01)
+
+        with self.assertLogs("yate", "ERROR"):
+            asyncio.run(async_testroutine())
+        self.assertEqual([("0x1", False), ("0x2", True)], [(msg.id, msg.processed) for msg in self.sent])
+
+    def test_coroutine_handler_cannot_be_offloaded(self):
+        async def route(msg):
+            return True
+
+        with self.assertRaises(ValueError):
+            self.y.register_message_handler("call.route", route, install=False, executor="thread")
+
+
+class TestWireTrace(unittest.TestCase):
+    def test_wire_trace_disabled(self):
+        y = YateAsync()
+        y.writer = MagicMock()
+        y._send_message_raw(b"%%>watch:chan.notify")
+        y.writer.writelines.assert_called_with([b"%%>watch:chan.notify", b"\n"])
+        output = io.StringIO()
+        y.dump_wire_trace(output)
+        self.assertEqual("", output.getvalue())
+
+    def test_wire_trace_ring_buffer(self):
+        y = YateAsync()
+        y.writer = MagicMock()
+        y.enable_wire_trace(size=2)
+        for name in ("chan.notify", "chan.hangup", "chan.dtmf"):
+            y._send_message_raw("%%>watch:{}".format(name).encode())
+        y._wire_trace.record_incoming(b"%%<watch:chan.dtmf:true")
+
+        output = io.StringIO()
+        y.dump_wire_trace(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].endswith("> b'%%>watch:chan.hangup'"))
+        self.assertTrue(lines[1].endswith("> b'%%>watch:chan.dtmf'"))
+        self.assertTrue(lines[2].endswith("< b'%%<watch:chan.dtmf:true'"))
+
+        y.disable_wire_trace()
+        y._send_message_raw(b"%%>watch:call.answered")
+        self.assertIsNone(y._wire_trace)
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+import unittest
+
+
+def modules_loaded_by(module):
+    """
+    Import module in a fresh interpreter and return the names of all modules loaded afterwards.
+    """
+    result = subprocess.run([sys.executable, "-c", "import sys, {}; print(' '.join(sys.modules))".format(module)],
+                            stdout=subprocess.PIPE, check=True, text=True)
+    return set(result.stdout.split())
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_ivr_does_not_load_executors(self):
+        loaded = modules_loaded_by("yate.ivr")
+        self.assertIn("yate.asyncio", loaded)
+        self.assertNotIn("multiprocessing", loaded)
+        self.assertNotIn("concurrent.futures.process", loaded)
+
+    def test_protocol_does_not_load_asyncio(self):
+        loaded = modules_loaded_by("yate.protocol")
+        self.assertNotIn("asyncio", loaded)
+        self.assertNotIn("logging", loaded)
+        self.assertNotIn("re", loaded)
+        self.assertNotIn("collections", loaded)
+        self.assertNotIn("functools", loaded)
+
+    def test_callgen_loads_aiohttp_only_when_used(self):
+        self.assertNotIn("aiohttp", modules_loaded_by("yate.callgen"))
+
+
+if __name__ == '__main__':
+    unittest.main()
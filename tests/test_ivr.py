@@ -1,8 +1,13 @@
 import asyncio
+import os
+import re
+import select
+import subprocess
+import tempfile
 import unittest
 
 from yate import ivr, protocol
-from tests.yatesim import YateSim, YateSimAsyncMixin
+from tests.yatesim import YateSim, YateSimAsyncMixin, YateSimServer
 
 
 class YateIVRInTheLoop(YateSimAsyncMixin, ivr.YateIVR):
@@ -63,7 +68,7 @@ class YateIVRBaseTests(unittest.TestCase):
         self.ivr.run(play_sndfile_main)
         attach_msg = self.ys.received_message_requests[0]
         self.assertEqual("chan.attach", attach_msg.name)
-        self.assertDictEqual(attach_msg.params,
+        self.assertEqual(attach_msg.params,
                              {"source": "wave/play//var/opt/test.slin",
                               "notify": "sip/1",
                               "autorepeat": "true"})
@@ -74,6 +79,42 @@ class YateIVRBaseTests(unittest.TestCase):
         await ivr.play_soundfile("/var/opt/test.slin", complete=True)
         self.sound_finished = True
 
+    async def play_sndfile_wait_dtmf_main(self, i):
+        self.ys.send_dtmf("sip/1", "1")
+        notify_msg = protocol.MessageRequest("chan.notify", {"id": "sip/1", "reason": "eof"})
+        self.ys.enqueue_yate_message_request(notify_msg)
+        await i.play_soundfile("/var/opt/test.slin", complete=True)
+        self.assertEqual(ivr.ChannelEventType.DTMF, await i.wait_channel_event(timeout_s=0.01))
+        self.assertIsNone(await i.wait_channel_event(timeout_s=0.01))
+        self.assertEqual("1", await i.read_dtmf_symbols(1))
+        self.assertIsNone(await i.wait_channel_event(timeout_s=0.01))
+        self.sound_finished = True
+
+    def test_play_soundfile_wait_ignores_dtmf(self):
+        self.sound_finished = False
+        self.ys.generate_call_execute("sip/1")
+
+        self.ivr.run(self.play_sndfile_wait_dtmf_main)
+        self.assertTrue(self.sound_finished)
+
+    async def wait_playback_end_ignoring_dtmf_main(self, i):
+        self.ys.send_dtmf("sip/1", "1")
+        await i.play_soundfile("/var/opt/test.slin")
+        notify_msg = protocol.MessageRequest("chan.notify", {"id": "sip/1", "reason": "eof"})
+        self.ys.enqueue_yate_message_request(notify_msg)
+        for _ in range(10):
+            if await i.wait_channel_event(timeout_s=1) == ivr.ChannelEventType.PLAYBACK_END:
+                self.sound_finished = True
+                break
+        self.assertEqual("1", i.dtmf_buffer)
+
+    def test_wait_playback_end_ignoring_dtmf(self):
+        self.sound_finished = False
+        self.ys.generate_call_execute("sip/1")
+
+        self.ivr.run(self.wait_playback_end_ignoring_dtmf_main)
+        self.assertTrue(self.sound_finished)
+
     def test_play_soundfile_wait(self):
         self.sound_finished = False
         self.ys.generate_call_execute("sip/1")
@@ -125,7 +166,7 @@ class YateIVRBaseTests(unittest.TestCase):
         self.assertEqual(event, ivr.ChannelEventType.DTMF)
         self.finished = True
 
-    def test_dtmf_read_symbols(self):
+    def test_wait_channel_event(self):
         self.finished = False
         self.ys.generate_call_execute("sip/1")
 
@@ -144,3 +185,273 @@ class YateIVRBaseTests(unittest.TestCase):
 
         self.ivr.run(self.dtmf_timeout_test_main)
         self.assertTrue(self.finished)
+
+
+    async def dtmf_type_ahead_test_main(self, ivr):
+        for symbol in "12#34":
+            self.ys.send_dtmf("sip/1", symbol)
+        self.assertEqual("12#", await ivr.read_dtmf_until("#"))
+        self.assertEqual("34", await ivr.read_dtmf_symbols(2))
+        self.finished = True
+
+    def test_dtmf_type_ahead(self):
+        self.finished = False
+        self.ys.generate_call_execute("sip/1")
+
+        self.ivr.run(self.dtmf_type_ahead_test_main)
+        self.assertTrue(self.finished)
+
+    async def dtmf_pattern_test_main(self, ivr):
+        for symbol in "4711#9":
+            self.ys.send_dtmf("sip/1", symbol)
+        self.assertEqual("4711#", await ivr.read_dtmf_pattern("X{4}#"))
+        self.assertIsNone(await ivr.read_dtmf_pattern("X{2}", timeout_s=0.01))
+        # stops at the first symbol that cannot match, without a timeout
+        for symbol in "12345#":
+            self.ys.send_dtmf("sip/1", symbol)
+        self.assertIsNone(await ivr.read_dtmf_pattern("X{4}#"))
+        self.assertEqual("#", ivr.dtmf_buffer)
+        self.assertEqual("#", await ivr.read_dtmf_symbols(1))
+        self.finished = True
+
+    def test_dtmf_pattern(self):
+        self.finished = False
+        self.ys.generate_call_execute("sip/1")
+
+        self.ivr.run(self.dtmf_pattern_test_main)
+        self.assertTrue(self.finished)
+        self.assertEqual("", self.ivr.dtmf_buffer)
+
+
+class DTMFCollectorTests(unittest.TestCase):
+    def match(self, pattern, symbols):
+        """
+        Return for every symbol whether the input matches ("M"), may still match ("-") or cannot ("x").
+        """
+        compiled = ivr.compile_dtmf_pattern(pattern)
+        state = compiled.start
+        result = ""
+        for symbol in symbols:
+            state = compiled.step(state, symbol)
+            result += "M" if compiled.matches(state) else "-" if state else "x"
+        return result
+
+    def test_dtmf_pattern(self):
+        self.assertEqual("---M", self.match("X{4}", "4711"))
+        self.assertEqual("----x", self.match("X{4}#", "12345"))
+        self.assertEqual("---M", self.match("*ZN.", "*92#"))
+        self.assertEqual("-x", self.match("*ZN.", "*0"))
+        self.assertEqual("-M", self.match("1[2-3*]", "1*"))
+        self.assertEqual("x", self.match("[Z*]", "0"))
+        self.assertEqual("-M-MM", self.match("1(2|34)+", "12342"))
+        self.assertEqual("-MMx", self.match("X{2,3}", "1234"))
+        self.assertEqual("-MMM", self.match("X{2,}", "1234"))
+        regex = re.compile("1+")
+        self.assertIs(regex, ivr.compile_dtmf_pattern(regex))
+
+    def test_invalid_dtmf_pattern(self):
+        for pattern in ("X{", "(1", "1)", "[12", "E", "X{3,2}", "[3-1]"):
+            with self.assertRaises(ValueError):
+                ivr.DTMFPattern(pattern)
+
+    def test_match_finishes_without_waiting(self):
+        async def main():
+            collector = ivr.DTMFCollector()
+            regex = re.compile("1[0-9]")
+            reading = asyncio.create_task(collector.read(lambda read: regex.fullmatch("".join(read)) is not None,
+                                                         10))
+            await asyncio.sleep(0)
+            collector.push("1")
+            await asyncio.sleep(0)
+            self.assertFalse(reading.done())
+            collector.push("23")
+            self.assertEqual(("12", True), await reading)
+            self.assertEqual(["3"], list(collector.symbols))
+
+        asyncio.run(main())
+
+    def test_interdigit_timeout(self):
+        async def main():
+            collector = ivr.DTMFCollector()
+            collector.push("1")
+            self.assertEqual(("1", False), await collector.read(lambda read: len(read) == 2, 10, 0.01))
+            # the first symbol is awaited for the overall timeout only
+            reading = asyncio.create_task(collector.read(lambda read: len(read) == 1, 10, 0.01))
+            await asyncio.sleep(0.05)
+            collector.push("2")
+            self.assertEqual(("2", True), await reading)
+
+        asyncio.run(main())
+
+    def test_single_reader(self):
+        async def main():
+            collector = ivr.DTMFCollector()
+            reading = asyncio.create_task(collector.read(lambda read: True))
+            await asyncio.sleep(0)
+            with self.assertRaises(RuntimeError):
+                await collector.read(lambda read: True)
+            reading.cancel()
+
+        asyncio.run(main())
+
+
+class ChannelEventQueueTests(unittest.TestCase):
+    def test_events_in_order_once_per_type(self):
+        async def main():
+            events = ivr.ChannelEventQueue()
+            for event_type in (ivr.ChannelEventType.DTMF, ivr.ChannelEventType.PLAYBACK_END,
+                               ivr.ChannelEventType.DTMF):
+                events.push(event_type)
+            self.assertEqual(ivr.ChannelEventType.DTMF, await events.get())
+            self.assertEqual(ivr.ChannelEventType.PLAYBACK_END, await events.get())
+            self.assertIsNone(await events.get(timeout_s=0.01))
+
+        asyncio.run(main())
+
+    def test_waiters_receive_event(self):
+        async def main():
+            events = ivr.ChannelEventQueue()
+            waiting = [asyncio.create_task(events.get(10)) for _ in range(2)]
+            await asyncio.sleep(0)
+            events.push(ivr.ChannelEventType.PLAYBACK_END)
+            self.assertEqual([ivr.ChannelEventType.PLAYBACK_END] * 2, await asyncio.gather(*waiting))
+            self.assertEqual(0, len(events.events))
+
+        asyncio.run(main())
+
+    def test_outdated_event_is_discarded(self):
+        async def main():
+            events = ivr.ChannelEventQueue()
+            events.push(ivr.ChannelEventType.PLAYBACK_END)
+            events.discard(ivr.ChannelEventType.PLAYBACK_END)
+            events.discard(ivr.ChannelEventType.DTMF)
+            self.assertIsNone(await events.get(timeout_s=0.01))
+            self.assertEqual([], events._waiters)
+
+        asyncio.run(main())
+
+
+class YateIVRProcessTests(unittest.TestCase):
+    def test_call_execute_before_startup(self):
+        # yate sends the call.execute right after starting the script, it must be answered
+        test_script = os.path.join(os.path.dirname(__file__), "ivr_min.py")
+        p = subprocess.Popen(["python3", test_script], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        p.stdin.write(b"%%>message:test.1:4711:call.execute::id=sip/1\n")
+        p.stdin.flush()
+        readable, _, _ = select.select([p.stdout], [], [], 10)
+        self.assertTrue(readable)
+        answer = protocol.parse_yate_message(p.stdout.readline().strip())
+        self.assertEqual(("test.1", True), (answer.id, answer.processed))
+        p.kill()
+        p.wait()
+        p.stdin.close()
+        p.stdout.close()
+
+
+class YateIVRServerTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sockpath = os.path.join(self.directory.name, "yate.sock")
+        self.server = YateSimServer(self.sockpath)
+        self.server.start()
+        self.ivr_server = ivr.YateIVRServer(sockpath=self.sockpath)
+        self.started_calls = []
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def run_server(self, call_main, drive):
+        async def application_main(ivr_server):
+            serving = asyncio.create_task(ivr_server.serve(call_main))
+            await self.wait_for_server(lambda: self.server.installing_connection("chan.dtmf") and
+                                       "chan.hangup" in self.server.connections[0].watched_messages)
+            try:
+                await drive()
+            finally:
+                serving.cancel()
+
+        asyncio.run(self.ivr_server._amain(application_main))
+
+    async def wait_for_server(self, condition):
+        await asyncio.to_thread(self.server.wait_for, condition)
+
+    def sent_requests(self, name):
+        return [msg for msg in self.server.connections[0].received_message_requests if msg.name == name]
+
+    async def start_call(self, call_id, channel_id, callto="ivr/menu"):
+        execute = protocol.MessageRequest("call.execute", {"id": call_id, "callto": callto})
+        answer = await asyncio.to_thread(self.server.send_message_request, execute)
+        if answer.params["callto"] == "dumb/":
+            await asyncio.to_thread(self.server.notify_watchers, "call.execute",
+                                    {"id": call_id, "callto": "dumb/", "peerid": channel_id})
+        return answer
+
+    async def send_dtmf(self, call_id, text):
+        dtmf = protocol.MessageRequest("chan.dtmf", {"id": call_id, "text": text})
+        return await asyncio.to_thread(self.server.send_message_request, dtmf)
+
+    async def menu_call_main(self, session):
+        self.started_calls.append(session.call_id)
+        digits = await session.read_dtmf_symbols(2)
+        await session.play_soundfile("/var/opt/{}.slin".format(digits))
+
+    def test_call_session(self):
+        async def drive():
+            answer = await self.start_call("sip/1", "dumb/1")
+            self.assertFalse(answer.processed)
+            await self.wait_for_server(lambda: self.started_calls)
+            self.assertTrue((await self.send_dtmf("sip/1", "4")).processed)
+            await self.send_dtmf("sip/1", "2")
+            await self.wait_for_server(lambda: self.sent_requests("call.drop"))
+
+            attach, = self.sent_requests("chan.masquerade")
+            self.assertEqual({"message": "chan.attach", "id": "dumb/1", "source": "wave/play//var/opt/42.slin",
+                              "notify": "sip/1"}, dict(attach.params))
+            self.assertEqual("dumb/1", self.sent_requests("call.drop")[0].params["id"])
+            self.assertEqual({}, self.ivr_server.sessions)
+
+        self.run_server(self.menu_call_main, drive)
+
+    def test_other_calls_are_ignored(self):
+        async def drive():
+            answer = await self.start_call("sip/1", "dumb/1", callto="sip/sip:alice@example.org")
+            self.assertFalse(answer.processed)
+            self.assertEqual("sip/sip:alice@example.org", answer.params["callto"])
+            self.assertEqual({}, self.ivr_server.sessions)
+            self.assertFalse((await self.send_dtmf("sip/1", "1")).processed)
+
+        self.run_server(self.menu_call_main, drive)
+
+    def test_hangup(self):
+        hangups = []
+
+        async def call_main(session):
+            session.register_hangup_handler(lambda: hangups.append(session.call_id))
+            self.started_calls.append(session.call_id)
+            await session.read_dtmf_until("#")
+
+        async def drive():
+            await self.start_call("sip/1", "dumb/1")
+            await self.wait_for_server(lambda: self.started_calls)
+            await asyncio.to_thread(self.server.notify_watchers, "chan.hangup", {"id": "sip/1"})
+            await self.wait_for_server(lambda: not self.ivr_server.sessions)
+            self.assertEqual(["sip/1"], hangups)
+            self.assertEqual([], self.sent_requests("call.drop"))
+
+        self.run_server(call_main, drive)
+
+    def test_concurrent_calls(self):
+        async def drive():
+            call_ids = ["sip/{}".format(i) for i in range(50)]
+            await asyncio.gather(*(self.start_call(call_id, "dumb/" + call_id[4:]) for call_id in call_ids))
+            await self.wait_for_server(lambda: len(self.started_calls) == len(call_ids))
+            await asyncio.gather(*(self.send_dtmf(call_id, call_id[-1]) for call_id in call_ids))
+            await asyncio.gather(*(self.send_dtmf(call_id, "#") for call_id in call_ids))
+            await self.wait_for_server(lambda: len(self.sent_requests("call.drop")) == len(call_ids))
+
+            sources = {msg.params["id"]: msg.params["source"] for msg in self.sent_requests("chan.masquerade")}
+            self.assertEqual({"dumb/" + call_id[4:]: "wave/play//var/opt/{}#.slin".format(call_id[-1])
+                              for call_id in call_ids}, sources)
+
+        self.run_server(self.menu_call_main, drive)
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from yate import protocol
+from yate.ivrpool import IVRProcessPool
+
+
+async def busy_tone(ivr):
+    await ivr.tone("busy")
+
+
+class YateSide:
+    """
+    The pipes yate connects an external module with, read line by line.
+    """
+    def __init__(self):
+        self.module_stdin, self._writer = os.pipe()
+        reader, self.module_stdout = os.pipe()
+        self.reader = os.fdopen(reader, "rb")
+
+    def launch(self, *command):
+        process = subprocess.Popen(command, stdin=self.module_stdin, stdout=self.module_stdout)
+        # only the module holds these ends now
+        os.close(self.module_stdin)
+        os.close(self.module_stdout)
+        return process
+
+    def send(self, line):
+        os.write(self._writer, line + b"\n")
+
+    def receive(self):
+        return protocol.parse_yate_message(self.reader.readline().strip())
+
+    def close(self):
+        os.close(self._writer)
+        self.reader.close()
+
+
+class TestIVRProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sockpath = os.path.join(self.directory.name, "ivr.sock")
+        self.pool = IVRProcessPool(busy_tone, self.sockpath, pool_size=2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+        self.directory.cleanup()
+
+    def test_call_is_served_by_warm_worker(self):
+        yate_side = YateSide()
+        launcher = yate_side.launch(sys.executable, "-m", "yate.ivrlaunch", self.sockpath)
+        yate_side.send(protocol.MessageRequest("call.execute", {"id": "sip/1"}).encode("test.1", 1522601502))
+
+        answer = yate_side.receive()
+        self.assertEqual(("call.execute", True), (answer.name, answer.processed))
+        for _ in range(2):
+            install = yate_side.receive()
+            yate_side.send(protocol.InstallConfirm(install.priority, install.name, True).encode())
+        attach = yate_side.receive()
+        self.assertEqual("tone/busy", attach.params["source"])
+        yate_side.send(attach.encode_answer_for_yate(True))
+
+        self.assertEqual(b"", yate_side.reader.readline())
+        self.assertEqual(0, launcher.wait(10))
+        yate_side.close()
+        self.pool.supervise(0)
+        self.assertEqual(2, len(self.pool.idle_workers))
+
+    def test_fallback_without_pool(self):
+        self.pool.stop()
+        yate_side = YateSide()
+        launcher = yate_side.launch(sys.executable, "-m", "yate.ivrlaunch", self.sockpath,
+                                    sys.executable, "-c", "print('%%>install:100:call.execute')")
+        self.assertEqual("call.execute", yate_side.receive().name)
+        self.assertEqual(0, launcher.wait(10))
+        yate_side.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,20 @@ class BaseEncodingTestCases(unittest.TestCase):
         with self.assertRaises(Exception):
             result = protocol.yate_decode_bytes(b"/bin%:/usr/bin%:/usr/local/bin")
 
+    def test_decode_fails_trailing_percent(self):
+        with self.assertRaises(protocol.YateMessageParsingError):
+            protocol.yate_decode_bytes(b"test%")
+
+    def test_encode_control_characters(self):
+        result = protocol.yate_encode_bytes(b"line1\nline2\x00")
+        self.assertEqual(b"line1%Jline2%@", result)
+
+    def test_encode_decode_all_bytes(self):
+        all_bytes = bytes(range(256))
+        encoded = protocol.yate_encode_bytes(all_bytes)
+        self.assertNotIn(b":", encoded)
+        self.assertEqual(all_bytes, protocol.yate_decode_bytes(encoded))
+
 
 class MessageDeserializationTestCases(unittest.TestCase):
     def test_parse_yate_msg(self):
@@ -43,6 +57,22 @@ class MessageDeserializationTestCases(unittest.TestCase):
         self.assertEqual({}, result.params)
         self.assertEqual(False, result.reply)
 
+    def test_parse_yate_msg_params(self):
+        result = protocol.parse_yate_message(b"%%<message:id1:true:chan.test:ret%z1:novalue:a=b=c:colon%z=x%zy:empty=")
+        self.assertEqual(True, result.reply)
+        self.assertEqual(True, result.processed)
+        self.assertEqual("ret:1", result.return_value)
+        self.assertEqual({"novalue": "", "a": "b=c", "colon:": "x:y", "empty": ""}, result.params)
+
+    def test_parse_yate_msg_too_short(self):
+        with self.assertRaises(protocol.YateMessageParsingError):
+            protocol.parse_yate_message(b"%%>message:id1:4711:chan.test")
+
+    def test_parsed_messages_have_no_instance_dict(self):
+        result = protocol.parse_yate_message(b"%%>message:id1:4711:chan.test:ret:id=sip/1")
+        self.assertFalse(hasattr(result, "__dict__"))
+        self.assertFalse(hasattr(result.params, "__dict__"))
+
     def test_parse_install_message(self):
         result = protocol.parse_yate_message(b"%%<install:50:test:true")
         self.assertEqual("install", result.msg_type)
@@ -120,6 +150,88 @@ class MessageDeserializationTestCases(unittest.TestCase):
         self.assertFalse(result.success)
 
 
+class MessageParamsTestCases(unittest.TestCase):
+    def parse(self, params):
+        return protocol.parse_yate_message(b"%%>message:id1:4711:chan.test:ret:" + params)
+
+    def test_params_are_decoded_lazily(self):
+        msg = self.parse(b"id=sip/1:address=10.0.0.1%z5060")
+        self.assertIsInstance(msg.params, protocol.MessageParams)
+        self.assertEqual("sip/1", msg.params["id"])
+        self.assertEqual("sip/1", msg.params.get("id"))
+        self.assertIsNone(msg.params.get("missing"))
+        self.assertIn("address", msg.params)
+        self.assertNotIn("missing", msg.params)
+
+    def test_params_decoding_error_on_access(self):
+        msg = self.parse(b"id=sip/1:broken=%")
+        self.assertEqual("sip/1", msg.params["id"])
+        with self.assertRaises(protocol.YateMessageParsingError):
+            msg.params["broken"]
+
+    def test_params_mapping(self):
+        msg = self.parse(b"b=2:a=1:novalue:b=3:key%z=x%zy")
+        self.assertEqual(["b", "a", "novalue", "key:"], list(msg.params))
+        self.assertEqual({"a": "1", "b": "3", "novalue": "", "key:": "x:y"}, msg.params)
+        self.assertEqual(4, len(msg.params))
+
+        msg.params["c"] = "new"
+        del msg.params["a"]
+        self.assertEqual([("b", "3"), ("novalue", ""), ("key:", "x:y"), ("c", "new")], list(msg.params.items()))
+        with self.assertRaises(KeyError):
+            del msg.params["a"]
+
+    def test_params_set_to_none(self):
+        msg = self.parse(b"a=1:b=2")
+        del msg.params["a"]
+        msg.params["a"] = None
+        self.assertIsNone(msg.params["a"])
+        self.assertIn("a", msg.params)
+        msg.params["b"] = None
+        self.assertIsNone(msg.params["b"])
+
+    def test_params_escaped_key_separator(self):
+        msg = self.parse(b"a%}b=c:key=x=y")
+        self.assertEqual({"a=b": "c", "key": "x=y"}, msg.params)
+        msg.params["a=b"] = "d"
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:a%}b=d:key=x=y", msg.encode_answer_for_yate(True))
+
+    def test_unmodified_params_keep_encoding(self):
+        msg = self.parse(b"id=sip/1:novalue:caller=me")
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:id=sip/1:novalue:caller=me",
+                         msg.encode_answer_for_yate(True))
+        self.assertEqual("me", msg.params["caller"])
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:id=sip/1:novalue:caller=me",
+                         msg.encode_answer_for_yate(True))
+
+    def test_modified_params_are_encoded(self):
+        msg = self.parse(b"id=sip/1:novalue:caller=me")
+        msg.params["caller"] = "you:%"
+        msg.params["new"] = "1"
+        del msg.params["novalue"]
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:id=sip/1:caller=you%z%%:new=1",
+                         msg.encode_answer_for_yate(True))
+
+
+    def test_modified_params_are_tracked(self):
+        msg = self.parse(b"id=sip/1:caller=me")
+        self.assertEqual([], msg.params.modified)
+        msg.params["caller"] = "you"
+        del msg.params["id"]
+        self.assertEqual(["caller", "id"], msg.params.modified)
+
+    def test_modified_duplicate_params(self):
+        msg = self.parse(b"a=1:b:a=2:c=3:b=4")
+        msg.params["a"] = "5"
+        del msg.params["b"]
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:a=5:c=3", msg.encode_answer_for_yate(True))
+
+    def test_modified_params_keep_separators(self):
+        msg = self.parse(b"a=1::b=2:")
+        msg.params["b"] = "3"
+        self.assertEqual(b"%%<message:id1:true:chan.test:ret:a=1::b=3:", msg.encode_answer_for_yate(True))
+
+
 class MessageSerializationTestCases(unittest.TestCase):
     def test_encode_yate_install_mgs(self):
         message = protocol.InstallRequest(1, "call.execute")
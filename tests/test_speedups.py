@@ -0,0 +1,117 @@
+import unittest
+from unittest.mock import patch
+
+from yate import protocol
+
+try:
+    from yate import _speedups
+except ImportError:
+    _speedups = None
+
+
+CALL_EXECUTE = '%%>message:0x7ff823883bb0.1932044751:1522601502:call.execute::id=sip/151:module=sip:status=incoming:address=172.20.23.1%z5060:caller=9940 DebügDÄCT:callername=DebügDÄCT:sip_contact="DebügDÄCT" <sip%z9940@172.20.1.3>;+sip.instance="<urn%zuuid%z1F102AF1-2C00-0100-8000-03029649cf19>":device=Mitel SIP-DECT (SW-Version=7.1-CK14):sdp_fmtp%z=0-15:sdp_sendrecv=:novalue:handlers=javascript%z15,regexroute%z40'.encode("utf-8")
+
+
+@unittest.skipIf(_speedups is None, "C accelerator is not built")
+class SpeedupsEquivalenceTests(unittest.TestCase):
+    def setUp(self):
+        # make sure the reference implementation does not call into the C implementation itself
+        patcher = patch.multiple(protocol, **protocol._pure_python_codec)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_same_result(self, name, *args):
+        expected = protocol._pure_python_codec[name](*args)
+        actual = getattr(_speedups, name)(*args)
+        self.assertEqual(type(expected), type(actual))
+        self.assertEqual(expected, actual)
+        return actual
+
+    def assert_same_error(self, name, *args):
+        with self.assertRaises(protocol.YateMessageParsingError) as expected:
+            protocol._pure_python_codec[name](*args)
+        with self.assertRaises(protocol.YateMessageParsingError) as actual:
+            getattr(_speedups, name)(*args)
+        self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_encode_decode_bytes(self):
+        samples = [b"", b"test", b"test%", b"/bin:/usr/bin", b"%%::%%", bytes(range(256)), CALL_EXECUTE]
+        for sample in samples:
+            encoded = self.assert_same_result("yate_encode_bytes", sample)
+            self.assert_same_result("yate_decode_bytes", encoded)
+            self.assert_same_result("yate_encode_bytes", memoryview(sample))
+
+    def test_decode_errors(self):
+        self.assert_same_error("yate_decode_bytes", b"test%")
+        self.assert_same_error("yate_decode_bytes", b"/bin%:/usr/bin")
+
+    def test_decode_split(self):
+        self.assert_same_result("yate_decode_split", CALL_EXECUTE)
+        self.assert_same_result("yate_decode_split", b"")
+        self.assert_same_result("yate_decode_split", b"::")
+        self.assert_same_error("yate_decode_split", b"a:b%")
+
+    def test_encode_join(self):
+        self.assert_same_result("yate_encode_join", "%>message", "id", "4711", "call.execute", "", "caller=DebügDÄCT")
+        self.assert_same_result("yate_encode_join", "a:b", "\n", "%")
+        self.assert_same_result("yate_encode_join")
+
+    def test_parse_keyvalue(self):
+        self.assert_same_result("yate_parse_keyvalue", ["id=sip/1", "novalue", "empty=", "=x", "a=b=c", "id=sip/2"])
+        self.assert_same_result("yate_parse_keyvalue", [])
+
+    @staticmethod
+    def use_speedups():
+        return patch.multiple(protocol, HAS_SPEEDUPS=True,
+                              **{name: getattr(_speedups, name) for name in protocol._pure_python_codec})
+
+    def parse_with_both(self, sample):
+        # without the accelerator, message parameters are decoded lazily
+        with patch.object(protocol, "HAS_SPEEDUPS", False):
+            expected = protocol.parse_yate_message(sample)
+        with self.use_speedups():
+            actual = protocol.parse_yate_message(sample)
+        return expected, actual
+
+    def test_parse_yate_message(self):
+        samples = [CALL_EXECUTE, b"%%<message:id123:true:call.execute:ret:test=yes", b"%%<install:50:test:true",
+                   b"%%>install:70:chan.test:important:true", b"%%<setlocal:id:mychan0:true",
+                   b"%%<watch:call.execute:false", b"%%<message:id123:true:call.execute:ret:a%}b=c:d=e%}"]
+        for sample in samples:
+            expected, actual = self.parse_with_both(sample)
+            self.assertIs(type(expected), type(actual))
+            if isinstance(expected, protocol.Message):
+                self.assertEqual(dict(expected.params), dict(actual.params))
+                self.assertEqual(expected.encode_answer_for_yate(True), actual.encode_answer_for_yate(True))
+                expected.params = actual.params = None
+            slots = [slot for cls in type(expected).__mro__ for slot in getattr(cls, "__slots__", ())]
+            self.assertNotEqual([], slots)
+            for slot in slots:
+                self.assertEqual(getattr(expected, slot), getattr(actual, slot))
+
+    def test_encode_modified_params(self):
+        for sample in [CALL_EXECUTE, b"%%>message:id1:4711:chan.test::id=sip/1:module=sip:caller=9940%z1"]:
+            expected, actual = self.parse_with_both(sample)
+            for msg in (expected, actual):
+                msg.params["id"] = "sip/2:%"
+                msg.params["new"] = "1"
+                del msg.params["module"]
+            self.assertEqual(expected.encode_answer_for_yate(True), actual.encode_answer_for_yate(True))
+
+    def test_parse_yate_message_errors(self):
+        samples = [b"%%>unknown:test", b"%%>message:id:notatime:call.execute:", b"%%>message:id:4711:call.execute",
+                   b"%%>message:id:4711:call.execute:broken%"]
+        for sample in samples:
+            with self.assertRaises(protocol.YateMessageParsingError) as expected, \
+                    patch.object(protocol, "HAS_SPEEDUPS", False):
+                dict(protocol.parse_yate_message(sample).params)
+            with self.assertRaises(protocol.YateMessageParsingError) as actual, self.use_speedups():
+                dict(protocol.parse_yate_message(sample).params)
+            self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_accelerator_is_used(self):
+        self.assertTrue(protocol.HAS_SPEEDUPS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from yate.protocol import MessageRequest
+from yate.supervisor import YateSupervisor
+
+from tests.yatesim import YateSimServer
+
+
+def answer_with_pid(msg):
+    msg.params["pid"] = str(os.getpid())
+    return True
+
+
+def ignore_notify(msg):
+    pass
+
+
+class TestYateSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sockpath = os.path.join(self.directory.name, "yate.sock")
+        self.server = YateSimServer(self.sockpath)
+        self.server.start()
+        self.supervisor = YateSupervisor(2, sockpath=self.sockpath, stats_interval=0.05, restart_delay=0.05)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.server.stop()
+        self.directory.cleanup()
+
+    def supervise_until(self, condition, timeout=10):
+        self.server.wait_for(lambda: self.supervisor.supervise(0.01) or condition(), timeout)
+
+    def installs(self):
+        return [set(connection.installed_message_handlers) for connection in self.server.connections]
+
+    def test_requires_socket_connection(self):
+        with self.assertRaises(ValueError):
+            YateSupervisor(2)
+
+    def test_handlers_are_spread_across_workers(self):
+        self.supervisor.register_message_handler("call.route", answer_with_pid)
+        self.supervisor.register_message_handler("call.execute", answer_with_pid)
+        self.supervisor.register_watch_handler("chan.notify", ignore_notify, worker=YateSupervisor.ALL_WORKERS)
+        self.supervisor.start()
+        self.supervise_until(lambda: sorted(map(len, self.installs())) == [1, 1] and
+                             all(c.watched_messages for c in self.server.connections))
+
+        self.assertCountEqual([{"call.route"}, {"call.execute"}], self.installs())
+        self.assertEqual([{"chan.notify"}] * 2, [c.watched_messages for c in self.server.connections])
+        route_answer = self.server.send_message_request(MessageRequest("call.route", {}))
+        execute_answer = self.server.send_message_request(MessageRequest("call.execute", {}))
+        self.assertTrue(route_answer.processed)
+        self.assertNotEqual(route_answer.params["pid"], execute_answer.params["pid"])
+
+    def test_registration_after_start_fails(self):
+        self.supervisor.start()
+        with self.assertRaises(RuntimeError):
+            self.supervisor.register_message_handler("call.route", answer_with_pid)
+
+    def test_message_handlers_cannot_be_replicated(self):
+        with self.assertRaises(ValueError):
+            self.supervisor.register_message_handler("call.route", answer_with_pid,
+                                                     worker=YateSupervisor.ALL_WORKERS)
+
+    def test_crashed_worker_is_restarted(self):
+        self.supervisor.register_message_handler("call.route", answer_with_pid, worker=0)
+        self.supervisor.start()
+        self.supervise_until(lambda: self.server.installing_connection("call.route") is not None)
+        first_pid = self.server.send_message_request(MessageRequest("call.route", {})).params["pid"]
+
+        self.supervisor.workers[0].process.kill()
+        self.supervise_until(lambda: self.supervisor.own_stats["worker_restarts"] == 1)
+        self.supervise_until(lambda: self.server.installing_connection("call.route") is not None)
+
+        answer = self.server.send_message_request(MessageRequest("call.route", {}))
+        self.assertTrue(answer.processed)
+        self.assertNotEqual(first_pid, answer.params["pid"])
+
+    def test_stats_are_aggregated(self):
+        self.supervisor.start()
+        self.supervise_until(lambda: len(self.server.connections) == 2)
+        self.server.send_raw_to_all(b"%%>garbage")
+        self.supervise_until(lambda: self.supervisor.stats["parse_errors"] == 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,8 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
-from yate import yate
 from yate.protocol import Message, MessageRequest
-from yate.yate import YateBase
+from yate.yate import YateBase, MessageRouter, YateConnectionLostError
 
 
 class YateBaseMessageHandlerSetupTests(unittest.TestCase):
@@ -53,12 +52,12 @@ class YateBaseMessageHandlerSetupTests(unittest.TestCase):
     @patch.object(YateBase, "_send_message_raw")
     def test_message_handler_uninstall(self, mock_method):
         y = YateBase()
-        mh = yate.MessageHandler("call.execute", 80, lambda: True, None, None)
-        mh.installed = True
-        y._message_handlers["call.execute"] = mh
+        y.register_message_handler("call.execute", lambda: True, 80)
+        y._recv_message_raw(b"%%<install:80:call.execute:true")
+        handler = y._message_handlers["call.execute"]
 
         y.unregister_message_handler("call.execute")
-        self.assertEqual(True, mh.uninstalled)
+        self.assertEqual(True, handler.uninstalled)
         mock_method.assert_called_with(b"%%>uninstall:call.execute")
 
         y._recv_message_raw(b"%%<uninstall:80:call.execute:true")
@@ -67,9 +66,7 @@ class YateBaseMessageHandlerSetupTests(unittest.TestCase):
     def test_installed_message_handler_dispatch(self):
         y = YateBase()
         callback_mock = MagicMock()
-        mh = yate.MessageHandler("call.execute", 80, callback_mock, None, None)
-        mh.installed = True
-        y._message_handlers["call.execute"] = mh
+        y.register_message_handler("call.execute", callback_mock, 80, install=False)
 
         msg = Message("0xdeadc0de", 4711, "call.execute", "false", {"caller": "me", "target": "0815"})
         self.assertEqual("message", msg.msg_type)
@@ -84,6 +81,273 @@ class YateBaseMessageHandlerSetupTests(unittest.TestCase):
         callback_mock.assert_not_called()
 
 
+class YateMultipleMessageHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.y = YateBase()
+        self.sent = []
+        self.y._send_message_raw = self.sent.append
+
+    def test_handlers_share_one_install(self):
+        done_callbacks = [MagicMock(), MagicMock(), MagicMock()]
+        for i, done_callback in enumerate(done_callbacks[:2]):
+            self.y.register_message_handler("chan.dtmf", MagicMock(), 100, "id", "sip/{}".format(i),
+                                            done_callback=done_callback, yate_filter=False)
+        self.assertEqual([b"%%>install:100:chan.dtmf"], self.sent)
+
+        self.y._recv_message_raw(b"%%<install:100:chan.dtmf:true")
+        done_callbacks[0].assert_called_once_with(True)
+        done_callbacks[1].assert_called_once_with(True)
+
+        self.y.register_message_handler("chan.dtmf", MagicMock(), 100, "id", "sip/2",
+                                        done_callback=done_callbacks[2], yate_filter=False)
+        done_callbacks[2].assert_called_once_with(True)
+        self.assertEqual(1, len(self.sent))
+
+    def test_dispatch_by_filter_value(self):
+        callbacks = {"sip/{}".format(i): MagicMock(return_value=True) for i in range(100)}
+        for channel, callback in callbacks.items():
+            self.y.register_message_handler("chan.dtmf", callback, 100, "id", channel, yate_filter=False)
+
+        self.y._recv_message_raw(b"%%>message:0xf00:1:chan.dtmf::id=sip/42:text=5")
+        callbacks["sip/42"].assert_called_once()
+        self.assertEqual("5", callbacks["sip/42"].call_args[0][0].params["text"])
+        self.assertEqual(1, sum(callback.call_count for callback in callbacks.values()))
+        self.assertEqual(b"%%<message:0xf00:true:chan.dtmf::id=sip/42:text=5", self.sent[-1])
+
+        # messages no local handler is interested in are passed on to yate
+        self.y._recv_message_raw(b"%%>message:0xf01:1:chan.dtmf::id=sip/500:text=5")
+        self.assertEqual(b"%%<message:0xf01:false:chan.dtmf::id=sip/500:text=5", self.sent[-1])
+
+    def test_handlers_run_in_priority_order(self):
+        calls = []
+        self.y.register_message_handler("call.route", lambda msg: calls.append("late") or True, 90,
+                                        install=False)
+        self.y.register_message_handler("call.route", lambda msg: calls.append("filtered"), 50, "called", "123",
+                                        install=False)
+        self.y.register_message_handler("call.route", lambda msg: calls.append("early") or False, 10,
+                                        install=False)
+
+        self.y._recv_message_raw(b"%%>message:0x1:1:call.route::called=999")
+        self.assertEqual(["early", "late"], calls)
+        self.assertEqual(b"%%<message:0x1:true:call.route::called=999", self.sent[-1])
+
+        # the filtered handler answers on its own by returning None
+        calls.clear()
+        self.sent.clear()
+        self.y._recv_message_raw(b"%%>message:0x2:1:call.route::called=123")
+        self.assertEqual(["early", "filtered"], calls)
+        self.assertEqual([], self.sent)
+
+    def test_second_filter_replaces_filtered_install(self):
+        self.y.register_message_handler("chan.notify", MagicMock(), 100, "targetid", "sip/1")
+        self.y._recv_message_raw(b"%%<install:100:chan.notify:true")
+        self.assertEqual([b"%%>install:100:chan.notify:targetid:sip/1"], self.sent)
+
+        self.y.register_message_handler("chan.notify", MagicMock(), 100, "targetid", "sip/2")
+        self.assertEqual(b"%%>uninstall:chan.notify", self.sent[-1])
+        self.y._recv_message_raw(b"%%<uninstall:100:chan.notify:true")
+        self.assertEqual(b"%%>install:100:chan.notify", self.sent[-1])
+        self.y._recv_message_raw(b"%%<install:100:chan.notify:true")
+        self.assertTrue(self.y._message_handlers["chan.notify"].installed)
+
+    def test_unregister_single_callback(self):
+        first, second = MagicMock(return_value=True), MagicMock(return_value=True)
+        self.y.register_message_handler("chan.dtmf", first, 100, "id", "sip/1", yate_filter=False)
+        self.y.register_message_handler("chan.dtmf", second, 100, "id", "sip/2", yate_filter=False)
+        self.y._recv_message_raw(b"%%<install:100:chan.dtmf:true")
+
+        self.y.unregister_message_handler("chan.dtmf", first)
+        self.assertEqual(b"%%>install:100:chan.dtmf", self.sent[-1])
+        self.y._recv_message_raw(b"%%>message:0x1:1:chan.dtmf::id=sip/1")
+        first.assert_not_called()
+        self.y._recv_message_raw(b"%%>message:0x2:1:chan.dtmf::id=sip/2")
+        second.assert_called_once()
+
+        self.y.unregister_message_handler("chan.dtmf", second)
+        self.assertEqual(b"%%>uninstall:chan.dtmf", self.sent[-1])
+        self.y._recv_message_raw(b"%%<uninstall:100:chan.dtmf:true")
+        self.assertNotIn("chan.dtmf", self.y._message_handlers)
+
+    def test_register_while_uninstalling_installs_again(self):
+        self.y.register_message_handler("chan.dtmf", MagicMock())
+        self.y._recv_message_raw(b"%%<install:100:chan.dtmf:true")
+        self.y.unregister_message_handler("chan.dtmf")
+        self.y.register_message_handler("chan.dtmf", MagicMock())
+        self.assertEqual(b"%%>uninstall:chan.dtmf", self.sent[-1])
+
+        self.y._recv_message_raw(b"%%<uninstall:100:chan.dtmf:true")
+        self.assertEqual(b"%%>install:100:chan.dtmf", self.sent[-1])
+
+    def test_multiple_watch_handlers(self):
+        everything, filtered = MagicMock(), MagicMock()
+        self.y.register_watch_handler("chan.hangup", everything)
+        self.y.register_watch_handler("chan.hangup", filtered, filter_attribute="id", filter_value="sip/1")
+        self.assertEqual([b"%%>watch:chan.hangup"], self.sent)
+
+        self.y._recv_message_raw(b"%%<message:0x1:true:chan.hangup::id=sip/2")
+        everything.assert_called_once()
+        filtered.assert_not_called()
+        self.y._recv_message_raw(b"%%<message:0x2:true:chan.hangup::id=sip/1")
+        self.assertEqual(2, everything.call_count)
+        filtered.assert_called_once()
+
+
+class MessageRouterTests(unittest.TestCase):
+    def test_routes_by_parameter_value(self):
+        y = YateBase()
+        router = MessageRouter("id")
+        y.register_watch_handler("chan.hangup", router)
+        callbacks = {"sip/{}".format(i): MagicMock() for i in range(10)}
+        for channel, callback in callbacks.items():
+            router.add(channel, callback)
+        self.assertEqual(10, len(router))
+
+        y._recv_message_raw(b"%%<message:0x1:true:chan.hangup::id=sip/3")
+        callbacks["sip/3"].assert_called_once()
+        self.assertEqual(1, sum(callback.call_count for callback in callbacks.values()))
+
+        router.discard("sip/3")
+        self.assertNotIn("sip/3", router)
+        y._recv_message_raw(b"%%<message:0x2:true:chan.hangup::id=sip/3")
+        callbacks["sip/3"].assert_called_once()
+
+    @patch.object(YateBase, "_send_message_raw")
+    def test_unrouted_messages_are_not_processed(self, mock_method):
+        y = YateBase()
+        y.register_message_handler("chan.dtmf", MessageRouter("id"))
+        mock_method.reset_mock()
+        y._recv_message_raw(b"%%>message:0x1:1:chan.dtmf::id=sip/1")
+        mock_method.assert_called_with(b"%%<message:0x1:false:chan.dtmf::id=sip/1")
+
+    def test_multiple_attributes_and_default(self):
+        default, callback = MagicMock(return_value=None), MagicMock(return_value=True)
+        router = MessageRouter("module", "id", default=default)
+        router.add(("sip", "sip/1"), callback)
+
+        self.assertTrue(router(Message("0x1", 1, "chan.notify", "", {"module": "sip", "id": "sip/1"})))
+        callback.assert_called_once()
+        self.assertIsNone(router(Message("0x2", 1, "chan.notify", "", {"id": "sip/1"})))
+        default.assert_called_once()
+
+    def test_needs_attribute(self):
+        with self.assertRaises(ValueError):
+            MessageRouter()
+
+
+class YateRequestTimeoutTests(unittest.TestCase):
+    def setUp(self):
+        self.y = YateBase()
+        self.y._send_message_raw = MagicMock()
+        self.y._get_timestamp = MagicMock(return_value=42)
+        self.y._get_monotonic_time = MagicMock(return_value=100.0)
+
+    def answer(self, index):
+        msg_id = "{}.{}".format(self.y._session_id, index)
+        self.y._recv_message_raw("%%<message:{}:true:chan.test::".format(msg_id).encode())
+
+    def test_requests_expire_in_deadline_order(self):
+        callback = MagicMock()
+        self.y.send_message(MessageRequest("chan.test", {}), callback, timeout=5)
+        self.y.send_message(MessageRequest("chan.test", {}), callback, timeout=1)
+        self.y.send_message(MessageRequest("chan.test", {}), callback)
+
+        self.y._get_monotonic_time.return_value = 102.0
+        self.assertEqual(105.0, self.y.expire_requests())
+        self.assertEqual(1, self.y.stats["expired_requests"])
+        self.assertIsNone(callback.call_args[0][1])
+        self.assertNotIn(self.y._session_id + ".2", self.y._requested_messages)
+
+        self.y._get_monotonic_time.return_value = 1000.0
+        self.assertIsNone(self.y.expire_requests())
+        self.assertEqual(2, self.y.stats["expired_requests"])
+        # requests without a timeout wait forever
+        self.assertEqual([self.y._session_id + ".3"], list(self.y._requested_messages))
+
+    def test_answered_requests_do_not_expire(self):
+        callback = MagicMock()
+        self.y.request_timeout = 1
+        self.y.send_message(MessageRequest("chan.test", {}), callback)
+        self.answer(1)
+        callback.assert_called_once()
+
+        self.y._get_monotonic_time.return_value = 200.0
+        self.y.expire_requests()
+        callback.assert_called_once()
+        self.assertEqual(0, self.y.stats["expired_requests"])
+
+    def test_deadlines_of_answered_requests_are_dropped(self):
+        self.y.request_timeout = 10
+        for i in range(1, 1001):
+            self.y.send_message(MessageRequest("chan.test", {}), MagicMock())
+            self.answer(i)
+        self.assertLess(len(self.y._request_deadlines), 100)
+
+
+class YateReplayTests(unittest.TestCase):
+    def setUp(self):
+        self.y = YateBase()
+        self.sent = []
+        self.y._send_message_raw = self.sent.append
+
+    def test_replay_registrations(self):
+        self.y.register_message_handler("call.route", MagicMock(), 80, "called", "123")
+        self.y.register_message_handler("call.execute", MagicMock())
+        self.y.register_watch_handler("chan.hangup", MagicMock())
+        self.y.set_local("timeout", "1000")
+        self.y._recv_message_raw(b"%%<install:80:call.route:true")
+        self.y._recv_message_raw(b"%%<install:100:call.execute:true")
+        self.y._recv_message_raw(b"%%<watch:chan.hangup:true")
+        self.y.unregister_message_handler("call.execute")
+        self.sent.clear()
+
+        self.y.replay_registrations()
+        self.assertEqual([b"%%>setlocal:timeout:1000", b"%%>install:80:call.route:called:123",
+                          b"%%>watch:chan.hangup"], self.sent)
+        self.assertNotIn("call.execute", self.y._message_handlers)
+        done_callback = MagicMock()
+        self.y.register_message_handler("call.route", MagicMock(), 80, "called", "123", done_callback=done_callback)
+        self.y._recv_message_raw(b"%%<install:80:call.route:true")
+        done_callback.assert_called_once_with(True)
+
+    def test_replay_skips_handlers_not_installed(self):
+        self.y.register_message_handler("call.execute", MagicMock(), install=False)
+        self.y.register_message_handler("call.route", MagicMock(), install=False)
+        self.y.register_message_handler("call.route", MagicMock(), 90)
+        self.sent.clear()
+
+        self.y.replay_registrations()
+        self.assertEqual([b"%%>install:90:call.route"], self.sent)
+
+    def test_install_priority_of_installing_handlers(self):
+        self.y.register_message_handler("call.route", MagicMock(), 50, install=False)
+        self.y.register_message_handler("call.route", MagicMock(), 90)
+        self.assertEqual([b"%%>install:90:call.route"], self.sent)
+        self.y._recv_message_raw(b"%%<install:90:call.route:true")
+
+        self.y.register_message_handler("call.route", MagicMock(), 95)
+        self.assertEqual(1, len(self.sent))
+        self.y.register_message_handler("call.route", MagicMock(), 80)
+        self.assertEqual(b"%%>uninstall:call.route", self.sent[-1])
+        self.y._recv_message_raw(b"%%<uninstall:90:call.route:true")
+        self.assertEqual(b"%%>install:80:call.route", self.sent[-1])
+
+    def test_pending_requests(self):
+        callback = MagicMock()
+        msg = MessageRequest("call.execute", {"id": "sip/1"})
+        self.y.send_message(msg, callback)
+        sent = self.sent.pop()
+
+        self.y.resend_pending_requests()
+        self.assertEqual([sent], self.sent)
+        self.y.fail_pending_requests()
+        callback.assert_called_once()
+        self.assertEqual(msg, callback.call_args.args[0])
+        self.assertIsInstance(callback.call_args.args[1], YateConnectionLostError)
+        self.assertEqual(1, self.y.stats["failed_requests"])
+        self.y.fail_pending_requests()
+        callback.assert_called_once()
+
+
 class YateMessageProcessingTests(unittest.TestCase):
     def setUp(self):
         self.y = YateBase()
@@ -105,6 +369,13 @@ class YateMessageProcessingTests(unittest.TestCase):
         moc_method.assert_called_with(b"%%>message:" + self.y._session_id.encode()
                                       + b".2:1546:chan.attach:res:target=sip/5")
 
+    def test_pending_request_has_no_instance_dict(self):
+        self.y._get_timestamp.return_value = 42
+        self.y.send_message(MessageRequest("chan.attach", {"target": "sip/2"}), MagicMock())
+        req = self.y._requested_messages[self.y._session_id + ".1"]
+        self.assertFalse(hasattr(req, "__dict__"))
+        self.assertFalse(hasattr(req.msg, "__dict__"))
+
     def test_message_response_callback_mechanism(self):
         callback_mock = MagicMock()
         self.y._get_timestamp.return_value = 42
@@ -123,9 +394,7 @@ class YateMessageProcessingTests(unittest.TestCase):
     @patch.object(YateBase, "_send_message_raw")
     def test_message_answer_mechanism(self, mock_method):
         callback_mock = MagicMock()
-        mh = yate.MessageHandler("call.execute", 80, callback_mock, None, None)
-        mh.installed = True
-        self.y._message_handlers["call.execute"] = mh
+        self.y.register_message_handler("call.execute", callback_mock, 80, install=False)
 
         msg = Message("0xdeadc0de", 4711, "call.execute", "false", {"caller": "me", "target": "0815"})
         self.y._handle_yate_message(msg)
@@ -144,9 +413,7 @@ class YateMessageProcessingTests(unittest.TestCase):
         callback_mock = MagicMock()
         callback_mock.return_value = True
 
-        mh = yate.MessageHandler("call.execute", 80, callback_mock, None, None)
-        mh.installed = True
-        self.y._message_handlers["call.execute"] = mh
+        self.y.register_message_handler("call.execute", callback_mock, 80, install=False)
 
         msg = Message("0xdeadc0de", 4711, "call.execute", "false", {"caller": "me", "target": "0815"})
         self.y._handle_yate_message(msg)
@@ -165,6 +432,29 @@ class YateMessageProcessingTests(unittest.TestCase):
 
 
 
+class YateDispatchTests(unittest.TestCase):
+    def test_parse_errors_are_counted(self):
+        y = YateBase()
+        self.assertEqual(0, y.stats["parse_errors"])
+        y._recv_message_raw(b"%%>unknown:message")
+        y._recv_message_raw(b"%%>message:id:notatime:call.execute:")
+        self.assertEqual(2, y.stats["parse_errors"])
+
+    def test_subclass_handler_override(self):
+        class CustomYate(YateBase):
+            def __init__(self):
+                super().__init__()
+                self.confirms = []
+
+            def _handle_yate_watch(self, msg):
+                self.confirms.append(msg)
+
+        y = CustomYate()
+        y._recv_message_raw(b"%%<watch:chan.notify:true")
+        self.assertEqual(1, len(y.confirms))
+        self.assertEqual("chan.notify", y.confirms[0].name)
+
+
 class YateWatchProcessingTests(unittest.TestCase):
     def setUp(self):
         self.y = YateBase()
@@ -192,9 +482,9 @@ class YateWatchProcessingTests(unittest.TestCase):
 
     @patch.object(YateBase, "_send_message_raw")
     def test_uninstall_watch_handler(self, mock_method):
-        handler = yate.WatchHandler("chan.notify", lambda: True)
-        handler.installed = True
-        self.y._watch_handlers["chan.notify"] = handler
+        self.y.register_watch_handler("chan.notify", lambda: True)
+        self.y._recv_message_raw(b"%%<watch:chan.notify:true")
+        handler = self.y._watch_handlers["chan.notify"]
 
         self.y.unregister_watch_handler("chan.notify")
         mock_method.assert_called_with(b"%%>unwatch:chan.notify")
@@ -205,9 +495,7 @@ class YateWatchProcessingTests(unittest.TestCase):
 
     def test_watch_handler_recv_message(self):
         callback_mock = MagicMock()
-        handler = yate.WatchHandler("chan.notify", callback_mock)
-        handler.installed = True
-        self.y._watch_handlers["chan.notify"] = handler
+        self.y.register_watch_handler("chan.notify", callback_mock)
 
         msg = Message("0xDEAD.1", None, "chan.notify", "val", {"target": "wave/2"}, True, True)
         self.y._handle_yate_message(msg)
@@ -216,9 +504,7 @@ class YateWatchProcessingTests(unittest.TestCase):
 
     def test_universal_watch_handler_recv_message(self):
         callback_mock = MagicMock()
-        handler = yate.WatchHandler("", callback_mock)
-        handler.installed = True
-        self.y._watch_handlers[""] = handler
+        self.y.register_watch_handler("", callback_mock)
 
         msg = Message("0xDEAD.1", None, "chan.dtmf", "val", {"target": "wave/2"}, True, True)
         self.y._handle_yate_message(msg)
@@ -1,4 +1,6 @@
 import asyncio
+import threading
+import time
 from asyncio import Queue, CancelledError
 from unittest.mock import MagicMock
 
@@ -119,3 +121,163 @@ class YateSimAsyncMixin:
     # Hook normal message sending code and send it to the simulator instead
     def _send_message_raw(self, msg):
         self._yate_sim.process_message(msg)
+
+
+class YateSimConnection:
+    def __init__(self, writer):
+        self.writer = writer
+        self.installed_message_handlers = {}
+        self.watched_messages = set()
+        self.local_params = {}
+        self.received_message_requests = []
+        self.pending_answers = {}
+
+
+class YateSimServer:
+    """
+    Simulates yate accepting external modules on a Unix socket. The server runs its own event loop in a
+    background thread, so it can serve modules running in other processes.
+    """
+    def __init__(self, sockpath):
+        self.sockpath = sockpath
+        self.connections = []
+        # number of connections accepted so far
+        self.connection_count = 0
+        # messages sent to us are answered right away unless this is disabled
+        self.answer_messages = True
+        self._msg_id = 1
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_unix_server(self._handle, self.sockpath))
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            writers = [connection.writer for connection in self.connections]
+            for writer in writers:
+                writer.close()
+            await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+            await self._server.wait_closed()
+        self._run(close(), 10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.connections = []
+
+    def drop_connections(self, timeout=10):
+        async def drop():
+            for connection in self.connections:
+                connection.writer.close()
+        self._run(drop(), timeout)
+
+    def _run(self, coroutine, timeout):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def installing_connection(self, msg_name):
+        for connection in self.connections:
+            if msg_name in connection.installed_message_handlers:
+                return connection
+        return None
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError("Condition not met in time")
+            time.sleep(0.01)
+
+    def send_message_request(self, msg_req: protocol.MessageRequest, timeout=10):
+        """
+        Send a message to the connection that installed a handler for it and return the answer.
+        """
+        async def send():
+            connection = self.installing_connection(msg_req.name)
+            msg_id = "sim.{}".format(self._msg_id)
+            self._msg_id += 1
+            answer = self._loop.create_future()
+            connection.pending_answers[msg_id] = answer
+            connection.writer.write(msg_req.encode(msg_id, self._msg_id * 10) + b"\n")
+            return await answer
+        return self._run(send(), timeout)
+
+    def notify_watchers(self, msg_name, params, processed=True, timeout=10):
+        """
+        Send the notification about a processed message to all connections watching it.
+        """
+        async def send():
+            msg = protocol.Message("sim.{}".format(self._msg_id), None, msg_name, "", params, reply=True)
+            self._msg_id += 1
+            for connection in self.connections:
+                if msg_name in connection.watched_messages:
+                    connection.writer.write(msg.encode_answer_for_yate(processed) + b"\n")
+        self._run(send(), timeout)
+
+    def send_raw_to_all(self, raw, timeout=10):
+        async def send():
+            for connection in self.connections:
+                connection.writer.write(raw + b"\n")
+        self._run(send(), timeout)
+
+    async def _handle(self, reader, writer):
+        connection = YateSimConnection(writer)
+        self.connections.append(connection)
+        self.connection_count += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._process_line(connection, line.strip())
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.remove(connection)
+            writer.close()
+
+    def _process_line(self, connection, line):
+        if line.startswith(b"%%>connect:"):
+            return
+        msg = protocol.parse_yate_message(line)
+        if isinstance(msg, protocol.InstallRequest):
+            handler = YateSimMessageHandler(msg.name, msg.priority, msg.filter_name, msg.filter_value)
+            connection.installed_message_handlers[msg.name] = handler
+            answer = protocol.InstallConfirm(msg.priority, msg.name, True)
+        elif isinstance(msg, protocol.UninstallRequest):
+            handler = connection.installed_message_handlers.pop(msg.name, None)
+            answer = protocol.UninstallConfirm(handler.priority if handler else 0, msg.name, handler is not None)
+        elif isinstance(msg, protocol.WatchRequest):
+            connection.watched_messages.add(msg.name)
+            answer = protocol.WatchConfirm(msg.name, True)
+        elif isinstance(msg, protocol.UnwatchRequest):
+            connection.watched_messages.discard(msg.name)
+            answer = protocol.UnwatchConfirm(msg.name, True)
+        elif isinstance(msg, protocol.SetLocalRequest):
+            if msg.value:
+                connection.local_params[msg.param] = msg.value
+            answer = protocol.SetLocalAnswer(msg.param, msg.value, True)
+        elif isinstance(msg, protocol.Message):
+            if msg.reply:
+                pending = connection.pending_answers.pop(msg.id, None)
+                if pending is not None:
+                    pending.set_result(msg)
+                return
+            connection.received_message_requests.append(msg)
+            if self.answer_messages:
+                connection.writer.write(msg.encode_answer_for_yate(True) + b"\n")
+            return
+        else:
+            return
+        connection.writer.write(answer.encode() + b"\n")
@@ -0,0 +1,369 @@
+/*
+ * Optional C implementation of the hot paths of the yate wire protocol.
+ *
+ * Every function in here has a pure python counterpart in yate/protocol.py with exactly the same
+ * behavior. yate.protocol replaces its python implementation with these functions if this module
+ * could be built and imported. tests/test_speedups.py checks that both implementations agree.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+
+/* yate.protocol is imported lazily as it imports this module itself */
+static PyObject *protocol_module = NULL;
+
+
+static PyObject *
+get_protocol_attr(const char *name)
+{
+    if (protocol_module == NULL) {
+        protocol_module = PyImport_ImportModule("yate.protocol");
+        if (protocol_module == NULL) {
+            return NULL;
+        }
+    }
+    return PyObject_GetAttrString(protocol_module, name);
+}
+
+
+static void
+set_parsing_error(const char *message)
+{
+    PyObject *error_class = get_protocol_attr("YateMessageParsingError");
+    if (error_class == NULL) {
+        return;
+    }
+    PyErr_SetString(error_class, message);
+    Py_DECREF(error_class);
+}
+
+
+static inline int
+needs_encoding(unsigned char c)
+{
+    return c < 32 || c == ':' || c == '%';
+}
+
+
+static PyObject *
+decode_bytes(const char *input, Py_ssize_t length)
+{
+    const char *end = input + length;
+    const char *percent = memchr(input, '%', length);
+    PyObject *result;
+    char *output;
+
+    if (percent == NULL) {
+        return PyBytes_FromStringAndSize(input, length);
+    }
+    /* decoding never grows the data, allocate for the worst case and shrink afterwards */
+    result = PyBytes_FromStringAndSize(NULL, length);
+    if (result == NULL) {
+        return NULL;
+    }
+    output = PyBytes_AS_STRING(result);
+    while (percent != NULL) {
+        unsigned char encoded;
+
+        memcpy(output, input, percent - input);
+        output += percent - input;
+        if (percent + 1 >= end) {
+            Py_DECREF(result);
+            set_parsing_error("Received invalid yate message. Upcode without encoded character");
+            return NULL;
+        }
+        encoded = (unsigned char)percent[1];
+        if (encoded == '%') {
+            *output++ = '%';
+        }
+        else if (encoded >= 64) {
+            *output++ = (char)(encoded - 64);
+        }
+        else {
+            Py_DECREF(result);
+            set_parsing_error("Received invalid upcode: Encoded character too small");
+            return NULL;
+        }
+        input = percent + 2;
+        percent = memchr(input, '%', end - input);
+    }
+    memcpy(output, input, end - input);
+    output += end - input;
+    if (_PyBytes_Resize(&result, output - PyBytes_AS_STRING(result)) < 0) {
+        return NULL;
+    }
+    return result;
+}
+
+
+static Py_ssize_t
+encoded_length(const unsigned char *input, Py_ssize_t length)
+{
+    Py_ssize_t result = length;
+    Py_ssize_t i;
+
+    for (i = 0; i < length; i++) {
+        result += needs_encoding(input[i]);
+    }
+    return result;
+}
+
+
+static char *
+encode_into(char *output, const unsigned char *input, Py_ssize_t length)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < length; i++) {
+        unsigned char c = input[i];
+        if (c == '%') {
+            *output++ = '%';
+            *output++ = '%';
+        }
+        else if (needs_encoding(c)) {
+            *output++ = '%';
+            *output++ = (char)(c + 64);
+        }
+        else {
+            *output++ = (char)c;
+        }
+    }
+    return output;
+}
+
+
+static PyObject *
+speedups_yate_decode_bytes(PyObject *self, PyObject *arg)
+{
+    Py_buffer view;
+    PyObject *result;
+
+    if (PyObject_GetBuffer(arg, &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    result = decode_bytes(view.buf, view.len);
+    PyBuffer_Release(&view);
+    return result;
+}
+
+
+static PyObject *
+speedups_yate_encode_bytes(PyObject *self, PyObject *arg)
+{
+    Py_buffer view;
+    PyObject *result;
+    Py_ssize_t length;
+
+    if (PyObject_GetBuffer(arg, &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    length = encoded_length(view.buf, view.len);
+    result = PyBytes_FromStringAndSize(NULL, length);
+    if (result != NULL) {
+        encode_into(PyBytes_AS_STRING(result), view.buf, view.len);
+    }
+    PyBuffer_Release(&view);
+    return result;
+}
+
+
+static PyObject *
+decode_field(const char *input, Py_ssize_t length)
+{
+    PyObject *decoded, *result;
+
+    if (memchr(input, '%', length) == NULL) {
+        return PyUnicode_DecodeUTF8(input, length, NULL);
+    }
+    decoded = decode_bytes(input, length);
+    if (decoded == NULL) {
+        return NULL;
+    }
+    result = PyUnicode_DecodeUTF8(PyBytes_AS_STRING(decoded), PyBytes_GET_SIZE(decoded), NULL);
+    Py_DECREF(decoded);
+    return result;
+}
+
+
+static PyObject *
+decode_split(PyObject *arg)
+{
+    Py_buffer view;
+    PyObject *result, *field;
+    const char *start, *end, *colon;
+
+    if (PyObject_GetBuffer(arg, &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    result = PyList_New(0);
+    if (result == NULL) {
+        goto error;
+    }
+    start = view.buf;
+    end = start + view.len;
+    for (;;) {
+        colon = memchr(start, ':', end - start);
+        if (colon == NULL) {
+            colon = end;
+        }
+        field = decode_field(start, colon - start);
+        if (field == NULL) {
+            goto error;
+        }
+        if (PyList_Append(result, field) < 0) {
+            Py_DECREF(field);
+            goto error;
+        }
+        Py_DECREF(field);
+        if (colon == end) {
+            break;
+        }
+        start = colon + 1;
+    }
+    PyBuffer_Release(&view);
+    return result;
+
+error:
+    Py_XDECREF(result);
+    PyBuffer_Release(&view);
+    return NULL;
+}
+
+
+static PyObject *
+speedups_yate_decode_split(PyObject *self, PyObject *arg)
+{
+    return decode_split(arg);
+}
+
+
+static PyObject *
+speedups_yate_encode_join(PyObject *self, PyObject *args)
+{
+    Py_ssize_t count = PyTuple_GET_SIZE(args);
+    Py_ssize_t total = count > 0 ? count - 1 : 0;
+    Py_ssize_t i;
+    PyObject *result;
+    char *output;
+
+    for (i = 0; i < count; i++) {
+        PyObject *item = PyTuple_GET_ITEM(args, i);
+        const char *data;
+        Py_ssize_t length;
+
+        if (!PyUnicode_Check(item)) {
+            PyErr_Format(PyExc_TypeError, "yate_encode_join() expects str arguments, got %.200s",
+                         Py_TYPE(item)->tp_name);
+            return NULL;
+        }
+        data = PyUnicode_AsUTF8AndSize(item, &length);
+        if (data == NULL) {
+            return NULL;
+        }
+        total += encoded_length((const unsigned char *)data, length);
+    }
+    result = PyBytes_FromStringAndSize(NULL, total);
+    if (result == NULL) {
+        return NULL;
+    }
+    output = PyBytes_AS_STRING(result);
+    for (i = 0; i < count; i++) {
+        Py_ssize_t length;
+        /* the UTF-8 representation is cached in the str object by the first pass */
+        const char *data = PyUnicode_AsUTF8AndSize(PyTuple_GET_ITEM(args, i), &length);
+
+        if (i > 0) {
+            *output++ = ':';
+        }
+        output = encode_into(output, (const unsigned char *)data, length);
+    }
+    return result;
+}
+
+
+static PyObject *
+speedups_yate_parse_keyvalue(PyObject *self, PyObject *arg)
+{
+    PyObject *sequence, *result;
+    Py_ssize_t count, i;
+
+    sequence = PySequence_Fast(arg, "yate_parse_keyvalue() expects a sequence of str");
+    if (sequence == NULL) {
+        return NULL;
+    }
+    result = PyDict_New();
+    if (result == NULL) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+    count = PySequence_Fast_GET_SIZE(sequence);
+    for (i = 0; i < count; i++) {
+        PyObject *param = PySequence_Fast_GET_ITEM(sequence, i);
+        PyObject *key, *value;
+        Py_ssize_t length, separator;
+        int status;
+
+        if (!PyUnicode_Check(param)) {
+            PyErr_Format(PyExc_TypeError, "yate_parse_keyvalue() expects str parameters, got %.200s",
+                         Py_TYPE(param)->tp_name);
+            goto error;
+        }
+        length = PyUnicode_GET_LENGTH(param);
+        separator = PyUnicode_FindChar(param, '=', 0, length, 1);
+        if (separator == -2) {
+            goto error;
+        }
+        if (separator < 0) {
+            key = Py_NewRef(param);
+            value = PyUnicode_New(0, 0);
+        }
+        else {
+            key = PyUnicode_Substring(param, 0, separator);
+            value = PyUnicode_Substring(param, separator + 1, length);
+        }
+        if (key == NULL || value == NULL) {
+            Py_XDECREF(key);
+            Py_XDECREF(value);
+            goto error;
+        }
+        status = PyDict_SetItem(result, key, value);
+        Py_DECREF(key);
+        Py_DECREF(value);
+        if (status < 0) {
+            goto error;
+        }
+    }
+    Py_DECREF(sequence);
+    return result;
+
+error:
+    Py_DECREF(sequence);
+    Py_DECREF(result);
+    return NULL;
+}
+
+
+static PyMethodDef speedups_methods[] = {
+    {"yate_decode_bytes", speedups_yate_decode_bytes, METH_O, NULL},
+    {"yate_encode_bytes", speedups_yate_encode_bytes, METH_O, NULL},
+    {"yate_decode_split", speedups_yate_decode_split, METH_O, NULL},
+    {"yate_encode_join", speedups_yate_encode_join, METH_VARARGS, NULL},
+    {"yate_parse_keyvalue", speedups_yate_parse_keyvalue, METH_O, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "yate._speedups",
+    "C implementation of the yate wire protocol codec",
+    -1,
+    speedups_methods
+};
+
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    return PyModule_Create(&speedups_module);
+}
@@ -1,7 +1,15 @@
 import asyncio
 from asyncio.streams import StreamWriter, FlowControlMixin
+from collections import deque
+# the executors load on first use, the process pool alone pulls in multiprocessing, pickle and tempfile
+import concurrent.futures
+from concurrent.futures import Executor
+import heapq
+import inspect
+import signal
 import sys
 import logging
+import time
 
 from yate import yate
 from yate.protocol import MessageRequest, Message, ConnectToYate
@@ -9,18 +17,264 @@ from yate.protocol import MessageRequest, Message, ConnectToYate
 logger = logging.getLogger("yate")
 
 
+class WireTrace:
+    """
+    Bounded record of the most recent raw lines exchanged with yate in each direction.
+    """
+    def __init__(self, size=1000, log=False):
+        self.incoming = deque(maxlen=size)
+        self.outgoing = deque(maxlen=size)
+        self.log = log
+
+    def record_incoming(self, line):
+        self.incoming.append((time.monotonic(), line))
+        if self.log:
+            logger.debug("< %r", line)
+
+    def record_outgoing(self, line):
+        self.outgoing.append((time.monotonic(), line))
+        if self.log:
+            logger.debug("> %r", line)
+
+    def dump(self, file=None):
+        """
+        Write the recorded lines of both directions in chronological order to file, stderr by default.
+        Never use stdout in stdio mode, it is our channel to yate.
+        """
+        file = file or sys.stderr
+        incoming = ((timestamp, "<", line) for timestamp, line in self.incoming)
+        outgoing = ((timestamp, ">", line) for timestamp, line in self.outgoing)
+        for timestamp, direction, line in heapq.merge(incoming, outgoing):
+            file.write("{:.6f} {} {!r}\n".format(timestamp, direction, line))
+        file.flush()
+
+
+class YateStreamProtocol(FlowControlMixin, asyncio.Protocol):
+    """
+    Passes all complete lines of every chunk received from yate on at once, only the incomplete last line is
+    buffered. Also serves as flow control protocol for a StreamWriter on the same transport.
+    """
+    def __init__(self, yate_async, loop=None):
+        super().__init__(loop)
+        self._yate = yate_async
+        self._partial_line = bytearray()
+        # length of the incomplete line once it exceeded max_line_size, only its allowed prefix is buffered
+        self._oversize_length = 0
+        self.closed = self._loop.create_future()
+
+    def data_received(self, data):
+        max_line_size = self._yate.max_line_size
+        lines = data.split(b"\n")
+        incomplete = lines.pop()
+        if lines and (self._partial_line or self._oversize_length):
+            lines[0] = self._complete_partial_line(lines[0], max_line_size)
+        if max_line_size is not None and len(data) > max_line_size:
+            # only a chunk larger than the limit can contain a complete line exceeding it
+            lines = [line if line is None or len(line) <= max_line_size
+                     else self._yate._oversize_line(line[:max_line_size], len(line)) for line in lines]
+            lines = [line for line in lines if line is not None]
+        elif lines and lines[0] is None:
+            del lines[0]
+        if incomplete:
+            self._extend_partial_line(incomplete, max_line_size)
+        if lines:
+            self._yate._recv_lines(lines)
+
+    def _extend_partial_line(self, data, max_line_size):
+        if self._oversize_length:
+            self._oversize_length += len(data)
+            return
+        self._partial_line += data
+        if max_line_size is not None and len(self._partial_line) > max_line_size:
+            self._oversize_length = len(self._partial_line)
+            del self._partial_line[max_line_size:]
+
+    def _complete_partial_line(self, data, max_line_size):
+        partial_line = self._partial_line
+        length = (self._oversize_length or len(partial_line)) + len(data)
+        if max_line_size is not None and length > max_line_size:
+            partial_line += data[:max_line_size - len(partial_line)]
+            line = self._yate._oversize_line(bytes(partial_line), length)
+        else:
+            partial_line += data
+            line = bytes(partial_line)
+        # releases the memory of a large line
+        partial_line.clear()
+        self._oversize_length = 0
+        return line
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class HandlerRegistration:
+    """
+    A message or watch handler for YateAsync.register_handlers_async, created with for_message or for_watch.
+    """
+    __slots__ = ("watch", "args", "kwargs")
+
+    def __init__(self, watch, args, kwargs):
+        self.watch = watch
+        self.args = args
+        self.kwargs = kwargs
+
+    @classmethod
+    def for_message(cls, message, callback, *args, **kwargs):
+        return cls(False, (message, callback, *args), kwargs)
+
+    @classmethod
+    def for_watch(cls, message, callback, **kwargs):
+        return cls(True, (message, callback), kwargs)
+
+    @property
+    def message(self):
+        return self.args[0]
+
+
+def _call_offloaded_handler(callback, msg):
+    # runs in the worker, the message is returned as a process pool works on a copy of it
+    return callback(msg), msg
+
+
+class OffloadedHandler:
+    """
+    Message handler callback that runs the wrapped callback in an executor and answers with its result.
+    Messages with the same value of order_attribute are handled one after another.
+    """
+    __slots__ = ("__wrapped__", "_yate", "_executor", "_semaphore", "_order_attribute", "_queued")
+
+    def __init__(self, yate_async, callback, executor, max_concurrency=None, order_attribute="id"):
+        self.__wrapped__ = callback
+        self._yate = yate_async
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
+        self._order_attribute = order_attribute
+        # messages waiting for a previous message with the same order key, by key
+        self._queued = {}
+
+    def __call__(self, msg):
+        key = msg.params.get(self._order_attribute) if self._order_attribute is not None else None
+        if key is None:
+            self._yate._start_handler_task(self._handle(msg))
+        elif key in self._queued:
+            self._queued[key].append(msg)
+        else:
+            self._queued[key] = deque()
+            self._yate._start_handler_task(self._handle_in_order(key, msg))
+        # answered once the executor is done
+        return None
+
+    async def _handle_in_order(self, key, msg):
+        queue = self._queued[key]
+        try:
+            while msg is not None:
+                await self._handle(msg)
+                msg = queue.popleft() if queue else None
+        finally:
+            del self._queued[key]
+
+    async def _handle(self, msg):
+        loop = asyncio.get_running_loop()
+        try:
+            if self._semaphore is None:
+                result, answered_msg = await loop.run_in_executor(self._executor, _call_offloaded_handler,
+                                                                  self.__wrapped__, msg)
+            else:
+                async with self._semaphore:
+                    result, answered_msg = await loop.run_in_executor(self._executor, _call_offloaded_handler,
+                                                                      self.__wrapped__, msg)
+        except Exception:
+            logger.exception("Offloaded handler for %s failed", msg.name)
+            self._yate.answer_message(msg, False)
+            return
+        self._yate.answer_message(answered_msg, bool(result))
+
+
+class CoroutineHandler:
+    """
+    Message handler callback that runs a coroutine function as a task and answers with its result.
+    The task is cancelled and the message answered with False after answer_timeout seconds.
+    """
+    __slots__ = ("__wrapped__", "_yate", "_semaphore", "_answer_timeout")
+
+    def __init__(self, yate_async, callback, max_concurrency=None, answer_timeout=None):
+        self.__wrapped__ = callback
+        self._yate = yate_async
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
+        self._answer_timeout = answer_timeout
+
+    def __call__(self, msg):
+        self._yate._start_handler_task(self._handle(msg))
+        # answered once the coroutine returned
+        return None
+
+    async def _handle(self, msg):
+        timeout = asyncio.timeout(self._answer_timeout)
+        try:
+            async with timeout:
+                result = await self._run(msg)
+        except Exception:
+            # a TimeoutError raised by the handler itself is just another failure
+            if timeout.expired():
+                self._yate.stats["handler_timeouts"] += 1
+                logger.warning("Handler for %s did not answer within %s seconds", msg.name, self._answer_timeout)
+            else:
+                logger.exception("Handler for %s failed", msg.name)
+            result = False
+        if result is not None:
+            self._yate.answer_message(msg, result)
+
+    async def _run(self, msg):
+        if self._semaphore is None:
+            return await self.__wrapped__(msg)
+        async with self._semaphore:
+            return await self.__wrapped__(msg)
+
+
 class YateAsync(yate.YateBase):
     MODE_STDIO = 1
     MODE_TCP = 2
     MODE_UNIX = 3
 
+    OVERSIZE_SKIP = "skip"
+    OVERSIZE_TRUNCATE = "truncate"
+
+    PENDING_FAIL = "fail"
+    PENDING_RETRY = "retry"
+
     def __init__(self, host=None, port=None, sockpath=None):
         super().__init__()
         self.reader = None
         self.writer = None
+        self._stream_protocol = None
+        self.max_line_size = 1024 * 1024
+        # executors for offloaded handlers, created on first use
+        self._thread_pool = None
+        self._process_pool = None
+        # the event loop only keeps weak references to tasks
+        self._handler_tasks = set()
+        self.oversize_policy = self.OVERSIZE_SKIP
         self.main_task = None
         self._automatic_bufsize = False
         self._termination_handler = None
+        self._wire_trace = None
+        # outgoing lines of the current event loop iteration, written with a single writelines
+        self._write_batch = []
+        self._flush_scheduled = False
+        self._expiry_timer = None
+        self._expiry_deadline = None
+        # flow control of send_message_async, see set_flow_control
+        self._max_in_flight = None
+        self._in_flight = 0
+        self._send_waiters = deque()
+        self._write_high_water = None
+        self._write_low_water = None
+        # (initial delay, maximum delay) of reconnect attempts, None to terminate when the connection is lost
+        self._reconnect_delays = None
+        self._pending_policy = self.PENDING_FAIL
+        self._reconnecting = False
 
         if host is not None:
             self.mode = self.MODE_TCP
@@ -38,6 +292,99 @@ class YateAsync(yate.YateBase):
     def set_termination_handler(self, termination_handler):
         self._termination_handler = termination_handler
 
+    def set_reconnect(self, enabled=True, initial_delay=0.1, max_delay=30.0, pending_policy=PENDING_FAIL):
+        """
+        Connect to yate again with exponential backoff when the connection is lost, replaying all registrations.
+        Unanswered messages fail with PENDING_FAIL or are sent again on the new connection with PENDING_RETRY.
+        """
+        if enabled and self.mode == self.MODE_STDIO:
+            raise ValueError("Yate cannot be reconnected in stdio mode")
+        self._reconnect_delays = (initial_delay, max_delay) if enabled else None
+        self._pending_policy = pending_policy
+
+    def set_line_limit(self, max_line_size, oversize_policy=OVERSIZE_SKIP):
+        """
+        Limit the size of lines received from yate to max_line_size bytes, None for no limit.
+        Longer lines are skipped, truncated or passed to a callable, depending on oversize_policy.
+        """
+        self.max_line_size = max_line_size
+        self.oversize_policy = oversize_policy
+
+    def _oversize_line(self, prefix, length):
+        self.stats["oversize_lines"] += 1
+        if self.oversize_policy == self.OVERSIZE_TRUNCATE:
+            logger.warning("Truncated line of %d bytes from yate to %d bytes", length, len(prefix))
+            return prefix
+        if self.oversize_policy == self.OVERSIZE_SKIP:
+            logger.warning("Skipped line of %d bytes from yate exceeding the limit of %d bytes",
+                           length, self.max_line_size)
+        else:
+            try:
+                self.oversize_policy(prefix, length)
+            except Exception:
+                # runs while the transport delivers data, an exception would close the connection
+                logger.exception("Oversize line policy failed")
+        return None
+
+    def set_flow_control(self, max_in_flight=None, high_water=None, low_water=None):
+        """
+        Limit the number of messages send_message_async has waiting for an answer to max_in_flight,
+        and wait for a write buffer above high_water to drain below low_water.
+        """
+        self._max_in_flight = max_in_flight
+        self._write_high_water = high_water
+        self._write_low_water = low_water
+        if self.writer is not None:
+            self._apply_write_buffer_limits()
+        # a larger window lets waiting senders proceed right away
+        self._wake_senders()
+
+    @property
+    def in_flight(self):
+        """
+        Number of messages sent with send_message_async that wait for their answer.
+        """
+        return self._in_flight
+
+    @property
+    def waiting_senders(self):
+        """
+        Number of send_message_async calls waiting for a free slot in the in-flight window.
+        """
+        return len(self._send_waiters)
+
+    @property
+    def write_buffer_size(self):
+        """
+        Number of bytes written to yate that were not yet passed on to the operating system.
+        """
+        if self.writer is None:
+            return 0
+        return self.writer.transport.get_write_buffer_size()
+
+    def _apply_write_buffer_limits(self):
+        if self._write_high_water is not None:
+            self.writer.transport.set_write_buffer_limits(self._write_high_water, self._write_low_water)
+
+    def enable_wire_trace(self, size=1000, log=False, dump_signal=None):
+        """
+        Record the last size raw lines exchanged with yate in each direction, optionally logging every line.
+        Sending dump_signal to the process dumps the trace to stderr.
+        """
+        self._wire_trace = WireTrace(size, log)
+        if dump_signal is not None:
+            signal.signal(dump_signal, lambda _signum, _frame: self.dump_wire_trace())
+
+    def disable_wire_trace(self):
+        self._wire_trace = None
+
+    def dump_wire_trace(self, file=None):
+        """
+        Write the recorded lines of the wire trace in chronological order to file, stderr by default.
+        """
+        if self._wire_trace is not None:
+            self._wire_trace.dump(file)
+
     async def _amain(self, application_main):
         if self.mode == self.MODE_STDIO:
             await self.setup_for_stdio()
@@ -47,6 +394,7 @@ class YateAsync(yate.YateBase):
             await self.setup_for_unix(self.sockpath)
         else:
             raise NotImplementedError("Unknown mode of operation found")
+        self._apply_write_buffer_limits()
 
         # now start event processing for yate messages
         message_loop_task = asyncio.create_task(self.message_processing_loop())
@@ -57,76 +405,187 @@ class YateAsync(yate.YateBase):
             await self.main_task
         except asyncio.CancelledError as e:
             pass # We clean up even when the main task is cancelled
+        self._flush_writes()
         self.writer.close()
         message_loop_task.cancel()
+        for executor in (self._thread_pool, self._process_pool):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
 
     async def _amain_ready(self):
         pass
 
     async def setup_for_stdio(self):
-        self.reader = asyncio.StreamReader()
-        reader_protocol = asyncio.StreamReaderProtocol(self.reader)
-        await asyncio.get_event_loop().connect_read_pipe(lambda: reader_protocol, sys.stdin)
+        loop = asyncio.get_event_loop()
+        # yate may send the call.execute right away, so be ready to answer before reading
+        writer_transport, writer_protocol = await loop.connect_write_pipe(FlowControlMixin, sys.stdout)
+        self.writer = StreamWriter(writer_transport, writer_protocol, None, loop)
 
-        writer_transport, writer_protocol = await asyncio.get_event_loop().connect_write_pipe(FlowControlMixin, sys.stdout)
-        self.writer = StreamWriter(writer_transport, writer_protocol, None, asyncio.get_event_loop())
+        _transport, self._stream_protocol = await loop.connect_read_pipe(lambda: YateStreamProtocol(self), sys.stdin)
 
     async def setup_for_tcp(self, host, port):
-        self.reader, self.writer = await asyncio.open_connection(host, port)
+        loop = asyncio.get_event_loop()
+        transport, self._stream_protocol = await loop.create_connection(lambda: YateStreamProtocol(self), host, port)
+        self.writer = StreamWriter(transport, self._stream_protocol, None, loop)
         self.send_connect()
 
     async def setup_for_unix(self, sockpath):
-        self.reader, self.writer = await asyncio.open_unix_connection(sockpath)
+        loop = asyncio.get_event_loop()
+        transport, self._stream_protocol = await loop.create_unix_connection(lambda: YateStreamProtocol(self),
+                                                                             sockpath)
+        self.writer = StreamWriter(transport, self._stream_protocol, None, loop)
         self.send_connect()
 
     async def message_processing_loop(self):
+        # incoming lines are processed by the stream protocol as they arrive, this only waits for the end
         try:
-            while True:
-                raw_message = await self.reader.readline()
-                logger.debug("< %s", repr(raw_message.strip()))
-                if raw_message == b"":
-                    # we only receive empty bytes if this is EOF, notify our program and terminate message
-                    # processing loop
-                    asyncio.create_task(self._yate_stream_closed())
-                    break
-                raw_message = raw_message.strip()
-                self._recv_message_raw(raw_message)
-            # once message processing ends, the whole application should terminate
+            await self._stream_protocol.closed
+            while self._reconnect_delays is not None:
+                await self._reconnect()
+                await self._stream_protocol.closed
+            # yate closed the stream, notify our program. The whole application should terminate.
+            asyncio.create_task(self._yate_stream_closed())
         except asyncio.CancelledError:
             pass
 
+    async def _reconnect(self):
+        logger.warning("Lost the connection to yate, reconnecting")
+        # lines written until we are connected again are dropped, everything still needed is replayed
+        self._reconnecting = True
+        self._write_batch = []
+        if self._pending_policy == self.PENDING_FAIL:
+            self.fail_pending_requests()
+        delay, max_delay = self._reconnect_delays
+        while True:
+            try:
+                if self.mode == self.MODE_TCP:
+                    await self.setup_for_tcp(self.host, self.port)
+                else:
+                    await self.setup_for_unix(self.sockpath)
+                break
+            except OSError as e:
+                logger.warning("Reconnecting to yate failed (%s), retrying in %.1f seconds", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        self._reconnecting = False
+        self.stats["reconnects"] += 1
+        self._apply_write_buffer_limits()
+        self.replay_registrations()
+        # including the requests sent while we were not connected
+        if self._pending_policy == self.PENDING_RETRY:
+            self.resend_pending_requests()
+        else:
+            self.fail_pending_requests()
+
+    def _recv_lines(self, lines):
+        wire_trace = self._wire_trace
+        for raw_message in lines:
+            raw_message = raw_message.strip()
+            if wire_trace is not None:
+                wire_trace.record_incoming(raw_message)
+            try:
+                self._recv_message_raw(raw_message)
+            except Exception:
+                # a failing handler must not stop the processing of the other lines
+                logger.exception("Processing a message from yate failed")
+
     def _send_message_raw(self, msg):
         if self._automatic_bufsize:
             yate_buf_required = len(msg) + 2 # plus \n and \0 terminator in yate
             if yate_buf_required > int(self.get_local("bufsize")):
                 def deferred_msg_write(_param, _value, _success):
                     # defer writing the message that is too long until the bufsize was adapted
-                    self.writer.write(msg + b"\n")
-                    logger.debug("> %s", repr(msg))
+                    self._write_line(msg)
                 # round to next kb
                 requested_bufsize = ((yate_buf_required // 1024) + 1) * 1024
                 logger.info("Automatic buffer size increase to %d bytes",  requested_bufsize)
                 self.set_local("bufsize", str(requested_bufsize), done_callback=deferred_msg_write)
                 return
-        self.writer.write(msg + b"\n")
-        logger.debug("> %s", repr(msg))
+        self._write_line(msg)
+
+    def _write_line(self, msg):
+        self._write_batch.append(msg)
+        if self._wire_trace is not None:
+            self._wire_trace.record_outgoing(msg)
+        if not self._flush_scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # not called from the event loop, nothing to batch with
+                self._flush_writes()
+                return
+            loop.call_soon(self._flush_writes)
+            self._flush_scheduled = True
+
+    def _flush_writes(self):
+        self._flush_scheduled = False
+        batch = self._write_batch
+        if not batch:
+            return
+        self._write_batch = []
+        if self._reconnecting:
+            # the transport of the lost connection silently drops writes
+            return
+        # interleave the lines with their terminators instead of copying every line to append it
+        lines = [b"\n"] * (2 * len(batch))
+        lines[::2] = batch
+        self.writer.writelines(lines)
 
     async def _yate_stream_closed(self):
         if self._termination_handler is not None:
             self._termination_handler()
 
     async def drain(self):
+        self._flush_writes()
         await self.writer.drain()
 
+    def register_message_handler(self, message, callback, priority=100, filter_attribute=None, filter_value=None,
+                                 install=True, done_callback=None, yate_filter=True, executor=None,
+                                 max_concurrency=None, order_attribute="id", answer_timeout=None):
+        """
+        Register callback like YateBase.register_message_handler. callback may also be a coroutine function
+        (see CoroutineHandler) or run in an executor, "thread", "process" or any Executor (see OffloadedHandler).
+        """
+        if inspect.iscoroutinefunction(callback):
+            if executor is not None:
+                raise ValueError("Coroutine handlers run on the event loop, they cannot use an executor")
+            callback = CoroutineHandler(self, callback, max_concurrency, answer_timeout)
+        elif executor is not None:
+            callback = OffloadedHandler(self, callback, self._get_executor(executor), max_concurrency,
+                                        order_attribute)
+        super().register_message_handler(message, callback, priority, filter_attribute, filter_value, install,
+                                         done_callback, yate_filter)
+
+    def _start_handler_task(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._handler_tasks.add(task)
+        task.add_done_callback(self._handler_tasks.discard)
+
+    def _get_executor(self, executor):
+        if isinstance(executor, Executor):
+            return executor
+        if executor == "thread":
+            if self._thread_pool is None:
+                self._thread_pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="yate-handler")
+            return self._thread_pool
+        if executor == "process":
+            if self._process_pool is None:
+                self._process_pool = concurrent.futures.ProcessPoolExecutor()
+            return self._process_pool
+        raise ValueError("Unknown executor for message handlers: {}".format(executor))
+
     async def register_message_handler_async(self, message, callback, priority=100, filter_attribute=None,
-                                             filter_value=None):
+                                             filter_value=None, yate_filter=True, executor=None,
+                                             max_concurrency=None, order_attribute="id", answer_timeout=None):
         future = asyncio.get_event_loop().create_future()
 
         def _done_callback(success):
             future.set_result(success)
 
         self.register_message_handler(message, callback, priority, filter_attribute, filter_value,
-                                      done_callback=_done_callback)
+                                      done_callback=_done_callback, yate_filter=yate_filter, executor=executor,
+                                      max_concurrency=max_concurrency, order_attribute=order_attribute,
+                                      answer_timeout=answer_timeout)
         await future
         return future.result()
 
@@ -140,16 +599,106 @@ class YateAsync(yate.YateBase):
         await future
         return future.result()
 
-    async def send_message_async(self, msg: MessageRequest) -> Message:
+    async def register_handlers_async(self, registrations):
+        """
+        Register several HandlerRegistration objects in a single round trip to yate.
+        :return: For every registration whether yate accepted it, in the same order
+        """
+        loop = asyncio.get_event_loop()
+        futures = []
+        for registration in registrations:
+            future = loop.create_future()
+            futures.append(future)
+            if registration.watch:
+                self.register_watch_handler(*registration.args, done_callback=future.set_result,
+                                            **registration.kwargs)
+            else:
+                self.register_message_handler(*registration.args, done_callback=future.set_result,
+                                              **registration.kwargs)
+        return await asyncio.gather(*futures)
+
+    async def send_message_async(self, msg: MessageRequest, timeout=None) -> Message:
+        """
+        Send msg to yate and wait for its answer, at most timeout seconds (request_timeout if None).
+        Raises YateRequestTimeoutError on timeout or YateConnectionLostError if the connection is lost first.
+        """
+        if self._reconnecting and self._pending_policy == self.PENDING_FAIL:
+            raise yate.YateConnectionLostError("Not connected to yate, cannot send {}".format(msg.name))
         future = asyncio.get_event_loop().create_future()
 
         def _done_callback(old_msg, result_msg):
-            future.set_result(result_msg)
-
-        self.send_message(msg, _done_callback)
-        await future
+            if future.done():
+                # the waiting coroutine was cancelled
+                return
+            if result_msg is None:
+                future.set_exception(yate.YateRequestTimeoutError(
+                    "Yate did not answer {} in time".format(old_msg.name)))
+            elif isinstance(result_msg, yate.YateConnectionLostError):
+                future.set_exception(result_msg)
+            else:
+                future.set_result(result_msg)
+
+        await self._acquire_send_slot()
+        try:
+            self.send_message(msg, _done_callback, timeout=timeout)
+            if self._write_high_water is not None and not self._reconnecting:
+                # waits while the write buffer is above its high water mark
+                self._flush_writes()
+                await self.writer.drain()
+            await future
+        finally:
+            self._release_send_slot()
         return future.result()
 
+    async def _acquire_send_slot(self):
+        if self._max_in_flight is None or (self._in_flight < self._max_in_flight and not self._send_waiters):
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._send_waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if waiter in self._send_waiters:
+                    self._send_waiters.remove(waiter)
+                self._wake_senders()
+            else:
+                # the slot was handed to us right before the cancellation
+                self._release_send_slot()
+            raise
+
+    def _release_send_slot(self):
+        self._in_flight -= 1
+        self._wake_senders()
+
+    def _wake_senders(self):
+        while self._send_waiters and (self._max_in_flight is None or self._in_flight < self._max_in_flight):
+            waiter = self._send_waiters.popleft()
+            if waiter.done():
+                continue
+            # the slot is handed over, so no new sender can overtake the waiting ones
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def _request_deadline_added(self, deadline):
+        if self._expiry_timer is not None:
+            if self._expiry_deadline <= deadline:
+                return
+            self._expiry_timer.cancel()
+        self._schedule_request_expiry(deadline)
+
+    def _schedule_request_expiry(self, deadline):
+        delay = max(0.0, deadline - self._get_monotonic_time())
+        self._expiry_deadline = deadline
+        self._expiry_timer = asyncio.get_event_loop().call_later(delay, self._request_expiry_timer)
+
+    def _request_expiry_timer(self):
+        self._expiry_timer = None
+        next_deadline = self.expire_requests()
+        if next_deadline is not None:
+            self._schedule_request_expiry(next_deadline)
+
     async def set_local_async(self, param, value):
         future = asyncio.get_event_loop().create_future()
 
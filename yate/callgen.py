@@ -1,20 +1,23 @@
 import argparse
 import asyncio
-import os
 import signal
 import logging
 from pathlib import Path
 
-from aiohttp import web
-
-from yate.asyncio import YateAsync
+from yate.asyncio import YateAsync, HandlerRegistration
 from yate.protocol import MessageRequest
+from yate.yate import MessageRouter, YateRequestTimeoutError
 
 soundfile_extensions = [".slin", ".gsm"]
+# bound the messages a burst of web requests can have outstanding with yate
+max_messages_in_flight = 64
+write_buffer_high_water = 64 * 1024
 
 
 
 class SoundCallInfo:
+    __slots__ = ("soundfile", "delay", "answered")
+
     def __init__(self, sndfile, delay):
         self.soundfile = sndfile
         self.delay = delay
@@ -28,10 +31,19 @@ class YateCallGenerator:
         self.shutdown_future = None
 
         self.active_calls = {}
+        # yate notifies us about all channels, these pass on the notifications for the calls we generated
+        self._answered_router = MessageRouter("peerid")
+        self._notify_router = MessageRouter("targetid")
+        self._hangup_router = MessageRouter("id")
         self.yate = YateAsync("127.0.0.1", port)
-        self.yate.set_termination_handler(self.termination_handler)
+        # survive a restart of yate, calls that were waiting for an answer are failed
+        self.yate.set_reconnect()
+        self.yate.set_flow_control(max_messages_in_flight, write_buffer_high_water)
         self.sounds_directories = sounds_directory
 
+        # aiohttp is only needed for the call generator, not for everything importing this module
+        from aiohttp import web
+        self._web = web
         self.web_app = web.Application()
         self.web_app.add_routes([web.post("/call", self.web_call_handler)])
         self.app_runner = web.AppRunner(self.web_app)
@@ -46,21 +58,21 @@ class YateCallGenerator:
         self.shutdown_future = asyncio.get_event_loop().create_future()
         asyncio.get_event_loop().add_signal_handler(signal.SIGINT, self.shutdown)
 
-        if not await self.yate.register_watch_handler_async("call.answered", self._call_answered_handler):
-            logging.error("Cannot watch call.answered.")
-            return
-        if not await self.yate.register_watch_handler_async("chan.notify", self._chan_notify_handler):
-            logging.error("Cannot watch chan.notify.")
-            return
-        if not await self.yate.register_watch_handler_async("chan.hangup", self._chan_hangup_handler):
-            logging.error("Cannot watch chan.hangup")
-            return
+        watches = [
+            HandlerRegistration.for_watch("call.answered", self._answered_router),
+            HandlerRegistration.for_watch("chan.notify", self._notify_router),
+            HandlerRegistration.for_watch("chan.hangup", self._hangup_router),
+        ]
+        for watch, success in zip(watches, await self.yate.register_handlers_async(watches)):
+            if not success:
+                logging.error("Cannot watch {}.".format(watch.message))
+                return
         logging.info("Yate ready. Starting webserver.")
 
         # fire up http server
         bind = None if self.bind_global else "localhost"
         await self.app_runner.setup()
-        site = web.TCPSite(self.app_runner, bind, 8080)
+        site = self._web.TCPSite(self.app_runner, bind, 8080)
         await site.start()
         logging.info("Webserver ready. Waiting for requests {}.".format("globally" if self.bind_global else "locally"))
 
@@ -72,12 +84,6 @@ class YateCallGenerator:
     def shutdown(self):
         self.shutdown_future.set_result(True)
 
-    @staticmethod
-    def termination_handler():
-        logging.info("Yate has closed the connection. Terminating application.")
-        os._exit(1)
-
-
     async def web_call_handler(self, request):
         logging.debug("TRACE: Request handler begin")
         params = await request.post()
@@ -90,19 +96,19 @@ class YateCallGenerator:
         max_ringtime = params.get("max_ringtime")
 
         if any((soundfile is None, delay is None, target is None)):
-            return web.Response(status=400, text="Provide at least <soundfile>, <delay> and <target>")
+            return self._web.Response(status=400, text="Provide at least <soundfile>, <delay> and <target>")
         if not delay.isnumeric():
-            return web.Response(status=400, text="<delay> needs to be numeric")
+            return self._web.Response(status=400, text="<delay> needs to be numeric")
         delay = int(delay)
         if max_ringtime is not None:
             if not max_ringtime.isnumeric():
-                return web.Response(status=400, text="<max_ringtime> needs to be numeric")
+                return self._web.Response(status=400, text="<max_ringtime> needs to be numeric")
             else:
                 max_ringtime = int(max_ringtime)
 
         sound_path = self.find_soundfile(soundfile)
         if sound_path is None:
-            return web.Response(status=404, text="Soundfile {} not found".format(soundfile))
+            return self._web.Response(status=404, text="Soundfile {} not found".format(soundfile))
 
         call_execute_message = MessageRequest("call.execute", {
             "callto": "dumb/",
@@ -111,44 +117,53 @@ class YateCallGenerator:
             "caller": caller,
             "callername": callername,
         })
-        result = await self.yate.send_message_async(call_execute_message)
+        try:
+            result = await self.yate.send_message_async(call_execute_message)
+        except (YateRequestTimeoutError, ConnectionError):
+            return self._web.Response(status=503, text="No answer from yate, try again later")
         if not result.processed:
-            return web.Response(status=404, text="Call.execute failed. Invalid target?")
+            return self._web.Response(status=404, text="Call.execute failed. Invalid target?")
 
         id = result.params["id"]
         call_info = SoundCallInfo(sound_path, delay)
-        self.active_calls[id] = call_info
+        self._track_call(id, call_info)
         if max_ringtime is not None:
             asyncio.get_event_loop().call_later(max_ringtime, self.drop_call_if_not_answered, id)
 
-        return web.Response(text="OK :-)")
+        return self._web.Response(text="OK :-)")
+
+    def _track_call(self, id, call_info):
+        self.active_calls[id] = call_info
+        self._answered_router.add(id, self._call_answered_handler)
+        self._notify_router.add(id, self._chan_notify_handler)
+        self._hangup_router.add(id, self._chan_hangup_handler)
+
+    def _forget_call(self, id):
+        del self.active_calls[id]
+        self._answered_router.discard(id)
+        self._notify_router.discard(id)
+        self._hangup_router.discard(id)
 
     def _call_answered_handler(self, msg):
         peer = msg.params["peerid"]
-        if peer in self.active_calls:
-            call_info = self.active_calls[peer]
-            call_info.answered = True
-            asyncio.get_event_loop().call_later(call_info.delay,
-                                                lambda: asyncio.get_event_loop()
-                                                .create_task(self.start_sound_playback(peer, call_info.soundfile)))
+        call_info = self.active_calls[peer]
+        call_info.answered = True
+        asyncio.get_event_loop().call_later(call_info.delay,
+                                            lambda: asyncio.get_event_loop()
+                                            .create_task(self.start_sound_playback(peer, call_info.soundfile)))
 
     def _chan_notify_handler(self, msg):
-        id = msg.params.get("targetid")
-        if id not in self.active_calls:
-            return
         if msg.params.get("reason", "") != "eof":
             return
-        self._drop_call(id)
+        self._drop_call(msg.params["targetid"])
 
     def _drop_call(self, id):
         drop_msg = MessageRequest("call.drop", {"id": id})
         self.yate.send_message(drop_msg, fire_and_forget=True)
-        del self.active_calls[id]
+        self._forget_call(id)
 
     def _chan_hangup_handler(self, msg):
-        id = msg.params["id"]
-        if id in self.active_calls:
-            del self.active_calls[id]
+        self._forget_call(msg.params["id"])
 
     async def start_sound_playback(self, peer, soundfile):
         if peer not in self.active_calls:
@@ -189,6 +204,9 @@ def main():
     else:
         logging.basicConfig(level=logging.INFO)
     app = YateCallGenerator(args.port, args.sounds_directory, args.bind_global)
+    if args.trace:
+        # log all lines exchanged with yate and allow dumping the most recent ones with SIGUSR1
+        app.yate.enable_wire_trace(log=True, dump_signal=signal.SIGUSR1)
     app.run()
 
 
@@ -1,10 +1,17 @@
 import asyncio
+from collections import deque
+import functools
+import logging
+import re
 import signal
 from enum import Enum
 from typing import Optional, Callable
 
-from yate.asyncio import YateAsync
+from yate.asyncio import YateAsync, HandlerRegistration
 from yate.protocol import MessageRequest
+from yate.yate import MessageRouter
+
+logger = logging.getLogger("yate")
 
 
 class ChannelEventType(Enum):
@@ -12,59 +19,351 @@ class ChannelEventType(Enum):
     DTMF = 2
 
 
-class YateIVR(YateAsync):
+DTMF_SYMBOLS = "0123456789ABCD*#"
+# dial plan symbols standing for a set of DTMF symbols
+_dtmf_pattern_classes = {"X": "0123456789", "Z": "123456789", "N": "23456789", ".": DTMF_SYMBOLS}
+
+
+class DTMFPattern:
+    """
+    A dial plan style pattern for DTMF input. X matches any digit, Z any digit but 0, N any digit from 2 to 9
+    and . any DTMF symbol, all other DTMF symbols match themselves. [...] matches one of the symbols or ranges
+    like 1-5 it contains, (...) groups and | separates alternatives. ?, +, {n}, {n,} and {n,m} repeat the
+    preceding symbol or group, so "X{4}#" matches four digits followed by #.
+
+    The pattern is matched symbol by symbol: start is the state before any input, step advances it by one
+    symbol and returns an empty state once the input cannot match anymore.
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        # a nondeterministic automaton: the transitions of every state on symbols and without input
+        self._transitions = []
+        self._epsilon = []
+        self._position = 0
+        tree = self._parse_alternatives()
+        if self._position < len(pattern):
+            raise ValueError("Unbalanced ) in DTMF pattern {!r}".format(pattern))
+        start, self._accept = self._build(tree)
+        self.start = self._closure({start})
+        # steps already taken, every state is a set of automaton states
+        self._steps = {}
+
+    def step(self, state, symbol):
+        key = (state, symbol)
+        next_state = self._steps.get(key)
+        if next_state is None:
+            targets = {target for node in state for symbols, target in self._transitions[node] if symbol in symbols}
+            next_state = self._steps[key] = self._closure(targets)
+        return next_state
+
+    def matches(self, state):
+        return self._accept in state
+
+    def _closure(self, nodes):
+        closure = set(nodes)
+        stack = list(nodes)
+        while stack:
+            for target in self._epsilon[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+
+    def _error(self, reason):
+        return ValueError("{} at position {} of DTMF pattern {!r}".format(reason, self._position, self.pattern))
+
+    def _peek(self):
+        return self.pattern[self._position] if self._position < len(self.pattern) else None
+
+    def _parse_alternatives(self):
+        alternatives = [self._parse_sequence()]
+        while self._peek() == "|":
+            self._position += 1
+            alternatives.append(self._parse_sequence())
+        return ("alternatives", alternatives) if len(alternatives) > 1 else alternatives[0]
+
+    def _parse_sequence(self):
+        items = []
+        while self._peek() not in (None, "|", ")"):
+            items.append(self._parse_repeat())
+        return ("sequence", items)
+
+    def _parse_repeat(self):
+        item = self._parse_item()
+        while True:
+            char = self._peek()
+            if char == "?":
+                item = ("repeat", item, 0, 1)
+            elif char == "+":
+                item = ("repeat", item, 1, None)
+            elif char == "{":
+                end = self.pattern.find("}", self._position)
+                if end < 0:
+                    raise self._error("Unterminated {")
+                minimum, comma, maximum = self.pattern[self._position + 1:end].partition(",")
+                if not minimum.isdigit() or not (maximum.isdigit() or maximum == ""):
+                    raise self._error("Invalid repetition")
+                minimum = int(minimum)
+                maximum = int(maximum) if maximum else (None if comma else minimum)
+                if maximum is not None and maximum < minimum:
+                    raise self._error("Invalid repetition")
+                item = ("repeat", item, minimum, maximum)
+                self._position = end
+            else:
+                return item
+            self._position += 1
+
+    def _parse_item(self):
+        char = self._peek()
+        self._position += 1
+        if char == "(":
+            item = self._parse_alternatives()
+            if self._peek() != ")":
+                raise self._error("Missing )")
+            self._position += 1
+            return item
+        if char == "[":
+            return ("symbols", self._parse_set())
+        if char in _dtmf_pattern_classes:
+            return ("symbols", frozenset(_dtmf_pattern_classes[char]))
+        if char is not None and char in DTMF_SYMBOLS:
+            return ("symbols", frozenset(char))
+        self._position -= 1
+        raise self._error("Unexpected {!r}".format(char))
+
+    def _parse_set(self):
+        symbols = set()
+        while self._peek() != "]":
+            char = self._peek()
+            if char in _dtmf_pattern_classes:
+                symbols.update(_dtmf_pattern_classes[char])
+            elif char is not None and char in DTMF_SYMBOLS:
+                if self.pattern[self._position + 1:self._position + 2] == "-":
+                    last = self.pattern[self._position + 2:self._position + 3]
+                    if not last or last not in DTMF_SYMBOLS or DTMF_SYMBOLS.index(last) < DTMF_SYMBOLS.index(char):
+                        raise self._error("Invalid range")
+                    symbols.update(DTMF_SYMBOLS[DTMF_SYMBOLS.index(char):DTMF_SYMBOLS.index(last) + 1])
+                    self._position += 2
+                else:
+                    symbols.add(char)
+            else:
+                raise self._error("Unterminated [" if char is None else "Unexpected {!r}".format(char))
+            self._position += 1
+        self._position += 1
+        return frozenset(symbols)
+
+    def _new_node(self):
+        self._transitions.append([])
+        self._epsilon.append([])
+        return len(self._transitions) - 1
+
+    def _build(self, tree):
+        """
+        Add the automaton for a parsed (part of the) pattern and return its start and end node.
+        """
+        kind = tree[0]
+        if kind == "symbols":
+            start, end = self._new_node(), self._new_node()
+            self._transitions[start].append((tree[1], end))
+            return start, end
+        if kind == "sequence":
+            start = end = self._new_node()
+            for item in tree[1]:
+                item_start, item_end = self._build(item)
+                self._epsilon[end].append(item_start)
+                end = item_end
+            return start, end
+        if kind == "alternatives":
+            start, end = self._new_node(), self._new_node()
+            for alternative in tree[1]:
+                alternative_start, alternative_end = self._build(alternative)
+                self._epsilon[start].append(alternative_start)
+                self._epsilon[alternative_end].append(end)
+            return start, end
+        _kind, item, minimum, maximum = tree
+        start = end = self._new_node()
+        for _ in range(minimum):
+            item_start, item_end = self._build(item)
+            self._epsilon[end].append(item_start)
+            end = item_end
+        last = self._new_node()
+        if maximum is None:
+            item_start, item_end = self._build(item)
+            self._epsilon[end] += [item_start, last]
+            self._epsilon[item_end] += [item_start, last]
+            return start, last
+        for _ in range(maximum - minimum):
+            item_start, item_end = self._build(item)
+            self._epsilon[end] += [item_start, last]
+            end = item_end
+        self._epsilon[end].append(last)
+        return start, last
+
+
+@functools.lru_cache(maxsize=256)
+def compile_dtmf_pattern(pattern):
+    """
+    Compile a dial plan style pattern for DTMF input, see DTMFPattern. Compiled regular expressions are returned
+    unchanged.
+
+    :raises ValueError: if the pattern is invalid
+    """
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    return DTMFPattern(pattern)
+
+
+class DTMFCollector:
+    """
+    The DTMF symbols of a call in the order they were entered. Symbols the caller typed ahead stay queued until
+    they are read. A reader waits for the next symbols without polling, it is woken up by push.
+    """
     def __init__(self):
-        super().__init__()
-        self._call_ready_future = None
-        self.call_params = {}
-        self.dtmf_buffer = ""
-        self.dtmf_event = None
-        self.playback_end_event = None
-        self._hangup_handlers = []
-        # register a listener that takes the call.execute message from yate for the incoming call
-        self.register_message_handler("call.execute", self._initial_call_execute_handler, install=False)
+        self.symbols = deque()
+        self._waiter = None
 
-    async def _amain(self, application_main):
-        self._call_ready_future = asyncio.get_event_loop().create_future()
-        self.dtmf_event = asyncio.Event()
-        self.playback_end_event = asyncio.Event()
-        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, self._handle_sigterm)
-        await super()._amain(application_main)
+    def push(self, text):
+        self.symbols.extend(text)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
 
-    def _handle_sigterm(self):
-        self.main_task.cancel()
+    def clear(self):
+        self.symbols.clear()
 
-    def _initial_call_execute_handler(self, msg):
-        self.call_params = msg.params
-        self.call_id = msg.params["id"]
-        asyncio.create_task(self._install_ivr_handlers())
-        self.unregister_message_handler("call.execute")
-        return True  # Acknowledge that we accepted the call
+    async def read(self, finished, timeout_s=None, interdigit_timeout_s=None):
+        """
+        Take symbols from the queue until finished returns True for the symbols read so far, or None because
+        they cannot be completed anymore.
+
+        :param finished: Callable with the list of symbols read so far
+        :param timeout_s: Optional, seconds to wait for all symbols
+        :param interdigit_timeout_s: Optional, seconds to wait for the next symbol once the first was read
+        :return: Tuple of the symbols read and whether finished returned True
+        """
+        if self._waiter is not None:
+            raise RuntimeError("DTMF input is already read by another task")
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout_s is None else loop.time() + timeout_s
+        read = []
+        try:
+            async with asyncio.timeout_at(deadline) as timeout:
+                while True:
+                    while self.symbols:
+                        read.append(self.symbols.popleft())
+                        done = finished(read)
+                        if done is not False:
+                            return "".join(read), done is True
+                    if read and interdigit_timeout_s is not None:
+                        next_deadline = loop.time() + interdigit_timeout_s
+                        timeout.reschedule(next_deadline if deadline is None else min(deadline, next_deadline))
+                    self._waiter = loop.create_future()
+                    try:
+                        await self._waiter
+                    finally:
+                        self._waiter = None
+        except asyncio.TimeoutError:
+            pass
+        return "".join(read), False
+
+
+class ChannelEventQueue:
+    """
+    The events of a channel that were not waited for yet, in the order they occurred. Like a set event, an
+    event type is queued at most once. Tasks waiting while an event occurs all receive it. Unread DTMF is
+    reported once by IVRCallMixin.wait_channel_event regardless of this queue.
+    """
+    def __init__(self):
+        self.events = deque()
+        self._waiters = []
+
+    def push(self, event_type):
+        if self._waiters:
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(event_type)
+            self._waiters.clear()
+        elif event_type not in self.events:
+            self.events.append(event_type)
+
+    def discard(self, event_type):
+        """
+        Forget a queued event that is outdated, e.g. the end of an earlier playback.
+        """
+        if event_type in self.events:
+            self.events.remove(event_type)
+
+    async def get(self, timeout_s=None):
+        """
+        Return the next event, waiting at most timeout_s seconds for it.
+
+        :return: The type of event or None if a timeout occurred
+        """
+        if self.events:
+            return self.events.popleft()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(timeout_s):
+                return await waiter
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+
+class IVRCallMixin:
+    """
+    The API to interact with a single call: play and record audio and read DTMF input. YateIVR provides it for
+    the one call of its process, IVRSession for every call of a YateIVRServer. Classes using it set up the
+    attributes in _init_call and implement _attach to send chan.attach to their channel.
+    """
+    def _init_call(self):
+        self.call_params = {}
+        self.call_id = None
+        self.dtmf = DTMFCollector()
+        # chan.notify and chan.dtmf of the call report their events here
+        self.channel_events = ChannelEventQueue()
+        # unread DTMF is reported by wait_channel_event once per chan.dtmf
+        self._dtmf_reported = False
+        self._hangup_handlers = []
+
+    async def _attach(self, params):
+        raise NotImplementedError()
 
     def _chan_notify_handler(self, msg):
         if msg.params.get("reason", "") == "eof":
-            self.playback_end_event.set()
+            self.channel_events.push(ChannelEventType.PLAYBACK_END)
         return True
 
     def _chan_dtmf_handler(self, msg):
-        self.dtmf_buffer += msg.params["text"]
-        self.dtmf_event.set()
+        self.dtmf.push(msg.params["text"])
+        self._dtmf_reported = False
+        self.channel_events.push(ChannelEventType.DTMF)
         return True
 
-    async def _yate_stream_closed(self):
-        for func in self._hangup_handlers:
-            func()
-        self.main_task.cancel()
-        return True
+    @property
+    def dtmf_buffer(self) -> str:
+        """
+        DTMF symbols the caller entered that were not read yet.
+        """
+        return "".join(self.dtmf.symbols)
+
+    async def _read_dtmf(self, finished, timeout_s, interdigit_timeout_s):
+        symbols, matched = await self.dtmf.read(finished, timeout_s, interdigit_timeout_s)
+        if not self.dtmf.symbols:
+            # nothing left for wait_channel_event to report
+            self.channel_events.discard(ChannelEventType.DTMF)
+        return symbols, matched
 
     def register_hangup_handler(self, func: Callable):
         """
         Register a function that should be called when the remote end hung up
         the call before the main task is canceled. Multiple functions
         can be registered in this way. They will be called in the order of their
-        registration. Please note that Yate indicates the hangup to us by closing our
+        registration. Please note that Yate indicates the hangup to a YateIVR by closing our
         communication channel. So, no Yate communication is possible in the handlers
-        you register here.
+        you register there.
 
         :param func: A callable with no parameters
         """
@@ -86,11 +385,11 @@ class YateIVR(YateAsync):
         }
         if repeat:
             msg_params["autorepeat"] = "true"
-        play_msg = MessageRequest("chan.attach", msg_params)
-        self.playback_end_event.clear()
-        await self.send_message_async(play_msg)
+        self.channel_events.discard(ChannelEventType.PLAYBACK_END)
+        await self._attach(msg_params)
         if complete:
-            await self.playback_end_event.wait()
+            while await self.channel_events.get() != ChannelEventType.PLAYBACK_END:
+                pass
         return True
 
     async def play_soundfiles_as_one(self, paths: list[str], complete: bool = False) -> bool:
@@ -110,16 +409,15 @@ class YateIVR(YateAsync):
                     "source": f"wave/play/{path}",
                     "notify": self.call_id,
                 }
-                play_msg = MessageRequest("chan.attach", msg_params)
-                self.playback_end_event.clear()
-                await self.send_message_async(play_msg)
+                self.channel_events.discard(ChannelEventType.PLAYBACK_END)
+                await self._attach(msg_params)
 
                 cur_playback_done = False
                 while not cur_playback_done:
-                    event_type = await self.wait_channel_event()
+                    # ignored DTMF stays pending for the application
+                    event_type = await (self.channel_events.get() if complete else self.wait_channel_event())
                     if event_type == ChannelEventType.DTMF:
                         if complete:
-                            self.dtmf_event.clear()
                             continue  # Ignore the event
                         break
                     elif event_type == ChannelEventType.PLAYBACK_END:
@@ -180,62 +478,75 @@ class YateIVR(YateAsync):
             "consumer": "wave/record/{}".format(path),
             "notify": self.call_id,
         }
-        play_msg = MessageRequest("chan.attach", msg_params)
-        res = await self.send_message_async(play_msg)
+        res = await self._attach(msg_params)
 
-    async def read_dtmf_until(self, stop_symbols: str, timeout_s: float = None) -> str:
+    async def read_dtmf_until(self, stop_symbols: str, timeout_s: float = None,
+                              interdigit_timeout_s: float = None) -> str:
         """
         Waits for DTMF input and collects it until one of the stop symbols occurs.
-        Returns all collected symbols (including the stop symbol)
+        Returns all collected symbols (including the stop symbol). Symbols the caller typed ahead are read
+        first, symbols after the stop symbol are kept for the next read.
 
         :param stop_symbols: A string of symbols. If the first symbol from the string is entered as DTMF,
                               the function return
         :param timeout_s: Optional, if not none, wait for at most timeout_s seconds and returns whatever
                           DTMF symbols where read until then.
+        :param interdigit_timeout_s: Optional, if not none, wait for at most interdigit_timeout_s seconds for
+                                     the next symbol once the first was read.
         :return: DTMF symbols read.
         """
-        local_buf = ""
-        try:
-            async with asyncio.timeout(timeout_s):
-                self.dtmf_buffer = ""
-                while True:
-                    await self.dtmf_event.wait()
-                    self.dtmf_event.clear()
-                    for i in range(len(self.dtmf_buffer)):
-                        local_buf += self.dtmf_buffer[i]
-                        if self.dtmf_buffer[i] in stop_symbols:
-                            self.dtmf_buffer = self.dtmf_buffer[i:]
-                            return local_buf
-                    self.dtmf_buffer = ""
-        except asyncio.TimeoutError:
-            pass
-        return local_buf
+        symbols, _stopped = await self._read_dtmf(lambda read: read[-1] in stop_symbols, timeout_s,
+                                                  interdigit_timeout_s)
+        return symbols
 
-    async def read_dtmf_symbols(self, count: int, timeout_s: float = None) -> str:
+    async def read_dtmf_symbols(self, count: int, timeout_s: float = None,
+                                interdigit_timeout_s: float = None) -> str:
         """
         Waits for DTMF input and collects it until count symbols occurred.
-        Returns all collected symbols.
+        Returns all collected symbols. Symbols the caller typed ahead are read first.
 
         :param count: The number of symbols that should be read.
         :param timeout_s: Optional, if not none, wait for at most timeout_s seconds and returns whatever
                           DTMF symbols where read until then.
+        :param interdigit_timeout_s: Optional, if not none, wait for at most interdigit_timeout_s seconds for
+                                     the next symbol once the first was read.
         :return: DTMF symbols read.
         """
-        result = ""
-        try:
-            async with asyncio.timeout(timeout_s):
-                self.dtmf_buffer = ""
-                for _ in range(count):
-                    await self.dtmf_event.wait()
-                    self.dtmf_event.clear()
-                    if len(self.dtmf_buffer) >= count:
-                        break
-            result = self.dtmf_buffer[:count]
-            self.dtmf_buffer = self.dtmf_buffer[count:]
-            return result
-        except asyncio.TimeoutError:
-            pass
-        return result
+        if count <= 0:
+            return ""
+        symbols, _complete = await self._read_dtmf(lambda read: len(read) >= count, timeout_s,
+                                                   interdigit_timeout_s)
+        return symbols
+
+    async def read_dtmf_pattern(self, pattern, timeout_s: float = None,
+                                interdigit_timeout_s: float = None) -> Optional[str]:
+        """
+        Waits for DTMF input and collects it until it matches pattern. Returns as soon as the symbols read
+        match, the symbols the caller entered afterwards are kept for the next read. A dial plan pattern also
+        stops at the first symbol that does not fit, a compiled regular expression only on a match or timeout.
+
+        :param pattern: Dial plan style pattern like "X{4}#" or a compiled regular expression, see
+                        compile_dtmf_pattern.
+        :param timeout_s: Optional, if not none, wait for at most timeout_s seconds for matching input.
+        :param interdigit_timeout_s: Optional, if not none, wait for at most interdigit_timeout_s seconds for
+                                     the next symbol once the first was read.
+        :return: The matching DTMF symbols, or None if the input did not match or a timeout occurred. The
+                 symbols read until then, up to the one that did not fit, are dropped.
+        """
+        compiled = compile_dtmf_pattern(pattern)
+        if isinstance(compiled, re.Pattern):
+            def finished(read):
+                return compiled.fullmatch("".join(read)) is not None
+        else:
+            state = compiled.start
+
+            def finished(read):
+                nonlocal state
+                state = compiled.step(state, read[-1])
+                # None once the input cannot match anymore
+                return compiled.matches(state) if state else None
+        symbols, matched = await self._read_dtmf(finished, timeout_s, interdigit_timeout_s)
+        return symbols if matched else None
 
     async def silence(self):
         """
@@ -249,8 +560,7 @@ class YateIVR(YateAsync):
         Attach a certain tone as source to our channel
         :return: The returned yate message
         """
-        tone_msg = MessageRequest("chan.attach", {"source": "tone/" + name})
-        return await self.send_message_async(tone_msg)
+        return await self._attach({"source": "tone/" + name})
 
     async def wait_channel_event(self, timeout_s: float = None) -> Optional[ChannelEventType]:
         """
@@ -260,22 +570,54 @@ class YateIVR(YateAsync):
         :param timeout_s: Maximum of seconds to wait for a channel event.
         :return: The type of event that occurred or None if a timeout occurred
         """
-        dtmf_waiter = asyncio.create_task(self.dtmf_event.wait())
-        play_waiter = asyncio.create_task(self.playback_end_event.wait())
-        done, pending = await asyncio.wait([dtmf_waiter, play_waiter], timeout=timeout_s, return_when=asyncio.FIRST_COMPLETED)
-        for t in pending:
-            t.cancel()
-        if dtmf_waiter in done:
+        if self.dtmf.symbols and not self._dtmf_reported:
+            # DTMF that arrived while nobody waited for it, e.g. during play_soundfile(complete=True). Reported
+            # once, so that a loop ignoring DTMF waits for the next event instead of spinning.
+            self._dtmf_reported = True
+            self.channel_events.discard(ChannelEventType.DTMF)
             return ChannelEventType.DTMF
-        elif play_waiter in done:
-            return ChannelEventType.PLAYBACK_END
-        else:
-            return None
+        event_type = await self.channel_events.get(timeout_s)
+        if event_type == ChannelEventType.DTMF:
+            self._dtmf_reported = True
+        return event_type
+
+
+class YateIVR(IVRCallMixin, YateAsync):
+    def __init__(self):
+        super().__init__()
+        self._call_ready_future = None
+        self._init_call()
+        # register a listener that takes the call.execute message from yate for the incoming call
+        self.register_message_handler("call.execute", self._initial_call_execute_handler, install=False)
+
+    async def _amain(self, application_main):
+        self._call_ready_future = asyncio.get_event_loop().create_future()
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, self._handle_sigterm)
+        await super()._amain(application_main)
+
+    def _handle_sigterm(self):
+        self.main_task.cancel()
+
+    def _initial_call_execute_handler(self, msg):
+        self.call_params = msg.params
+        self.call_id = msg.params["id"]
+        asyncio.create_task(self._install_ivr_handlers())
+        self.unregister_message_handler("call.execute")
+        return True  # Acknowledge that we accepted the call
+
+    async def _yate_stream_closed(self):
+        for func in self._hangup_handlers:
+            func()
+        self.main_task.cancel()
+        return True
 
     async def _install_ivr_handlers(self):
-        await self.register_message_handler_async("chan.notify", self._chan_notify_handler, 100, "targetid",
-                                                  self.call_id)
-        await self.register_message_handler_async("chan.dtmf", self._chan_dtmf_handler, 100, "id", self.call_id)
+        # both installs in a single round trip to yate
+        await self.register_handlers_async([
+            HandlerRegistration.for_message("chan.notify", self._chan_notify_handler, 100, "targetid",
+                                            self.call_id),
+            HandlerRegistration.for_message("chan.dtmf", self._chan_dtmf_handler, 100, "id", self.call_id),
+        ])
         self._call_ready_future.set_result(None)
 
     async def _amain_ready(self):
@@ -283,3 +625,133 @@ class YateIVR(YateAsync):
         await self._call_ready_future
         # well, now we can proceed to applications main
 
+    async def _attach(self, params):
+        # yate passes the messages of our process to its channel
+        return await self.send_message_async(MessageRequest("chan.attach", params))
+
+
+class IVRSession(IVRCallMixin):
+    """
+    One call of a YateIVRServer. It provides the same API as YateIVR, the messages for the call are sent over
+    the connection of the server.
+    """
+    def __init__(self, server, msg):
+        self.server = server
+        self._init_call()
+        self.call_params = msg.params
+        self.call_id = msg.params["id"]
+        # our end of the call, known once yate connected the call to it
+        self.channel_id = None
+        self.main_task = None
+
+    async def _attach(self, params):
+        # the connection of the server does not belong to a channel, so address ours explicitly
+        attach_msg = MessageRequest("chan.masquerade", {"message": "chan.attach", "id": self.channel_id, **params})
+        return await self.server.send_message_async(attach_msg)
+
+    async def drop(self):
+        """
+        Hang up the call.
+        """
+        await self.server.send_message_async(MessageRequest("call.drop", {"id": self.channel_id}))
+
+
+class YateIVRServer(YateAsync):
+    """
+    Serves the IVR calls of many channels over a single TCP or Unix socket connection to yate, instead of a
+    process per call started by yate. Calls are routed to the server with a callto starting with callto_prefix,
+    e.g. "ivr/menu". The server takes them by passing call.execute on to a dumb channel and runs call_main with
+    an IVRSession for every call.
+
+    The handlers for chan.notify, chan.dtmf and chan.hangup as well as the watch for call.execute are installed
+    once for all calls. Every call adds routes to them, so starting a call takes no additional round trip.
+    """
+    def __init__(self, host=None, port=None, sockpath=None, callto_prefix="ivr/", priority=50):
+        super().__init__(host, port, sockpath)
+        if self.mode == self.MODE_STDIO:
+            raise ValueError("The IVR server needs a TCP or Unix socket connection to yate")
+        self.callto_prefix = callto_prefix
+        self.priority = priority
+        # sessions by the id of the calling channel
+        self.sessions = {}
+        self._call_main = None
+        self._execute_router = MessageRouter("id")
+        self._notify_router = MessageRouter("targetid")
+        self._dtmf_router = MessageRouter("id")
+        self._hangup_router = MessageRouter("id")
+
+    def run(self, call_main):
+        """
+        Serve calls until the server is cancelled.
+
+        :param call_main: Coroutine function run for every call with its IVRSession. The call is dropped when
+                          it returns.
+        """
+        super().run(lambda _yate: self.serve(call_main))
+
+    async def serve(self, call_main):
+        self._call_main = call_main
+        await self.register_handlers_async([
+            HandlerRegistration.for_message("call.execute", self._call_execute_handler, self.priority),
+            HandlerRegistration.for_watch("call.execute", self._execute_router),
+            HandlerRegistration.for_message("chan.notify", self._notify_router, self.priority),
+            HandlerRegistration.for_message("chan.dtmf", self._dtmf_router, self.priority),
+            HandlerRegistration.for_watch("chan.hangup", self._hangup_router),
+        ])
+        await asyncio.get_running_loop().create_future()
+
+    def _call_execute_handler(self, msg):
+        if not msg.params.get("callto", "").startswith(self.callto_prefix):
+            return False
+        session = IVRSession(self, msg)
+        self.sessions[session.call_id] = session
+        self._execute_router.add(session.call_id, self._call_executed)
+        self._hangup_router.add(session.call_id, self._call_hangup)
+        # let yate connect the call to a dumb channel that serves as our end of it
+        msg.params["callto"] = "dumb/"
+        return False
+
+    def _call_executed(self, msg):
+        session = self.sessions.get(msg.params["id"])
+        self._execute_router.discard(msg.params["id"])
+        if session is None:
+            return
+        if not msg.processed:
+            self._end_session(session)
+            return
+        session.channel_id = msg.params.get("peerid") or msg.params["targetid"]
+        self._notify_router.add(session.call_id, session._chan_notify_handler)
+        self._dtmf_router.add(session.call_id, session._chan_dtmf_handler)
+        session.main_task = asyncio.create_task(self._run_session(session))
+
+    async def _run_session(self, session):
+        try:
+            try:
+                await self._call_main(session)
+            except Exception:
+                logger.exception("IVR session of call %s failed", session.call_id)
+            # the caller is still connected, end the call
+            self.send_message(MessageRequest("call.drop", {"id": session.channel_id}), fire_and_forget=True)
+        except asyncio.CancelledError:
+            # the caller hung up
+            pass
+        finally:
+            self._end_session(session)
+
+    def _call_hangup(self, msg):
+        session = self.sessions.get(msg.params["id"])
+        if session is None:
+            return
+        for func in session._hangup_handlers:
+            func()
+        if session.main_task is not None:
+            session.main_task.cancel()
+        else:
+            self._end_session(session)
+
+    def _end_session(self, session):
+        if self.sessions.get(session.call_id) is not session:
+            return
+        del self.sessions[session.call_id]
+        for router in (self._execute_router, self._notify_router, self._dtmf_router, self._hangup_router):
+            router.discard(session.call_id)
@@ -0,0 +1,47 @@
+"""
+Launcher that yate executes for an IVR call instead of the IVR script itself. It hands its stdin and stdout,
+the connection of the call to yate, to a warm worker of an IVRProcessPool (see yate.ivrpool) and waits until the
+worker finished the call. It only imports what it needs to pass on the file descriptors, so the call does not
+wait for the startup of asyncio and the IVR library.
+"""
+import os
+import sys
+# the socket module pulls in enum, selectors and more, the C module is enough to pass file descriptors
+import _socket
+
+
+def launch(sockpath, fallback=None):
+    """
+    Pass stdin and stdout to the IVR process pool listening on sockpath and wait until the call ended.
+
+    :param fallback: Command line (list) to execute instead if the pool is not reachable, e.g. the IVR script
+                     itself.
+    :return: Exit code for the launcher
+    """
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        connection.connect(sockpath)
+    except OSError as e:
+        if not fallback:
+            print("Cannot reach the IVR process pool at {}: {}".format(sockpath, e), file=sys.stderr)
+            return 1
+        os.execvp(fallback[0], fallback)
+    fds = b"".join(fd.to_bytes(4, sys.byteorder) for fd in (0, 1))
+    connection.sendmsg([b"call"], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, fds)])
+    os.close(0)
+    os.close(1)
+    # the worker keeps the connection open for the duration of the call
+    while connection.recv(64):
+        pass
+    return 0
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: {} <pool socket> [fallback command ...]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(2)
+    sys.exit(launch(sys.argv[1], sys.argv[2:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,58 @@
+# collections.abc imports all of collections, its implementation is loaded on interpreter startup anyway
+from _collections_abc import MutableMapping
+
 ORD_PERCENT = ord("%")
 ORD_COLON = ord(":")
+ORD_EQUALS = ord("=")
 
+# Yate escapes every byte below 32, the field separator ":" and the escape character "%" itself.
+# Both directions are table driven: a single regex pass finds all bytes that need translation and
+# the replacement is a plain dict lookup, so the cost is linear in the size of the input.
+# The regular expressions are compiled on first use, the C accelerator does not need re at all.
+_yate_encode_pattern = None
+_yate_encode_table = {bytes([c]): b"%" + bytes([c + 64]) for c in range(32)}
+_yate_encode_table[b":"] = b"%" + bytes([ORD_COLON + 64])
+_yate_encode_table[b"%"] = b"%%"
 
-def yate_decode_bytes(byte_input: bytes):
-    output = b""
-    view = memoryview(byte_input)
-    pos = 0
+_yate_decode_pattern = None
+_yate_decode_table = {b"%" + bytes([c]): bytes([c - 64]) for c in range(64, 256)}
+_yate_decode_table[b"%%"] = b"%"
+
+
+def _compile_patterns():
+    global _yate_encode_pattern, _yate_decode_pattern
+    import re
+    _yate_encode_pattern = re.compile(b"[\x00-\x1f:%]")
+    _yate_decode_pattern = re.compile(b"%.?", re.DOTALL)
+
+
+def _yate_encode_replacement(match):
+    return _yate_encode_table[match.group()]
+
+
+def _yate_decode_replacement(match):
     try:
-        while True:
-            next_percent = byte_input.find(ORD_PERCENT, pos)
-            if next_percent < 0:
-                return output + view[pos:]
-            output += view[pos:next_percent]
-            if view[next_percent+1] == ORD_PERCENT:
-                output += b"%"
-            else:
-                output += (view[next_percent+1]-64).to_bytes(1, "big")
-            pos = next_percent+2
-    except IndexError:
-        raise YateMessageParsingError("Received invalid yate message. Upcode without encoded character")
-    except ValueError:
+        return _yate_decode_table[match.group()]
+    except KeyError:
+        if len(match.group()) < 2:
+            raise YateMessageParsingError("Received invalid yate message. Upcode without encoded character")
         raise YateMessageParsingError("Received invalid upcode: Encoded character too small")
 
 
+def yate_decode_bytes(byte_input: bytes):
+    if ORD_PERCENT not in byte_input:
+        return bytes(byte_input)
+    if _yate_decode_pattern is None:
+        _compile_patterns()
+    return _yate_decode_pattern.sub(_yate_decode_replacement, byte_input)
+
+
 def yate_encode_bytes(byte_input: bytes):
-    output = b""
-    view = memoryview(byte_input)
-    pos = 0
-    for i in range(len(byte_input)):
-        if view[i] < 32 or view[i] == ORD_COLON:
-            output += view[pos:i]
-            output += b"%" + (view[i]+64).to_bytes(1, "big")
-            pos = i+1
-        elif view[i] == ORD_PERCENT:
-            output += view[pos:i]
-            output += b"%%"
-            pos = i+1
-    output += view[pos:]
-    return output
+    if _yate_encode_pattern is None:
+        _compile_patterns()
+    if _yate_encode_pattern.search(byte_input) is None:
+        return bytes(byte_input)
+    return _yate_encode_pattern.sub(_yate_encode_replacement, byte_input)
 
 
 def yate_decode_split(bytes_input):
@@ -69,20 +84,266 @@ class YateMessageParsingError(Exception):
         super().__init__(message)
 
 
+def _decode_field(field):
+    if ORD_PERCENT in field:
+        field = yate_decode_bytes(field)
+    return field.decode("utf-8")
+
+
+_encoded_keys = {}
+
+
+def _encode_key(key):
+    try:
+        return _encoded_keys[key]
+    except KeyError:
+        pass
+    if len(_encoded_keys) >= 4096:
+        _encoded_keys.clear()
+    # like yate, escape "=" in parameter names so that the first "=" always separates name and value
+    raw_key = _encoded_keys[key] = yate_encode_bytes(key.encode("utf-8")).replace(b"=", b"%}")
+    return raw_key
+
+
+def _encode_value(value):
+    return yate_encode_bytes(value.encode("utf-8"))
+
+
+_DELETED = object()
+# below this many parameters, encoding all of them in C costs less than copying the unmodified ones
+_DELTA_ENCODE_MIN_PARAMS = 12
+# marks parameters that were not modified, None is a valid value
+_UNSET = object()
+
+
+class MessageParams(MutableMapping):
+    """
+    The parameters of a message received from yate.
+
+    Behaves like a dict, but keeps the encoded form received from yate. Parameters that are not
+    modified keep their original encoding, so answering a message does not encode them again.
+    Without the C accelerator parameters are only decoded when they are accessed.
+    Note that malformed parameters are only detected when they are accessed.
+    """
+    __slots__ = ("_line", "_index", "_lazy", "_modified")
+
+    def __init__(self, params=None, line=None, decoded=None):
+        # the message line received from yate, the encoded parameters follow the return value
+        self._line = line
+        # key -> value of the received parameters, unless decoded is given built on first access.
+        # Values are kept encoded until they are read.
+        self._index = decoded
+        self._lazy = decoded is None
+        # key -> new value (or _DELETED) for all parameters modified after receiving the message
+        self._modified = {}
+        if params is not None:
+            self.update(params)
+
+    def _build_index(self):
+        index = self._index = {}
+        if self._line is not None:
+            for field in self._line.split(b":")[5:]:
+                raw_key, _, value = field.partition(b"=")
+                # if a parameter occurs multiple times, the last one wins just like building a dict from them
+                index[_decode_field(raw_key)] = value
+        return index
+
+    def _keys(self):
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        if not self._modified:
+            return index.keys()
+        keys = dict.fromkeys(index)
+        for key, value in self._modified.items():
+            if value is _DELETED:
+                keys.pop(key, None)
+            else:
+                keys[key] = None
+        return keys
+
+    def __getitem__(self, key):
+        value = self._modified.get(key, _UNSET)
+        if value is not _UNSET:
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        value = index[key]
+        if value.__class__ is bytes:
+            value = index[key] = _decode_field(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._modified[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._modified[key] = _DELETED
+
+    def __contains__(self, key):
+        value = self._modified.get(key, _UNSET)
+        if value is not _UNSET:
+            return value is not _DELETED
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        return key in index
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, dict(self))
+
+    def copy(self):
+        return dict(self)
+
+    @property
+    def modified(self):
+        """
+        :return: The names of all parameters that were set or deleted after receiving the message
+        """
+        return list(self._modified)
+
+    def _modified_spans(self, buffer):
+        index = self._index
+        # without duplicate parameters, the search for a modified one ends at its first occurrence
+        unique = index is not None and len(index) == buffer.count(b":") - 1
+        spans = []
+        missing = []
+        for key, value in self._modified.items():
+            raw_key = _encode_key(key)
+            replacement = None if value is _DELETED else raw_key + b"=" + _encode_value(value)
+            span = None if index is not None and key not in index else _find_field(buffer, raw_key, 0)
+            if span is None:
+                missing.append(replacement)
+                continue
+            # like in a dict, the parameter keeps the position of its first occurrence
+            spans.append((*span, replacement))
+            while not unique:
+                span = _find_field(buffer, raw_key, span[1])
+                if span is None:
+                    break
+                spans.append((*span, None))
+        spans.sort()
+        return spans, missing
+
+    def encode_fields(self):
+        """
+        :return: A list of encoded chunks of "key=value" fields that make up all parameters when joined by ":".
+                 Unmodified parameters are copied from the received message.
+        """
+        if self._line is None:
+            return [_encode_key(key) + b"=" + _encode_value(value)
+                    for key, value in self._modified.items() if value is not _DELETED]
+        if not self._modified:
+            return [self._line.split(b":", 5)[5]]
+        index = self._index
+        if not self._lazy and len(index) < _DELTA_ENCODE_MIN_PARAMS and len(index) == self._line.count(b":") - 4:
+            # without duplicate or empty fields, encoding all parameters again gives the same parameters
+            fields = self._encode_all()
+            if fields is not None:
+                return fields
+        buffer = b":" + self._line.split(b":", 5)[5] + b":"
+        spans, missing = self._modified_spans(buffer)
+        chunks = []
+        # the buffer starts and ends with a ":", the fields in between are copied without their separators
+        previous_end = 0
+        for start, end, replacement in spans:
+            if start > previous_end + 1:
+                chunks.append(buffer[previous_end + 1:start - 1])
+            if replacement is not None:
+                chunks.append(replacement)
+            previous_end = end
+        if previous_end < len(buffer) - 1:
+            chunks.append(buffer[previous_end + 1:len(buffer) - 1])
+        chunks.extend(replacement for replacement in missing if replacement is not None)
+        return chunks
+
+
+    def _encode_all(self):
+        params = dict(self._index)
+        for key, value in self._modified.items():
+            if value is _DELETED:
+                params.pop(key, None)
+            else:
+                params[key] = value
+        if "=" in "".join(params):
+            # "=" in a name needs the escaping of _encode_key
+            return None
+        return [yate_encode_join(*map("=".join, params.items()))] if params else []
+
+
+def _find_field(buffer, raw_key, start):
+    # ":" never occurs unescaped in keys and values, so it reliably marks the start of a field
+    pattern = b":" + raw_key
+    pos = buffer.find(pattern, start)
+    while pos >= 0:
+        end = pos + len(pattern)
+        if buffer[end] == ORD_EQUALS or buffer[end] == ORD_COLON:
+            return pos + 1, buffer.index(b":", end)
+        pos = buffer.find(pattern, end)
+    return None
+
+
+def _encode_params(params):
+    if isinstance(params, MessageParams):
+        return params.encode_fields()
+    return [_encode_key(key) + b"=" + _encode_value(value) for key, value in params.items()]
+
+
 def parse_yate_message(bytes_input):
-    split_msg = yate_decode_split(bytes_input)
-    message_type = split_msg[0]
+    # The C codec decodes a whole message in less time than python takes to find the few parameters a
+    # handler reads. "=" escaped in a parameter name would be taken as separator once decoded, searching
+    # for the rare "}" first is a lot faster than searching for "%}".
+    if HAS_SPEEDUPS and (b"}" not in bytes_input or b"%}" not in bytes_input):
+        try:
+            fields = yate_decode_split(bytes_input)
+        except (YateMessageParsingError, UnicodeDecodeError):
+            # keep the valid parameters readable, only the malformed ones raise when accessed
+            fields = None
+        if fields is not None:
+            message_class = _yate_message_type_table.get(fields[0])
+            if message_class is Message and len(fields) >= 5:
+                params = MessageParams(None, bytes_input, yate_parse_keyvalue(fields[5:])) if len(fields) > 5 \
+                    else MessageParams()
+                return Message.from_header(fields, params)
+            if message_class is not None:
+                return message_class.parse(fields)
+    # the parameters of messages are kept in their encoded form, so split off the header
+    fields = bytes_input.split(b":", 5)
+    message_type = _decode_field(fields[0])
     message_class = _yate_message_type_table.get(message_type)
     if message_class is None:
         raise YateMessageParsingError("Unknown message type: {}".format(message_type))
-    return message_class.parse(split_msg)
+    if message_class is Message and len(fields) >= 5:
+        # Messages make up most of the traffic. Only their header is decoded right away, parameters are
+        # decoded when they are accessed.
+        header = [message_type, *map(_decode_field, fields[1:5])]
+        return Message.from_header(header, MessageParams(line=bytes_input) if len(fields) > 5 else MessageParams())
+    fields = bytes_input.split(b":")
+    return message_class.parse([message_type, *map(_decode_field, fields[1:])])
 
 
 class Message:
+    msg_type = "message"
+    __slots__ = ("id", "time", "processed", "name", "return_value", "params", "reply")
+
     @classmethod
     def parse(cls, data):
         if len(data) < 5:
             raise YateMessageParsingError("Invalid message from yate with only {} parameters".format(len(data)))
+        return cls.from_header(data, yate_parse_keyvalue(data[5:]))
+
+    @classmethod
+    def from_header(cls, data, params):
         reply = (data[0] == "%<message")
         id = data[1]
         if reply:
@@ -96,11 +357,9 @@ class Message:
                 raise YateMessageParsingError("Invalid message time from yate: {}".format(data[2]))
         name = data[3]
         return_value = data[4]
-        params = yate_parse_keyvalue(data[5:])
         return cls(id, time, name, return_value, params, processed, reply)
 
     def __init__(self, id, time, name, return_value, params, processed=None, reply=False):
-        self.msg_type = "message"
         self.id = id
         self.time = time
         self.processed = processed
@@ -111,15 +370,13 @@ class Message:
 
     def encode_answer_for_yate(self, processed):
         processed = str(processed).lower()
-        return yate_encode_join("%<message",
-                                self.id,
-                                processed,
-                                self.name,
-                                self.return_value,
-                                *["=".join(item) for item in self.params.items()])
+        header = yate_encode_join("%<message", self.id, processed, self.name, self.return_value)
+        return b":".join([header, *_encode_params(self.params)])
 
 
 class MessageRequest:
+    __slots__ = ("name", "return_value", "params")
+
     def __init__(self, name, params, return_value=""):
         self.name = name
         self.return_value = return_value
@@ -135,6 +392,8 @@ class MessageRequest:
 
 
 class InstallRequest:
+    __slots__ = ("priority", "name", "filter_name", "filter_value")
+
     def __init__(self, prioriy, name, filtername=None, filtervalue=None):
         self.priority = prioriy
         self.name = name
@@ -161,6 +420,8 @@ class InstallRequest:
 
 
 class InstallUninstallBase:
+    __slots__ = ("priority", "name", "success")
+
     @classmethod
     def parse(cls, data):
         if len(data) < 4:
@@ -175,8 +436,10 @@ class InstallUninstallBase:
 
 
 class InstallConfirm(InstallUninstallBase):
+    msg_type = "install"
+    __slots__ = ()
+
     def __init__(self, priority, name, success):
-        self.msg_type = "install"
         self.priority = priority
         self.name = name
         self.success = success
@@ -186,6 +449,8 @@ class InstallConfirm(InstallUninstallBase):
 
 
 class UninstallRequest:
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -200,8 +465,10 @@ class UninstallRequest:
 
 
 class UninstallConfirm(InstallUninstallBase):
+    msg_type = "uninstall"
+    __slots__ = ()
+
     def __init__(self, priority, name, success):
-        self.msg_type = "uninstall"
         self.priority = priority
         self.name = name
         self.success = success
@@ -211,6 +478,8 @@ class UninstallConfirm(InstallUninstallBase):
 
 
 class WatchRequest:
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -225,6 +494,9 @@ class WatchRequest:
 
 
 class WatchConfirm:
+    msg_type = "watch"
+    __slots__ = ("name", "success")
+
     @classmethod
     def parse(cls, data):
         if len(data) < 3:
@@ -234,7 +506,6 @@ class WatchConfirm:
         return cls(name, success)
 
     def __init__(self, name, success):
-        self.msg_type = "watch"
         self.name = name
         self.success = success
 
@@ -243,6 +514,8 @@ class WatchConfirm:
 
 
 class UnwatchRequest:
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -257,6 +530,9 @@ class UnwatchRequest:
 
 
 class UnwatchConfirm:
+    msg_type = "unwatch"
+    __slots__ = ("name", "success")
+
     @classmethod
     def parse(cls, data):
         if len(data) < 3:
@@ -266,7 +542,6 @@ class UnwatchConfirm:
         return cls(name, success)
 
     def __init__(self, name, success):
-        self.msg_type = "unwatch"
         self.name = name
         self.success = success
 
@@ -275,8 +550,10 @@ class UnwatchConfirm:
 
 
 class SetLocalRequest:
+    msg_type = "setlocal"
+    __slots__ = ("param", "value")
+
     def __init__(self, param, value=None):
-        self.msg_type = "setlocal"
         self.param = param
         self.value = value or ""
 
@@ -293,8 +570,10 @@ class SetLocalRequest:
 
 
 class SetLocalAnswer:
+    msg_type = "setlocal"
+    __slots__ = ("param", "value", "success")
+
     def __init__(self, param, value, success):
-        self.msg_type = "setlocal"
         self.param = param
         self.value = value
         self.success = success
@@ -311,6 +590,8 @@ class SetLocalAnswer:
 
 
 class ConnectToYate:
+    __slots__ = ("role", "id", "type")
+
     def __init__(self, role="global", id=None, type=None):
         self.role = role
         self.id = id
@@ -339,3 +620,21 @@ _yate_message_type_table = {
     "%>setlocal": SetLocalRequest,
     "%<setlocal": SetLocalAnswer,
 }
+
+
+# The pure python implementation of the codec is kept around as reference, e.g. for testing the C
+# implementation against it.
+_pure_python_codec = {
+    "yate_decode_bytes": yate_decode_bytes,
+    "yate_encode_bytes": yate_encode_bytes,
+    "yate_decode_split": yate_decode_split,
+    "yate_encode_join": yate_encode_join,
+    "yate_parse_keyvalue": yate_parse_keyvalue,
+}
+
+try:
+    from yate._speedups import (yate_decode_bytes, yate_encode_bytes, yate_decode_split, yate_encode_join,
+                                yate_parse_keyvalue)
+    HAS_SPEEDUPS = True
+except ImportError:
+    HAS_SPEEDUPS = False
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+from collections import Counter
+
+from yate.asyncio import YateAsync, HandlerRegistration
+
+logger = logging.getLogger("yate")
+
+
+class WorkerProcess:
+    __slots__ = ("index", "registrations", "process", "stats_connection", "started", "failures")
+
+    def __init__(self, index):
+        self.index = index
+        self.registrations = []
+        self.process = None
+        self.stats_connection = None
+        self.started = None
+        self.failures = 0
+
+
+def reset_worker_signals():
+    """
+    Let a forked worker process ignore SIGINT and end on SIGTERM. Its parent decides when workers end, and the
+    worker would otherwise inherit the handlers of run_until_signalled.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def run_until_signalled(start, supervise, stop):
+    """
+    Call start, then supervise once a second until we receive SIGINT or SIGTERM, and finally stop.
+    """
+    stopping = []
+
+    def request_stop(_signum, _frame):
+        stopping.append(True)
+
+    previous_handlers = [signal.signal(signum, request_stop) for signum in (signal.SIGINT, signal.SIGTERM)]
+    start()
+    try:
+        while not stopping:
+            supervise(timeout=1.0)
+    finally:
+        stop()
+        for signum, handler in zip((signal.SIGINT, signal.SIGTERM), previous_handlers):
+            signal.signal(signum, handler)
+
+
+def _run_worker(index, connection_args, registrations, application_main, stats_connection, stats_interval):
+    reset_worker_signals()
+    yate = YateAsync(**connection_args)
+
+    async def report_stats():
+        while True:
+            stats_connection.send(dict(yate.stats))
+            await asyncio.sleep(stats_interval)
+
+    async def worker_main(yate):
+        results = await yate.register_handlers_async(registrations)
+        for registration, success in zip(registrations, results):
+            if not success:
+                logger.error("Yate refused to %s %s", "watch" if registration.watch else "install",
+                             registration.message)
+        reporter = asyncio.create_task(report_stats())
+        try:
+            if application_main is not None:
+                await application_main(yate, index)
+            else:
+                await asyncio.get_running_loop().create_future()
+        finally:
+            reporter.cancel()
+
+    # a worker without its connection to yate is of no use, end it so the supervisor starts a new one
+    yate.set_termination_handler(lambda: yate.main_task.cancel())
+    yate.run(worker_main)
+
+
+class YateSupervisor:
+    """
+    Runs the handlers of an external module in several worker processes, each with its own connection to yate
+    in TCP or Unix socket mode, so they make use of more than one CPU core. Handlers are registered once on the
+    supervisor before it starts. Every registration is assigned to one worker, spreading the installs across
+    them, so messages of different names are handled in parallel. Yate hands a message to one handler after the
+    other, so a name installed by several workers would not be handled in parallel anyway. Watches can also be
+    registered in all workers with worker=ALL_WORKERS.
+
+    Workers that end are started again, with an exponential backoff if they keep failing right away. The
+    stats of all workers are reported to the supervisor and summed up in stats.
+    """
+    ALL_WORKERS = "all"
+
+    def __init__(self, worker_count, host=None, port=None, sockpath=None, stats_interval=1.0, restart_delay=0.1,
+                 max_restart_delay=30.0, mp_context=None):
+        if host is not None:
+            self._connection_args = {"host": host, "port": port}
+        elif sockpath is not None:
+            self._connection_args = {"sockpath": sockpath}
+        else:
+            raise ValueError("Worker processes need a TCP or Unix socket connection to yate")
+        self.workers = [WorkerProcess(index) for index in range(worker_count)]
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self._mp_context = mp_context or multiprocessing.get_context()
+        self._application_main = None
+        self._worker_stats = {}
+        self._restarts = {}
+        self._running = False
+        # counters of the supervisor itself, e.g. stats["worker_restarts"]
+        self.own_stats = Counter()
+
+    def register_message_handler(self, message, callback, priority=100, filter_attribute=None, filter_value=None,
+                                 worker=None, **options):
+        """
+        Register a message handler in one worker, see YateAsync.register_message_handler for the arguments.
+        The callback has to be picklable, unless workers are forked.
+
+        :param worker: Index of the worker to install the handler in, or None for the worker with the fewest
+                       registrations.
+        """
+        self._add_registration(HandlerRegistration.for_message(message, callback, priority, filter_attribute,
+                                                               filter_value, **options), worker)
+
+    def register_watch_handler(self, message, callback, worker=None):
+        """
+        Register a watch handler in one worker, or in all of them with worker=ALL_WORKERS.
+        """
+        self._add_registration(HandlerRegistration.for_watch(message, callback), worker)
+
+    def _add_registration(self, registration, worker):
+        if self._running:
+            raise RuntimeError("Handlers have to be registered before the workers are started")
+        if worker == self.ALL_WORKERS:
+            if not registration.watch:
+                raise ValueError("Yate passes a message to one handler after the other, install it in one worker")
+            workers = self.workers
+        elif worker is None:
+            workers = [min(self.workers, key=lambda w: len(w.registrations))]
+        else:
+            workers = [self.workers[worker]]
+        for worker_process in workers:
+            worker_process.registrations.append(registration)
+
+    @property
+    def stats(self):
+        """
+        Sum of the most recently reported stats of all workers.
+        """
+        total = Counter()
+        for worker_stats in self._worker_stats.values():
+            total.update(worker_stats)
+        return total
+
+    def start(self, application_main=None):
+        """
+        Start all workers.
+
+        :param application_main: Optional coroutine function run in every worker once its handlers are
+                                 registered, called with the YateAsync instance and the index of the worker.
+        """
+        self._application_main = application_main
+        self._running = True
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def _start_worker(self, worker):
+        receiving, sending = self._mp_context.Pipe(duplex=False)
+        worker.process = self._mp_context.Process(
+            target=_run_worker, name="yate-worker-{}".format(worker.index),
+            args=(worker.index, self._connection_args, worker.registrations, self._application_main, sending,
+                  self.stats_interval))
+        worker.process.start()
+        sending.close()
+        worker.stats_connection = receiving
+        worker.started = time.monotonic()
+
+    def supervise(self, timeout=None):
+        """
+        Process the stats reports of the workers and start ended workers again. Waits at most timeout seconds
+        for something to happen.
+        """
+        now = time.monotonic()
+        waiting_for = []
+        for worker in self.workers:
+            if worker.process is None:
+                restart_at = self._restarts[worker.index]
+                if restart_at <= now:
+                    del self._restarts[worker.index]
+                    self._start_worker(worker)
+                else:
+                    timeout = restart_at - now if timeout is None else min(timeout, restart_at - now)
+                    continue
+            waiting_for.append(worker.process.sentinel)
+            waiting_for.append(worker.stats_connection)
+
+        for ready in multiprocessing.connection.wait(waiting_for, timeout):
+            for worker in self.workers:
+                if ready is worker.stats_connection:
+                    self._receive_stats(worker)
+        for worker in self.workers:
+            if worker.process is not None and not worker.process.is_alive():
+                self._worker_ended(worker)
+
+    def _receive_stats(self, worker):
+        try:
+            while worker.stats_connection.poll():
+                self._worker_stats[worker.index] = worker.stats_connection.recv()
+        except (EOFError, OSError):
+            pass
+
+    def _worker_ended(self, worker):
+        self._receive_stats(worker)
+        worker.stats_connection.close()
+        lifetime = time.monotonic() - worker.started
+        worker.failures = 0 if lifetime > self.max_restart_delay else worker.failures + 1
+        delay = min(self.restart_delay * 2 ** max(worker.failures - 1, 0), self.max_restart_delay)
+        logger.warning("Worker %d ended with exit code %s, starting it again in %.1f seconds",
+                       worker.index, worker.process.exitcode, delay)
+        worker.process = None
+        self.own_stats["worker_restarts"] += 1
+        self._restarts[worker.index] = time.monotonic() + delay
+
+    def stop(self):
+        """
+        Terminate all workers.
+        """
+        self._running = False
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join()
+                worker.stats_connection.close()
+                worker.process = None
+        self._restarts.clear()
+
+    def run(self, application_main=None):
+        """
+        Start the workers and supervise them until we receive SIGINT or SIGTERM.
+        """
+        run_until_signalled(lambda: self.start(application_main), self.supervise, self.stop)
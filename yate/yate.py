@@ -1,43 +1,189 @@
+import bisect
+import heapq
 import logging
-import random
-import string
 import time
+from collections import Counter
 
-from yate.protocol import parse_yate_message, InstallRequest, UninstallRequest, WatchRequest, UnwatchRequest, ConnectToYate, SetLocalRequest
+from yate.protocol import (parse_yate_message, InstallRequest, UninstallRequest, WatchRequest, UnwatchRequest,
+                           ConnectToYate, SetLocalRequest, Message, InstallConfirm, UninstallConfirm, WatchConfirm,
+                           UnwatchConfirm, SetLocalAnswer)
 
 logger = logging.getLogger("yate")
 
 
 class MessageHandler:
+    __slots__ = ("message", "priority", "callback", "filter_attribute", "filter_value", "done_callback")
+
     def __init__(self, msg, prio, callback, filter_attribute, filter_value, done_callback=None):
         self.message = msg
         self.priority = prio
         self.callback = callback
         self.filter_attribute = filter_attribute
-        self.filter_value = filter_value
-        self.installed = False
-        self.uninstalled = False
+        self.filter_value = None if filter_attribute is None else str(filter_value)
         self.done_callback = done_callback
 
 
 class MessageRequest:
-    def __init__(self, message_object, id, timestamp, callback):
+    __slots__ = ("msg", "id", "timestamp", "callback", "deadline")
+
+    def __init__(self, message_object, id, timestamp, callback, deadline=None):
         self.msg = message_object
         self.id = id
         self.timestamp = timestamp
         self.callback = callback
+        self.deadline = deadline
+
+
+class YateRequestTimeoutError(TimeoutError):
+    """
+    Yate did not answer a message we sent within its timeout.
+    """
+    pass
+
+
+class YateConnectionLostError(ConnectionError):
+    """
+    The connection to yate was lost before it answered a message we sent.
+    """
+    pass
 
 
 class WatchHandler:
-    def __init__(self, msg, callback, done_callback=None):
+    __slots__ = ("message", "priority", "callback", "filter_attribute", "filter_value", "done_callback")
+
+    def __init__(self, msg, callback, done_callback=None, priority=100, filter_attribute=None, filter_value=None):
         self.message = msg
+        self.priority = priority
         self.callback = callback
+        self.filter_attribute = filter_attribute
+        self.filter_value = None if filter_attribute is None else str(filter_value)
+        self.done_callback = done_callback
+
+
+def _handler_priority(handler):
+    return handler.priority
+
+
+class HandlerGroup:
+    """
+    All handlers registered for one message name, sharing a single install (or watch) in yate.
+    """
+    __slots__ = ("message", "priority", "filter_attribute", "filter_value", "install", "installed",
+                 "install_requested", "uninstalled", "handlers", "_unfiltered", "_filtered")
+
+    def __init__(self, message, priority=100, filter_attribute=None, filter_value=None, install=True):
+        self.message = message
+        # priority and filter of the install in yate
+        self.priority = priority
+        self.filter_attribute = filter_attribute
+        self.filter_value = None if filter_attribute is None else str(filter_value)
+        # False while all handlers were registered without installing them in yate
+        self.install = install
         self.installed = False
+        self.install_requested = False
         self.uninstalled = False
-        self.done_callback = done_callback
+        # insertion ordered set of all handlers of this group
+        self.handlers = {}
+        self._unfiltered = []
+        self._filtered = {}
+
+    def add(self, handler):
+        self.handlers[handler] = None
+        if handler.filter_attribute is None:
+            handlers = self._unfiltered
+        else:
+            by_value = self._filtered.setdefault(handler.filter_attribute, {})
+            handlers = by_value.setdefault(handler.filter_value, [])
+        # keeps handlers of the same priority in registration order
+        bisect.insort(handlers, handler, key=_handler_priority)
+
+    def remove(self, handler):
+        del self.handlers[handler]
+        if handler.filter_attribute is None:
+            self._unfiltered.remove(handler)
+            return
+        by_value = self._filtered[handler.filter_attribute]
+        handlers = by_value[handler.filter_value]
+        handlers.remove(handler)
+        if not handlers:
+            del by_value[handler.filter_value]
+            if not by_value:
+                del self._filtered[handler.filter_attribute]
+
+    def remove_callback(self, callback=None):
+        """
+        Remove all handlers calling callback (or wrapping it), or every handler if callback is None.
+        """
+        for handler in list(self.handlers):
+            if callback is None or handler.callback == callback or \
+                    getattr(handler.callback, "__wrapped__", None) == callback:
+                self.remove(handler)
+
+    def matching_handlers(self, msg):
+        """
+        Return the handlers that match msg, in order of their priority.
+        """
+        if self.filter_attribute is not None:
+            # all handlers share the filter of the install, yate already applied it
+            return self._filtered.get(self.filter_attribute, {}).get(self.filter_value, ())
+        handlers = self._unfiltered
+        for attribute, by_value in self._filtered.items():
+            matches = by_value.get(msg.params.get(attribute))
+            if matches:
+                handlers = sorted(handlers + matches, key=_handler_priority) if handlers else matches
+        return handlers
+
+    def pop_done_callbacks(self):
+        callbacks = [handler.done_callback for handler in self.handlers if handler.done_callback is not None]
+        for handler in self.handlers:
+            handler.done_callback = None
+        return callbacks
+
+
+class MessageRouter:
+    """
+    Handler callback passing each message to the route registered for the value(s) of attributes, e.g. a channel id.
+    Messages without a route go to default, or are answered as not processed.
+    """
+    __slots__ = ("attributes", "default", "_routes", "_key")
+
+    def __init__(self, *attributes, default=None):
+        if not attributes:
+            raise ValueError("A MessageRouter needs at least one parameter to route by")
+        self.attributes = attributes
+        self.default = default
+        self._routes = {}
+        if len(attributes) == 1:
+            attribute = attributes[0]
+            self._key = lambda params: params.get(attribute)
+        else:
+            self._key = lambda params: tuple(params.get(attribute) for attribute in attributes)
+
+    def add(self, key, callback):
+        self._routes[key] = callback
+
+    def discard(self, key):
+        self._routes.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._routes
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __call__(self, msg):
+        callback = self._routes.get(self._key(msg.params))
+        if callback is None:
+            callback = self.default
+            if callback is None:
+                return False
+        return callback(msg)
 
 
 def session_id_generator():
+    # only needed once per connection, random would add to the import time of every IVR script
+    import random
+    import string
     return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(6))
 
 
@@ -46,62 +192,202 @@ class YateBase:
         self._message_handlers = {}
         self._watch_handlers = {}
         self._requested_messages = {}
+        # min-heap of (deadline, msg_id) for pending requests with a timeout. Answered requests are not removed
+        # from it, they are skipped on expiry or dropped when it is rebuilt.
+        self._request_deadlines = []
+        # default timeout in seconds for requests sent with send_message, None waits forever
+        self.request_timeout = None
         self._local_params = {}
         self._local_param_handlers = {}
+        # local parameters we set, replayed on a new connection
+        self._local_settings = {}
         self._msg_id = 1
         self._session_id = session_id_generator()
+        # counters for monitoring, e.g. stats["parse_errors"] for incoming lines that could not be parsed
+        self.stats = Counter()
+        self._dispatch_table = self._create_dispatch_table()
+
+    def _create_dispatch_table(self):
+        """
+        Map the class of every message yate sends us to the method handling it.
+        """
+        return {
+            Message: self._handle_yate_message,
+            InstallConfirm: self._handle_yate_install,
+            UninstallConfirm: self._handle_yate_uninstall,
+            WatchConfirm: self._handle_yate_watch,
+            UnwatchConfirm: self._handle_yate_unwatch,
+            SetLocalAnswer: self._handle_yate_setlocal,
+        }
 
     def send_connect(self):
         msg = ConnectToYate()
         self._send_message_raw(msg.encode())
 
     def register_message_handler(self, message, callback, priority=100, filter_attribute=None, filter_value=None,
-                                 install=True, done_callback=None):
+                                 install=True, done_callback=None, yate_filter=True):
+        """
+        Register callback for message, handlers of one name share an install and run in order of priority.
+        Pass yate_filter=False for handlers registered per channel, to not install their filter in yate.
+        """
         handler = MessageHandler(message, priority, callback, filter_attribute, filter_value, done_callback)
-        self._message_handlers[message] = handler
-        if install:
-            install_msg = InstallRequest(priority, message, filter_attribute, filter_value)
-            self._send_message_raw(install_msg.encode())
-
-    def unregister_message_handler(self, message):
-        if message not in self._message_handlers:
+        group = self._message_handlers.get(message)
+        if group is None:
+            if not yate_filter:
+                filter_attribute = filter_value = None
+            group = HandlerGroup(message, priority, filter_attribute, filter_value, install)
+            self._message_handlers[message] = group
+            group.add(handler)
+            if install:
+                self._send_install(group)
+            return
+        group.add(handler)
+        replace_install = False
+        if install and not group.install:
+            # handlers registered without installing them do not decide the priority of the install
+            group.priority = priority
+            group.install = True
+        elif install and priority < group.priority:
+            # yate has to pass the message to us before any handler of a lower priority than ours
+            group.priority = priority
+            replace_install = True
+        if group.filter_attribute is not None and (group.filter_attribute, group.filter_value) != \
+                (handler.filter_attribute, handler.filter_value):
+            # the install in yate only passes the messages of the first filter. Replace it by an unfiltered one.
+            group.filter_attribute = group.filter_value = None
+            replace_install = True
+        if replace_install and (group.installed or group.install_requested):
+            # the install is sent again once yate confirms the uninstall
+            self._send_uninstall(group)
+        elif group.installed:
+            handler.done_callback = None
+            if done_callback is not None:
+                done_callback(True)
+        elif install and not group.install_requested and not group.uninstalled:
+            self._send_install(group)
+
+    def unregister_message_handler(self, message, callback=None):
+        """
+        Unregister the handlers of message that call callback, or all of them if callback is None.
+        """
+        group = self._message_handlers.get(message)
+        if group is None:
             return
-        handler = self._message_handlers[message]
-        if handler.installed:
-            uninstall_msg = UninstallRequest(message)
-            self._send_message_raw(uninstall_msg.encode())
-            handler.uninstalled = True
+        group.remove_callback(callback)
+        if group.handlers:
+            return
+        if group.installed or group.install_requested:
+            self._send_uninstall(group)
         else:
             # if it was never installed - well just remove it from the registry
             del self._message_handlers[message]
 
-    def register_watch_handler(self, message, callback, done_callback=None):
-        handler = WatchHandler(message, callback, done_callback)
-        self._watch_handlers[message] = handler
-        watch_msg = WatchRequest(message)
-        self._send_message_raw(watch_msg.encode())
+    def _send_install(self, group):
+        install_msg = InstallRequest(group.priority, group.message, group.filter_attribute, group.filter_value)
+        self._send_message_raw(install_msg.encode())
+        group.install_requested = True
 
-    def unregister_watch_handler(self, message):
-        if message not in self._watch_handlers:
+    def _send_uninstall(self, group):
+        if group.uninstalled:
+            return
+        uninstall_msg = UninstallRequest(group.message)
+        self._send_message_raw(uninstall_msg.encode())
+        group.uninstalled = True
+
+    def register_watch_handler(self, message, callback, done_callback=None, priority=100, filter_attribute=None,
+                               filter_value=None):
+        """
+        Register callback for processed messages with the given name, or for all messages if message is empty.
+        """
+        handler = WatchHandler(message, callback, done_callback, priority, filter_attribute, filter_value)
+        group = self._watch_handlers.get(message)
+        if group is None:
+            group = HandlerGroup(message)
+            self._watch_handlers[message] = group
+        group.add(handler)
+        if group.installed:
+            handler.done_callback = None
+            if done_callback is not None:
+                done_callback(True)
+        elif not group.install_requested and not group.uninstalled:
+            watch_msg = WatchRequest(message)
+            self._send_message_raw(watch_msg.encode())
+            group.install_requested = True
+
+    def unregister_watch_handler(self, message, callback=None):
+        """
+        Unregister the watch handlers of message that call callback, or all of them if callback is None.
+        """
+        group = self._watch_handlers.get(message)
+        if group is None:
             return
-        handler = self._watch_handlers[message]
-        if handler.installed:
-            unwatch_msg = UnwatchRequest(message)
-            self._send_message_raw(unwatch_msg.encode())
-            handler.uninstalled = True
+        group.remove_callback(callback)
+        if group.handlers:
+            return
+        if group.installed or group.install_requested:
+            if not group.uninstalled:
+                unwatch_msg = UnwatchRequest(message)
+                self._send_message_raw(unwatch_msg.encode())
+                group.uninstalled = True
         else:
             del self._watch_handlers[message]
 
     def set_local(self, param, value, done_callback=None):
         if done_callback is not None:
             self._local_param_handlers[param] = done_callback
+        if value:
+            self._local_settings[param] = value
         setlocal_msg = SetLocalRequest(param, value)
         self._send_message_raw(setlocal_msg.encode())
 
     def get_local(self, param):
         return self._local_params.get(param)
 
-    def send_message(self, msg, callback=None, fire_and_forget=False):
+    def replay_registrations(self):
+        """
+        Send local parameters, installs and watches again on a new connection after the old one was lost.
+        """
+        for param, value in self._local_settings.items():
+            self._send_message_raw(SetLocalRequest(param, value).encode())
+        for param in self._local_param_handlers:
+            if param not in self._local_settings:
+                self._send_message_raw(SetLocalRequest(param, "").encode())
+        for registry in (self._message_handlers, self._watch_handlers):
+            for name, group in list(registry.items()):
+                group.installed = group.install_requested = group.uninstalled = False
+                if not group.handlers:
+                    del registry[name]
+        for group in self._message_handlers.values():
+            if group.install:
+                self._send_install(group)
+        for group in self._watch_handlers.values():
+            self._send_message_raw(WatchRequest(group.message).encode())
+            group.install_requested = True
+
+    def fail_pending_requests(self):
+        """
+        Call the callbacks of all pending requests with a YateConnectionLostError after the connection was lost.
+        """
+        requests = self._requested_messages
+        self._requested_messages = {}
+        self._request_deadlines = []
+        for req in requests.values():
+            self.stats["failed_requests"] += 1
+            if req.callback is not None:
+                req.callback(req.msg, YateConnectionLostError(
+                    "Lost the connection to yate before it answered {}".format(req.msg.name)))
+
+    def resend_pending_requests(self):
+        """
+        Send all requests waiting for an answer again, with their original id and timeout.
+        """
+        for req in self._requested_messages.values():
+            self._send_message_raw(req.msg.encode(req.id, req.timestamp))
+
+    def send_message(self, msg, callback=None, fire_and_forget=False, timeout=None):
+        """
+        Send msg to yate, callback gets the answer, None after timeout or a YateConnectionLostError.
+        """
         msg_id = self._msg_id
         self._msg_id = self._msg_id + 1
         timestamp = self._get_timestamp()
@@ -111,46 +397,96 @@ class YateBase:
         self._send_message_raw(raw_message)
 
         if not fire_and_forget:
-            req = MessageRequest(msg, msg_id_str, timestamp, callback)
+            if timeout is None:
+                timeout = self.request_timeout
+            deadline = None if timeout is None else self._get_monotonic_time() + timeout
+            req = MessageRequest(msg, msg_id_str, timestamp, callback, deadline)
             self._requested_messages[msg_id_str] = req
+            if deadline is not None:
+                heapq.heappush(self._request_deadlines, (deadline, msg_id_str))
+                self._request_deadline_added(deadline)
+
+    def expire_requests(self):
+        """
+        Call the callbacks of timed out requests with None, return the earliest remaining deadline or None.
+        """
+        now = self._get_monotonic_time()
+        deadlines = self._request_deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _deadline, msg_id = heapq.heappop(deadlines)
+            req = self._requested_messages.pop(msg_id, None)
+            if req is None:
+                # answered in time
+                continue
+            self.stats["expired_requests"] += 1
+            logger.warning("Yate did not answer message %s (%s) in time", msg_id, req.msg.name)
+            if req.callback is not None:
+                req.callback(req.msg, None)
+        return deadlines[0][0] if deadlines else None
+
+    def _forget_request_deadlines(self):
+        # drop the deadlines of answered requests once they make up most of the heap
+        if len(self._request_deadlines) > 2 * len(self._requested_messages) + 64:
+            self._request_deadlines = [(req.deadline, msg_id) for msg_id, req in self._requested_messages.items()
+                                       if req.deadline is not None]
+            heapq.heapify(self._request_deadlines)
+
+    def _request_deadline_added(self, deadline):
+        # Called for every request with a timeout, implementations make sure expire_requests is called by then
+        pass
 
     def answer_message(self, msg, processed):
         raw_message = msg.encode_answer_for_yate(processed)
         self._send_message_raw(raw_message)
 
     def _handle_yate_install(self, msg):
-        handler = self._message_handlers.get(msg.name)
-        if handler is None:
+        group = self._message_handlers.get(msg.name)
+        if group is None:
             logger.warning("Yate notified us that a handler for {} is installed though we didn't request it".format(msg.name))
             return
+        group.install_requested = False
         if msg.success:
-            handler.installed = True
-        if handler.done_callback is not None:
-            handler.done_callback(msg.success)
+            group.installed = True
+        for done_callback in group.pop_done_callbacks():
+            done_callback(msg.success)
 
     def _handle_yate_uninstall(self, msg):
-        handler = self._message_handlers.get(msg.name)
-        if handler is None:
+        group = self._message_handlers.get(msg.name)
+        if group is None:
             logger.warning("Yate notified us that a handler for {} is uninstalled though we didn't request it".format(msg.name))
             return
-        del self._message_handlers[msg.name]
+        group.installed = False
+        group.uninstalled = False
+        if group.handlers:
+            # handlers were registered again while uninstalling or the install is replaced by an unfiltered one
+            self._send_install(group)
+        else:
+            del self._message_handlers[msg.name]
 
     def _handle_yate_watch(self, msg):
-        handler = self._watch_handlers.get(msg.name)
-        if handler is None:
+        group = self._watch_handlers.get(msg.name)
+        if group is None:
             logger.warning("Yate notified us that{} is watched though we didn't request it".format(msg.name))
             return
+        group.install_requested = False
         if msg.success:
-            handler.installed = True
-        if handler.done_callback is not None:
-            handler.done_callback(msg.success)
+            group.installed = True
+        for done_callback in group.pop_done_callbacks():
+            done_callback(msg.success)
 
     def _handle_yate_unwatch(self, msg):
-        handler = self._watch_handlers.get(msg.name)
-        if handler is None:
+        group = self._watch_handlers.get(msg.name)
+        if group is None:
             logger.warning("Yate notified us that {} is not watched anymore though we didn't request it".format(msg.name))
             return
-        del self._watch_handlers[msg.name]
+        group.installed = False
+        group.uninstalled = False
+        if group.handlers:
+            # watch handlers were registered again while unwatching
+            self._send_message_raw(WatchRequest(msg.name).encode())
+            group.install_requested = True
+        else:
+            del self._watch_handlers[msg.name]
 
     def _handle_yate_setlocal(self, msg):
         self._local_params[msg.param] = msg.value
@@ -160,37 +496,51 @@ class YateBase:
 
     def _handle_yate_message(self, msg):
         if msg.reply is False:
-            handler = self._message_handlers.get(msg.name)
-            if handler is None:
+            group = self._message_handlers.get(msg.name)
+            if group is None:
                 logger.warning("Yate sent us a message we did not subscribe for: {}".format(msg.name))
                 # in order to keep normal event processing, just ack and explain we did not process it
                 self.answer_message(msg, False)
                 return
-            result = handler.callback(msg)
-            # handlers can return true or false if they want us to automatically answer the message
-            if result is not None:
-                self.answer_message(msg, result)
+            # copied as handlers may unregister themselves
+            for handler in tuple(group.matching_handlers(msg)):
+                result = handler.callback(msg)
+                # handlers return None if they answer the message on their own, True if they processed it and
+                # False to pass it on to the next handler
+                if result is None:
+                    return
+                if result:
+                    self.answer_message(msg, True)
+                    return
+            self.answer_message(msg, False)
         else:
             req = self._requested_messages.get(msg.id)
             if req is None:
                 # this might be a watched message type
-                handler = self._watch_handlers.get(msg.name)
-                if handler is None:
+                group = self._watch_handlers.get(msg.name)
+                if group is None:
                     # maybe there is a watch handler for everything
-                    handler = self._watch_handlers.get("")
-                    if handler is None:
+                    group = self._watch_handlers.get("")
+                    if group is None:
                         # this is probably caused by fire and forget mode
                         logger.debug("Got unprocessed message of type {}".format(msg.name))
                         return
-                handler.callback(msg)
+                for handler in tuple(group.matching_handlers(msg)):
+                    handler.callback(msg)
             else:
-                req.callback(req.msg, msg)
                 del self._requested_messages[msg.id]
+                if req.deadline is not None:
+                    self._forget_request_deadlines()
+                req.callback(req.msg, msg)
 
     def _get_timestamp(self):
         # This function exists mostly for test mocking
         return int(time.time())
 
+    def _get_monotonic_time(self):
+        # Clock for request timeouts, exists for test mocking as well
+        return time.monotonic()
+
     def _send_message_raw(self, msg):
         pass
 
@@ -198,7 +548,9 @@ class YateBase:
         try:
             message = parse_yate_message(raw_data)
         except Exception as e:
-            logging.error("Incoming yate message did not parse: {}".format(str(e)))
+            self.stats["parse_errors"] += 1
+            logger.error("Incoming yate message did not parse: %s", e)
             return  # for now ignore messages with parsing errors
-        if hasattr(self, "_handle_yate_{}".format(message.msg_type)):
-            getattr(self, "_handle_yate_{}".format(message.msg_type))(message)
+        handler = self._dispatch_table.get(type(message))
+        if handler is not None:
+            handler(message)